@@ -14,8 +14,12 @@ from odin import (
     _OdinDetector,
     _PluginConfig,
     DETECTOR_CHOICES,
+    OdinCapacityBudget,
+    OdinHostTopology,
 )
 from plugins import (
+    BloscCompression,
+    LiveViewSettings,
     _BloscPlugin,
     _DatasetCreationPlugin,
     _FileWriterPlugin,
@@ -32,6 +36,7 @@ from util import (
     debug_print,
     expand_template_file,
 )
+from sizing import DEFAULT_BUFFER_SECONDS
 
 debug_print("Arc: = \n{}\n{}".format(OdinPaths.ARC_TOOL, OdinPaths.ARC_PYTHON), 1)
 
@@ -58,10 +63,11 @@ class ArcDimensions:
         super_module_count=6
 
 
-        self.fem_count = (
+        # int, as math.ceil returns a float under python 2
+        self.fem_count = int(
             math.ceil(
                 super_module_count
-                / (self.FEM_SUPER_MODULES_PER_FEM_X * self.FEM_SUPER_MODULES_PER_FEM_Y)
+                / float(self.FEM_SUPER_MODULES_PER_FEM_X * self.FEM_SUPER_MODULES_PER_FEM_Y)
             )
         )
 
@@ -94,8 +100,10 @@ class _ArcProcessPlugin(_DatasetCreationPlugin):
         ]
         super(_ArcProcessPlugin, self).__init__(None)
 
-    def create_extra_config_entries(self, rank, total):
-        entries = super(_ArcProcessPlugin, self).create_extra_config_entries(self, rank)
+    def create_extra_config_entries(self, rank, total, chunks=None):
+        entries = super(_ArcProcessPlugin, self).create_extra_config_entries(
+            rank, total, chunks
+        )
         dimensions_entry = {
             self.NAME: {
                 "width": self.dims.x_pixels,
@@ -165,14 +173,24 @@ class _ArcPluginConfig(_PluginConfig):
     # Class to define the standard set of plugins that an Arc Detector uses
     AutoInstantiate = True
 
-    def __init__(self, dims=ArcDimensions(12)):
+    def __init__(self, dims=ArcDimensions(12), COMPRESSION=None, LIVE_VIEW=None):
         arc = _ArcProcessPlugin(dims.fem_count)
         offset = _OffsetAdjustmentPlugin(source=arc)
         uid = _UIDAdjustmentPlugin(source=offset)
         sum = _SumPlugin(source=uid)
         # gap = _ArcGapFillPlugin(source=sum, dims=dims)
-        view = _LiveViewPlugin(source=sum)
-        hdf = _FileWriterPlugin(source=sum)
+        # Frames are only compressed if compression parameters are given
+        blosc = None
+        if COMPRESSION is not None:
+            blosc = _BloscPlugin(source=sum, settings=COMPRESSION.settings)
+        view_source = sum
+        if LIVE_VIEW is not None and LIVE_VIEW.COMPRESSED:
+            if blosc is None:
+                raise ValueError("Compressed live view needs COMPRESSION parameters")
+            view_source = blosc
+        view = _LiveViewPlugin(source=view_source,
+                               settings=LIVE_VIEW.settings if LIVE_VIEW is not None else None)
+        hdf = _FileWriterPlugin(source=blosc or sum)
         super(_ArcPluginConfig, self).__init__(
             PLUGIN_1=arc,
             PLUGIN_3=offset,
@@ -180,12 +198,27 @@ class _ArcPluginConfig(_PluginConfig):
             PLUGIN_5=sum,
             PLUGIN_6=view,
             PLUGIN_7=hdf,
+            PLUGIN_8=blosc,
             # PLUGIN_5=gap,
-            # PLUGIN_7=blosc,
         )
 
-        # Set the modes
-        self.modes = ["compression", "no_compression"]
+        profiles = COMPRESSION.profiles if COMPRESSION is not None else []
+
+        # Set the modes - there is no compression mode without compression parameters
+        self.modes = ["no_compression"]
+        if blosc is not None:
+            self.modes = ["compression", "no_compression"] + [name for name, _ in profiles]
+
+        # Create the compression mode chain and a chain for each compression profile
+        if blosc is not None:
+            for mode, settings in [("compression", None)] + profiles:
+                arc.add_mode(mode)
+                offset.add_mode(mode, source=arc)
+                uid.add_mode(mode, source=offset)
+                sum.add_mode(mode, source=uid)
+                view.add_mode(mode, source=view_source)
+                blosc.add_mode(mode, source=sum, settings=settings)
+                hdf.add_mode(mode, source=blosc)
 
         # Now we need to create the no compression mode chain (no blosc in the chain)
         arc.add_mode("no_compression")
@@ -198,6 +231,7 @@ class _ArcPluginConfig(_PluginConfig):
 
     def detector_setup(self, od_args):
         # Make an instance of our template
+        od_args.update(self.mode_macros())
         makeTemplateInstance(_ArcModeTemplate, locals(), od_args)
 
 
@@ -206,6 +240,9 @@ class ArcOdinDataServer(_OdinDataServer):
     """Store configuration for an ArcOdinDataServer"""
 
     PLUGIN_CONFIG = None
+    # SUPER_MODULES, COMPRESSION and LIVE_VIEW the shared PLUGIN_CONFIG was created with
+    PLUGIN_SETTINGS = None
+    DEFAULT_BIT_DEPTH = 12
 
     # TODO TODO In reality the Arc Server will have 4 FEM DEST NICs
     # so this class needs 4 sets of FEM details added OR the builder
@@ -226,20 +263,46 @@ class ArcOdinDataServer(_OdinDataServer):
         SUPER_MODULES=2,
         SHARED_MEM_SIZE=1048576000,
         PLUGIN_CONFIG=None,
-        BASE_UDP_PORT=61000
+        BASE_UDP_PORT=61000,
+        FRAME_RATE=0,
+        BIT_DEPTH=0,
+        BUFFER_SECONDS=DEFAULT_BUFFER_SECONDS,
+        SHM_AVAILABLE=0,
+        TOPOLOGY=None,
+        BUDGET=None,
+        COMPRESSION=None,
+        HUGE_PAGES=False,
+        LIVE_VIEW=None,
     ):
         self.sensor = "Arc {} FEM".format(SUPER_MODULES)
         dims = ArcDimensions(SUPER_MODULES)
         if PLUGIN_CONFIG is None:
             if ArcOdinDataServer.PLUGIN_CONFIG is None:
                 # Create the standard Arc plugin config
-                ArcOdinDataServer.PLUGIN_CONFIG = _ArcPluginConfig(dims)
+                ArcOdinDataServer.PLUGIN_CONFIG = _ArcPluginConfig(dims, COMPRESSION, LIVE_VIEW)
+                ArcOdinDataServer.PLUGIN_SETTINGS = (SUPER_MODULES, COMPRESSION, LIVE_VIEW)
+            elif ArcOdinDataServer.PLUGIN_SETTINGS != (SUPER_MODULES, COMPRESSION, LIVE_VIEW):
+                # Every server shares the plugin config, and the modes of the Mode PV
+                raise ValueError(
+                    "ArcOdinDataServer {} has different SUPER_MODULES, COMPRESSION or LIVE_VIEW "
+                    "to the first server - give every server the same settings".format(IP)
+                )
 
         # Update attributes with parameters
         self.__dict__.update(locals())
 
         self.__super.__init__(
-            IP, PROCESSES, SHARED_MEM_SIZE, ArcOdinDataServer.PLUGIN_CONFIG
+            IP,
+            PROCESSES,
+            SHARED_MEM_SIZE,
+            ArcOdinDataServer.PLUGIN_CONFIG,
+            FRAME_RATE=FRAME_RATE,
+            BIT_DEPTH=BIT_DEPTH,
+            BUFFER_SECONDS=BUFFER_SECONDS,
+            SHM_AVAILABLE=SHM_AVAILABLE,
+            TOPOLOGY=TOPOLOGY,
+            BUDGET=BUDGET,
+            HUGE_PAGES=HUGE_PAGES,
         )
 
     ArgInfo = makeArgInfo(
@@ -262,9 +325,36 @@ class ArcOdinDataServer(_OdinDataServer):
         SHARED_MEM_SIZE=Simple("Size of shared memory buffers in bytes", int),
         PLUGIN_CONFIG=Ident("Define a custom set of plugins", _PluginConfig),
         BASE_UDP_PORT=Simple("Starting UDP Port for first FEM", int),
+        FRAME_RATE=Simple(
+            "Detector frame rate (Hz) - if set, SHARED_MEM_SIZE is derived "
+            "from the sensor geometry and this rate",
+            float,
+        ),
+        BIT_DEPTH=Simple("Bit depth of frames, for shared memory sizing (0 -> 12)", int),
+        BUFFER_SECONDS=Simple(
+            "Seconds of backlog each FrameReceiver buffer should absorb", float
+        ),
+        SHM_AVAILABLE=Simple(
+            "Size of /dev/shm on this server in bytes, to check buffers fit "
+            "(0 -> check local /dev/shm if IP is local)",
+            int,
+        ),
+        TOPOLOGY=Ident("Host topology for core placement", OdinHostTopology),
+        BUDGET=Ident(
+            "Bandwidth budget to check FRAME_RATE against", OdinCapacityBudget
+        ),
+        COMPRESSION=Ident("Blosc parameters and compression modes", BloscCompression),
+        HUGE_PAGES=Simple(
+            "Back shared memory buffers with huge pages - /dev/shm must be mounted "
+            "with huge=",
+            bool,
+        ),
+        LIVE_VIEW=Ident("Live view rate and compression", LiveViewSettings),
     )
 
     def create_odin_data_process(self, server, ready, release, meta, buffer_size, buffer_idx, plugin_config):
+        # One port for each FEM
+        udp_port = self.allocate_udp_ports(self.BASE_UDP_PORT, self.dims.fem_count)
         process = _ArcOdinData(
             server,
             ready,
@@ -274,11 +364,13 @@ class ArcOdinDataServer(_OdinDataServer):
             buffer_idx,
             plugin_config,
             self.SUPER_MODULES,
-            self.BASE_UDP_PORT,
+            udp_port,
         )
-        self.BASE_UDP_PORT += 1
         return process
 
+    def frame_dimensions(self):
+        return self.dims.x_pixels, self.dims.y_pixels
+
 
 class ArcOdinControlServer(_OdinControlServer):
 
@@ -610,7 +702,7 @@ class _ArcGapFillPlugin(_FrameProcessorPlugin):
         self.chip_gap = CHIP_GAP
         self.module_gap = MODULE_GAP
 
-    def create_extra_config_entries(self, rank, total):
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
 
         chip_size = [
@@ -0,0 +1,137 @@
+from __future__ import division, print_function
+
+import sys
+
+from util import debug_print
+
+
+# Fraction of a budget above which a warning is printed
+WARNING_UTILISATION = 0.8
+# ZeroMQ guide rule of thumb - one IO thread per gigabyte per second in or out
+ZMQ_IO_THREAD_BYTES = 1e9
+MEGABYTE = 1e6
+GIGABIT = 1e9 / 8
+
+
+def check_budget(description, load, budget, scale, unit):
+    """Check a load against its budget, both in bytes per second
+
+    Raises ValueError if the load exceeds the budget and prints a warning if it is above
+    WARNING_UTILISATION of it. A budget of 0 is not checked.
+
+    """
+    if not budget:
+        return
+
+    message = "{} needs {:.2f} {unit} of {:.2f} {unit}".format(
+        description, load / scale, budget / scale, unit=unit
+    )
+    if load > budget:
+        raise ValueError(message + " available")
+    elif load > budget * WARNING_UTILISATION:
+        print("WARNING: {} ({:.0%})".format(message, load / budget), file=sys.stderr)
+
+
+class ProcessLoad(object):
+
+    """Data rates through one OdinData process"""
+
+    def __init__(self, server, process, total_processes):
+        self.server = server
+        self.rank = process.RANK
+        self.frame_rate = server.process_frame_rate(total_processes)
+        self.ingress = server.process_ingress(total_processes)
+        self.write = server.process_write(total_processes)
+        if self.frame_rate:
+            self.backlog = process.SHARED_MEM_SIZE / (server.frame_bytes() * self.frame_rate)
+        else:
+            self.backlog = None
+
+    def describe(self):
+        return "{} rank {}: {:.1f} Hz, {:.1f} MB/s in, {:.1f} MB/s written, {} backlog".format(
+            self.server.IP, self.rank, self.frame_rate, self.ingress / MEGABYTE,
+            self.write / MEGABYTE,
+            "{:.2f}s".format(self.backlog) if self.backlog is not None else "unknown"
+        )
+
+
+class CapacityPlan(object):
+
+    """Data rates through the hosts and processes of a set of OdinDataServers
+
+    Rates are derived from the detector rate each server is configured with and checked
+    against the OdinCapacityBudget of the server, if it has one. Servers sharing a host
+    share its data links and storage bandwidth.
+
+    """
+
+    def __init__(self, servers, total_processes):
+        self.processes = [
+            ProcessLoad(server, process, total_processes)
+            for server in servers
+            for process in server.processes
+            if server.process_ingress(total_processes)
+        ]
+        self.hosts = {}
+        for load in self.processes:
+            self.hosts.setdefault(load.server.IP, []).append(load)
+
+    def host_budget(self, ip):
+        for load in self.hosts[ip]:
+            if load.server.BUDGET is not None:
+                return load.server.BUDGET
+        return None
+
+    def report(self):
+        for ip in sorted(self.hosts):
+            loads = self.hosts[ip]
+            debug_print(
+                "{}: {:.2f} Gb/s in, {:.1f} MB/s written".format(
+                    ip,
+                    sum(load.ingress for load in loads) / GIGABIT,
+                    sum(load.write for load in loads) / MEGABYTE,
+                ),
+                1
+            )
+            for load in sorted(loads, key=lambda load: load.rank):
+                debug_print("  " + load.describe(), 1)
+
+    def check(self):
+        """Check every host and process is within its budget
+
+        Raises:
+            ValueError: If any budget is exceeded
+
+        """
+        for ip in sorted(self.hosts):
+            loads = self.hosts[ip]
+            budget = self.host_budget(ip)
+            if budget is not None:
+                check_budget(
+                    "Detector data into {}".format(ip),
+                    sum(load.ingress for load in loads),
+                    budget.LINK_SPEED * GIGABIT, GIGABIT, "Gb/s"
+                )
+                check_budget(
+                    "Writing to storage from {}".format(ip),
+                    sum(load.write for load in loads),
+                    budget.STORAGE_BANDWIDTH * MEGABYTE, MEGABYTE, "MB/s"
+                )
+
+            for load in loads:
+                server = load.server
+                if server.BUDGET is not None:
+                    check_budget(
+                        "OdinData rank {} on {}".format(load.rank, ip),
+                        load.ingress,
+                        server.BUDGET.PROCESS_BANDWIDTH * MEGABYTE, MEGABYTE, "MB/s"
+                    )
+                if server.ZMQ_INGRESS and load.ingress > server.IO_THREADS * ZMQ_IO_THREAD_BYTES:
+                    print(
+                        "WARNING: OdinData rank {} on {} receives {:.2f} GB/s with {} IO "
+                        "threads - consider IO_THREADS={}".format(
+                            load.rank, ip, load.ingress / 1e9, server.IO_THREADS,
+                            int(load.ingress // ZMQ_IO_THREAD_BYTES) + 1
+                        ),
+                        file=sys.stderr,
+                    )
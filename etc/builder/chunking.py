@@ -0,0 +1,161 @@
+from __future__ import division, print_function
+
+import sys
+
+from util import debug_print
+
+
+MEBIBYTE = 1024 * 1024
+# Target size of a chunk
+DEFAULT_CHUNK_BYTES = 2 * MEBIBYTE
+# Default HDF5 raw data chunk cache of a dataset. Chunks filled a frame at a time must fit,
+# or every partial write goes to disk
+DEFAULT_CHUNK_CACHE = MEBIBYTE
+DATATYPE_BYTES = {
+    "uint8": 1,
+    "uint16": 2,
+    "uint32": 4,
+    "uint64": 8,
+    "int8": 1,
+    "int16": 2,
+    "int32": 4,
+    "int64": 8,
+    "float32": 4,
+    "float64": 8,
+}
+
+
+def parse_overrides(overrides):
+    """Parse chunk overrides of the form "dataset:n[,n...];dataset:n[,n...]"
+
+    Returns:
+        dict: {dataset: [chunk dimensions]}
+
+    """
+    chunks = {}
+    for override in overrides.split(";"):
+        if not override.strip():
+            continue
+        try:
+            name, dims = override.split(":")
+            chunks[name.strip()] = [int(dim) for dim in dims.split(",")]
+        except ValueError:
+            raise ValueError(
+                "Invalid chunk override '{}' - expected dataset:n[,n...]".format(override)
+            )
+    return chunks
+
+
+def align_to_block(size, block_size):
+    """Return the largest size no greater than size that packs evenly into blocks
+
+    A size of at least one block is rounded down to a whole number of blocks, and a
+    smaller size to the largest power of two fraction of a block.
+
+    """
+    if not block_size:
+        return size
+    if size >= block_size:
+        return size - size % block_size
+    aligned = block_size
+    while aligned > size and aligned > 1:
+        aligned //= 2
+    return aligned
+
+
+class ChunkPlanner(object):
+
+    """Choose the chunk shape of each dataset a FrameProcessor writes
+
+    Image datasets (those with dims) are chunked by whole frames, so compressed frames can
+    be written directly as chunks. Uncompressed frames smaller than the target are stacked
+    into a chunk. Datasets of one value per frame are chunked to the target size, limited
+    to the chunk cache as they are filled a frame at a time. Event streams are written in
+    blocks of events, so keep the chunks of their plugin, or are chunked to the target size
+    without the cache limit. Planned chunks are aligned to the filesystem block size.
+
+    """
+
+    def __init__(self, chunk_bytes=DEFAULT_CHUNK_BYTES, block_size=0,
+                 chunk_cache=DEFAULT_CHUNK_CACHE, overrides=None):
+        self.chunk_bytes = chunk_bytes
+        self.block_size = block_size
+        self.chunk_cache = chunk_cache
+        self.overrides = overrides or {}
+
+    def partial_chunk_elements(self, itemsize):
+        """Return the elements in a chunk of a dataset written a frame at a time"""
+        size = align_to_block(min(self.chunk_bytes, self.chunk_cache), self.block_size)
+        return max(size // itemsize, 1)
+
+    def event_chunk_elements(self, itemsize):
+        """Return the elements in a chunk of an event stream, written in blocks of events"""
+        return max(align_to_block(self.chunk_bytes, self.block_size) // itemsize, 1)
+
+    def plan(self, dataset, frame_rate=0, event_rate=0, compressed=False):
+        """Return the chunks of a dataset and the rate they are written at
+
+        Args:
+            dataset(dict): DATASETS entry with name, datatype and optionally dims, chunks
+                and events (True if there is a value per event rather than per frame)
+            frame_rate(float): Frames written per second by this writer
+            event_rate(float): Events written per second by this writer
+            compressed(bool): Whether frames are compressed before writing
+
+        Returns:
+            tuple: (chunks, chunks per second or None if the rate is not known)
+
+        """
+        name = dataset["name"]
+        itemsize = DATATYPE_BYTES[dataset["datatype"]]
+        if "dims" in dataset:
+            dims = list(dataset["dims"])
+            frame_bytes = itemsize
+            for dim in dims:
+                frame_bytes *= dim
+            if compressed:
+                frames = 1
+            else:
+                frames = max(min(self.chunk_bytes, self.chunk_cache) // frame_bytes, 1)
+            chunks, rate = [frames] + dims, frame_rate
+        elif dataset.get("events"):
+            # Chunks fixed by the plugin match the blocks it writes events in
+            chunks = dataset.get("chunks") or [self.event_chunk_elements(itemsize)]
+            chunks, rate = list(chunks), event_rate
+        elif "chunks" not in dataset:
+            chunks, rate = [self.partial_chunk_elements(itemsize)], frame_rate
+        else:
+            # Fixed by the plugin and not a rate the planner knows
+            chunks, rate = list(dataset["chunks"]), 0
+
+        chunks = self.overrides.get(name, chunks)
+        return chunks, (rate / chunks[0] if rate else None)
+
+    def report(self, writer, planned, max_chunk_rate=0):
+        """Print the chunks of each dataset and the total chunk rate of a writer
+
+        Args:
+            writer(str): Description of the writer
+            planned(dict): {dataset: (chunks, chunks per second)}
+            max_chunk_rate(float): Chunks per second above which to warn (0 -> no limit)
+
+        """
+        total = 0
+        for name in sorted(planned):
+            chunks, rate = planned[name]
+            debug_print(
+                "{} {}: chunks {} ({})".format(
+                    writer, name, chunks,
+                    "{:.1f} chunks/s".format(rate) if rate is not None else "rate unknown"
+                ),
+                1
+            )
+            total += rate or 0
+
+        debug_print("{}: {:.1f} chunks/s".format(writer, total), 1)
+        if max_chunk_rate and total > max_chunk_rate:
+            print(
+                "WARNING: {} writes {:.1f} chunks/s, more than the {:.1f} chunks/s "
+                "limit".format(writer, total, max_chunk_rate),
+                file=sys.stderr,
+            )
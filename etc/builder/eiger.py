@@ -5,6 +5,8 @@ from iocbuilder.arginfo import Choice, Ident, Simple, makeArgInfo
 from iocbuilder.modules.ADCore import ADBaseTemplate, makeTemplateInstance
 from odin import (
     DETECTOR_CHOICES,
+    OdinCapacityBudget,
+    OdinHostTopology,
     OdinProcServ,
     OdinStartAllScript,
     _MetaWriter,
@@ -16,16 +18,29 @@ from odin import (
     _PluginConfig,
 )
 from plugins import (
+    KafkaSettings,
     _DatasetCreationPlugin,
     _FileWriterPlugin,
     _KafkaPlugin,
     _OffsetAdjustmentPlugin,
     _UIDAdjustmentPlugin,
 )
+from ports import PORTS
+from sizing import DEFAULT_BUFFER_SECONDS
 from util import OdinPaths, debug_print, expand_template_file
 
 debug_print("Eiger: = \n{}\n{}".format(OdinPaths.EIGER_TOOL, OdinPaths.EIGER_PYTHON), 1)
 
+EIGER_DIMENSIONS = {
+    # Sensor: (Width, Height)
+    "500K": (1028, 512),
+    "4M": (2068, 2162),
+    "9M": (3108, 3262),
+    "16M": (4148, 4362)
+}
+# EigerFan forwards to the process of each rank on this port plus the rank
+EIGER_FAN_BASE_PORT = 31600
+
 
 class _EigerProcessPlugin(_DatasetCreationPlugin):
 
@@ -41,10 +56,18 @@ class _EigerProcessPlugin(_DatasetCreationPlugin):
 
         self.size_dataset = size_dataset
 
-    def create_extra_config_entries(self, rank, total):
+    def plan_chunks(self, planner, frame_rate, event_rate, compressed):
+        # The datasets are only written with size_dataset
+        if not self.size_dataset:
+            return {}
+        return super(_EigerProcessPlugin, self).plan_chunks(planner, frame_rate, event_rate, compressed)
+
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
         if self.size_dataset:
-            entries = super(_EigerProcessPlugin, self).create_extra_config_entries(rank, total)
+            entries = super(_EigerProcessPlugin, self).create_extra_config_entries(
+                rank, total, chunks
+            )
 
         return entries
 
@@ -57,15 +80,23 @@ class EigerFan(Device):
     AutoInstantiate = True
 
     def __init__(self, IP, DETECTOR_IP, PROCESSES, SOCKETS, SENSOR, THREADS=2, BLOCK_SIZE=1000,
-                 NUMA_NODE=-1):
+                 NUMA_NODE=-1, TOPOLOGY=None):
         self.__super.__init__()
         # Update attributes with parameters
         self.__dict__.update(locals())
 
+        if TOPOLOGY is not None and TOPOLOGY.IP != IP:
+            raise ValueError("TOPOLOGY for {} given to EigerFan on {}".format(TOPOLOGY.IP, IP))
+        for rank in range(PROCESSES):
+            PORTS.reserve(IP, EIGER_FAN_BASE_PORT + rank,
+                          "EigerFan forward to process {}".format(rank + 1))
+
         self.create_startup_file()
 
     def create_startup_file(self):
-        if self.NUMA_NODE >= 0:
+        if self.TOPOLOGY is not None:
+            numa_call = self.TOPOLOGY.auxiliary_numa_call()
+        elif self.NUMA_NODE >= 0:
             numa_call = "numactl --membind={node} --cpunodebind={node} ".format(node=self.NUMA_NODE)
         else:
             numa_call = ""
@@ -85,7 +116,8 @@ class EigerFan(Device):
         SENSOR=Choice("Sensor type", ["500K", "4M", "9M", "16M"]),
         THREADS=Simple("Number of ZMQ threads to use", int),
         BLOCK_SIZE=Simple("Number of blocks per file", int),
-        NUMA_NODE=Simple("Numa node to run process on - Optional for performance tuning", int)
+        NUMA_NODE=Simple("Numa node to run process on - Optional for performance tuning", int),
+        TOPOLOGY=Ident("Host topology for core placement (overrides NUMA_NODE)", OdinHostTopology)
     )
 
 
@@ -112,7 +144,7 @@ class _EigerOdinData(_OdinData):
     def create_config_files(self, index, total):
         macros = dict(DETECTOR=OdinPaths.EIGER_TOOL,
                       IP=self.source,
-                      RX_PORT_SUFFIX=self.RANK,
+                      RX_PORT=EIGER_FAN_BASE_PORT + self.RANK,
                       SENSOR=self.sensor)
 
         if self.plugins is None:
@@ -130,7 +162,7 @@ class EigerPluginConfig(_PluginConfig):
     # Device attributes
     AutoInstantiate = True
 
-    def __init__(self, MODE="Simple", KAFKA_SERVERS=None):
+    def __init__(self, MODE="Simple", KAFKA_SERVERS=None, KAFKA=None):
         if MODE == "Simple":
             eiger = _EigerProcessPlugin(size_dataset=False)
             hdf = _FileWriterPlugin(source=eiger, indexes=True)
@@ -142,12 +174,15 @@ class EigerPluginConfig(_PluginConfig):
             hdf = _FileWriterPlugin(source=uid, indexes=True)
             plugins = [eiger, offset, uid, hdf]
         elif MODE == "Kafka":
-            if KAFKA_SERVERS is None:
-                raise ValueError("Must provide Kafka servers with Kafka mode")
             eiger = _EigerProcessPlugin(size_dataset=False)
-            kafka = _KafkaPlugin(KAFKA_SERVERS, source=eiger)
+            if KAFKA is not None:
+                kafka = KAFKA.create_plugins(source=eiger)
+            elif KAFKA_SERVERS is not None:
+                kafka = [_KafkaPlugin(KAFKA_SERVERS, source=eiger)]
+            else:
+                raise ValueError("Must provide Kafka servers with Kafka mode")
             hdf = _FileWriterPlugin(source=eiger, indexes=True)
-            plugins = [eiger, kafka, hdf]
+            plugins = [eiger] + kafka + [hdf]
         else:
             raise ValueError("Invalid mode for EigerPluginConfig")
 
@@ -157,6 +192,8 @@ class EigerPluginConfig(_PluginConfig):
     ArgInfo = makeArgInfo(__init__,
         MODE=Choice("Which plugin configuration mode to use", ["Simple", "Malcolm", "Kafka"]),
         KAFKA_SERVERS=Simple("Kafka servers, if using Kafka (comma separated).", str),
+        KAFKA=Ident("Kafka topics and partitions, if using Kafka (overrides "
+                    "KAFKA_SERVERS)", KafkaSettings),
     )
 
 
@@ -165,9 +202,14 @@ class EigerOdinDataServer(_OdinDataServer):
     """Store configuration for an EigerOdinDataServer"""
 
     PLUGIN_CONFIG = None
+    # Frames are streamed from EigerFan already compressed by the detector
+    ZMQ_INGRESS = True
+    COMPRESSED_INGRESS = True
 
     def __init__(self, IP, PROCESSES, SOURCE, SHARED_MEM_SIZE=16000000000, PLUGIN_CONFIG=None,
-                 IO_THREADS=1, TOTAL_NUMA_NODES=0):
+                 IO_THREADS=1, TOTAL_NUMA_NODES=0, FRAME_RATE=0, BIT_DEPTH=0,
+                 BUFFER_SECONDS=DEFAULT_BUFFER_SECONDS, SHM_AVAILABLE=0, TOPOLOGY=None,
+                 BUDGET=None, HUGE_PAGES=False):
         self.source = SOURCE.IP
         self.sensor = SOURCE.SENSOR
         if PLUGIN_CONFIG is None:
@@ -178,7 +220,8 @@ class EigerOdinDataServer(_OdinDataServer):
             EigerOdinDataServer.PLUGIN_CONFIG = PLUGIN_CONFIG
 
         self.__super.__init__(IP, PROCESSES, SHARED_MEM_SIZE, EigerOdinDataServer.PLUGIN_CONFIG,
-                              IO_THREADS, TOTAL_NUMA_NODES)
+                              IO_THREADS, TOTAL_NUMA_NODES, FRAME_RATE, BIT_DEPTH,
+                              BUFFER_SECONDS, SHM_AVAILABLE, TOPOLOGY, BUDGET, HUGE_PAGES)
 
     ArgInfo = makeArgInfo(__init__,
         IP=Simple("IP address of server hosting OdinData processes", str),
@@ -188,12 +231,30 @@ class EigerOdinDataServer(_OdinDataServer):
         PLUGIN_CONFIG=Ident("Define a custom set of plugins", _PluginConfig),
         IO_THREADS=Simple("Number of FR Ipc Channel IO threads to use", int),
         TOTAL_NUMA_NODES=Simple("Total number of numa nodes available to distribute processes over"
-                                " - Optional for performance tuning", int)
+                                " - Optional for performance tuning", int),
+        FRAME_RATE=Simple("Detector frame rate (Hz) - if set, SHARED_MEM_SIZE is derived "
+                          "from the sensor geometry and this rate", float),
+        BIT_DEPTH=Simple("Bit depth of frames, for shared memory sizing (0 -> 16)", int),
+        BUFFER_SECONDS=Simple("Seconds of backlog each FrameReceiver buffer should absorb",
+                              float),
+        SHM_AVAILABLE=Simple("Size of /dev/shm on this server in bytes, to check buffers fit "
+                             "(0 -> check local /dev/shm if IP is local)", int),
+        TOPOLOGY=Ident("Host topology for core placement (overrides TOTAL_NUMA_NODES)",
+                       OdinHostTopology),
+        BUDGET=Ident("Bandwidth budget to check FRAME_RATE against", OdinCapacityBudget),
+        HUGE_PAGES=Simple("Back shared memory buffers with huge pages - /dev/shm must be "
+                          "mounted with huge=", bool)
     )
 
     def create_odin_data_process(self, server, ready, release, meta, buffer_size, buffer_idx,  plugin_config):
         return _EigerOdinData(server, ready, release, meta, buffer_size, buffer_idx, plugin_config, self.source, self.sensor)
 
+    def frame_dimensions(self):
+        if EigerMetaWriter.SENSOR_SHAPE is not None:
+            # Set from SENSOR_Y and SENSOR_X of the EigerOdinDataDriver
+            return EigerMetaWriter.SENSOR_SHAPE[1], EigerMetaWriter.SENSOR_SHAPE[0]
+        return EIGER_DIMENSIONS[self.sensor]
+
 
 class _EigerV16DetectorTemplate(AutoSubstitution):
     TemplateFile = "Eiger1.template"
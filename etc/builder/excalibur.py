@@ -13,8 +13,12 @@ from odin import (
     _OdinDetector,
     _PluginConfig,
     DETECTOR_CHOICES,
+    OdinCapacityBudget,
+    OdinHostTopology,
 )
 from plugins import (
+    BloscCompression,
+    LiveViewSettings,
     _BloscPlugin,
     _DatasetCreationPlugin,
     _FileWriterPlugin,
@@ -30,6 +34,7 @@ from util import (
     debug_print,
     expand_template_file,
 )
+from sizing import DEFAULT_BUFFER_SECONDS
 
 debug_print(
     "Excalibur: \n{}\n{}".format(OdinPaths.EXCALIBUR_TOOL, OdinPaths.EXCALIBUR_PYTHON),
@@ -61,7 +66,7 @@ class _ExcaliburProcessPlugin(_DatasetCreationPlugin):
 
         self.sensor = sensor
 
-    def create_extra_config_entries(self, rank, total):
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
         dimensions_entry = {
             self.NAME: {
@@ -127,14 +132,18 @@ class _ExcaliburPluginConfig(_PluginConfig):
     # Device attributes
     AutoInstantiate = True
 
-    def __init__(self, SENSOR):
+    def __init__(self, SENSOR, COMPRESSION=None, LIVE_VIEW=None):
         excalibur = _ExcaliburProcessPlugin(sensor=SENSOR)
         offset = _OffsetAdjustmentPlugin(source=excalibur)
         uid = _UIDAdjustmentPlugin(source=offset)
         sum = _SumPlugin(source=uid)
         gap = _ExcaliburGapFillPlugin(source=sum, SENSOR=SENSOR, CHIP_GAP=3, MODULE_GAP=124)
-        view = _LiveViewPlugin(source=gap)
-        blosc = _BloscPlugin(source=gap)
+        blosc = _BloscPlugin(source=gap,
+                             settings=COMPRESSION.settings if COMPRESSION is not None else None)
+        # Compressed live view takes frames from blosc in the modes that compress
+        view_source = blosc if LIVE_VIEW is not None and LIVE_VIEW.COMPRESSED else gap
+        view = _LiveViewPlugin(source=view_source,
+                               settings=LIVE_VIEW.settings if LIVE_VIEW is not None else None)
         hdf = _FileWriterPlugin(source=blosc)
         super(_ExcaliburPluginConfig, self).__init__(PLUGIN_1=excalibur,
                                                      PLUGIN_2=offset,
@@ -145,18 +154,22 @@ class _ExcaliburPluginConfig(_PluginConfig):
                                                      PLUGIN_7=blosc,
                                                      PLUGIN_8=hdf)
 
+        profiles = COMPRESSION.profiles if COMPRESSION is not None else []
+
         # Set the modes
-        self.modes = ['compression', 'no_compression']
-
-        # Now we need to create the standard mode chain (with compression)
-        excalibur.add_mode('compression')
-        offset.add_mode('compression', source=excalibur)
-        uid.add_mode('compression', source=offset)
-        sum.add_mode('compression', source=uid)
-        gap.add_mode('compression', source=sum)
-        view.add_mode('compression', source=gap)
-        blosc.add_mode('compression', source=gap)
-        hdf.add_mode('compression', source=blosc)
+        self.modes = ['compression', 'no_compression'] + [name for name, _ in profiles]
+
+        # Now we need to create the standard mode chain (with compression) and a chain
+        # for each compression profile
+        for mode, settings in [('compression', None)] + profiles:
+            excalibur.add_mode(mode)
+            offset.add_mode(mode, source=excalibur)
+            uid.add_mode(mode, source=offset)
+            sum.add_mode(mode, source=uid)
+            gap.add_mode(mode, source=sum)
+            view.add_mode(mode, source=view_source)
+            blosc.add_mode(mode, source=gap, settings=settings)
+            hdf.add_mode(mode, source=blosc)
 
         # Now we need to create the no compression mode chain (no blosc in the chain)
         excalibur.add_mode('no_compression')
@@ -169,6 +182,7 @@ class _ExcaliburPluginConfig(_PluginConfig):
 
     def detector_setup(self, od_args):
         ## Make an instance of our template
+        od_args.update(self.mode_macros())
         makeTemplateInstance(_ExcaliburModeTemplate, locals(), od_args)
 
 
@@ -178,18 +192,36 @@ class ExcaliburOdinDataServer(_OdinDataServer):
 
     BASE_UDP_PORT = 61649
     PLUGIN_CONFIG = None
+    # COMPRESSION and LIVE_VIEW the shared PLUGIN_CONFIG was created with
+    PLUGIN_SETTINGS = None
+    DEFAULT_BIT_DEPTH = 12
 
     def __init__(self, IP, PROCESSES, SENSOR,
                  FEM_DEST_MAC, FEM_DEST_IP="10.0.2.2",
                  SHARED_MEM_SIZE=1048576000, PLUGIN_CONFIG=None,
-                 FEM_DEST_MAC_2=None, FEM_DEST_IP_2=None, DIRECT_FEM_CONNECTION=False):
+                 FEM_DEST_MAC_2=None, FEM_DEST_IP_2=None, DIRECT_FEM_CONNECTION=False,
+                 FRAME_RATE=0, BIT_DEPTH=0, BUFFER_SECONDS=DEFAULT_BUFFER_SECONDS,
+                 SHM_AVAILABLE=0, TOPOLOGY=None, BUDGET=None, COMPRESSION=None,
+                 HUGE_PAGES=False, LIVE_VIEW=None):
         self.sensor = SENSOR
         if PLUGIN_CONFIG is None:
             if ExcaliburOdinDataServer.PLUGIN_CONFIG is None:
                 # Create the standard Excalibur plugin config
-                ExcaliburOdinDataServer.PLUGIN_CONFIG = _ExcaliburPluginConfig(SENSOR)
+                ExcaliburOdinDataServer.PLUGIN_CONFIG = _ExcaliburPluginConfig(
+                    SENSOR, COMPRESSION, LIVE_VIEW
+                )
+                ExcaliburOdinDataServer.PLUGIN_SETTINGS = (COMPRESSION, LIVE_VIEW)
+            elif ExcaliburOdinDataServer.PLUGIN_SETTINGS != (COMPRESSION, LIVE_VIEW):
+                # Every server shares the plugin config, and the modes of the Mode PV
+                raise ValueError(
+                    "ExcaliburOdinDataServer {} has different COMPRESSION or LIVE_VIEW to the "
+                    "first server - give every server the same settings".format(IP)
+                )
 
-        self.__super.__init__(IP, PROCESSES, SHARED_MEM_SIZE, ExcaliburOdinDataServer.PLUGIN_CONFIG)
+        self.__super.__init__(IP, PROCESSES, SHARED_MEM_SIZE, ExcaliburOdinDataServer.PLUGIN_CONFIG,
+                              FRAME_RATE=FRAME_RATE, BIT_DEPTH=BIT_DEPTH,
+                              BUFFER_SECONDS=BUFFER_SECONDS, SHM_AVAILABLE=SHM_AVAILABLE,
+                              TOPOLOGY=TOPOLOGY, BUDGET=BUDGET, HUGE_PAGES=HUGE_PAGES)
         # Update attributes with parameters
         self.__dict__.update(locals())
 
@@ -205,15 +237,32 @@ class ExcaliburOdinDataServer(_OdinDataServer):
         FEM_DEST_IP_2=Simple("IP address of second node data link", str),
         DIRECT_FEM_CONNECTION=Simple("True if data links go direct from FEM to server. "
                                      "False if data links go through a switch. "
-                                     "This determines what is done with the second FEM_DEST", bool)
+                                     "This determines what is done with the second FEM_DEST", bool),
+        FRAME_RATE=Simple("Detector frame rate (Hz) - if set, SHARED_MEM_SIZE is derived "
+                          "from the sensor geometry and this rate", float),
+        BIT_DEPTH=Simple("Bit depth of frames, for shared memory sizing (0 -> 12)", int),
+        BUFFER_SECONDS=Simple("Seconds of backlog each FrameReceiver buffer should absorb",
+                              float),
+        SHM_AVAILABLE=Simple("Size of /dev/shm on this server in bytes, to check buffers fit "
+                             "(0 -> check local /dev/shm if IP is local)", int),
+        TOPOLOGY=Ident("Host topology for core placement", OdinHostTopology),
+        BUDGET=Ident("Bandwidth budget to check FRAME_RATE against", OdinCapacityBudget),
+        COMPRESSION=Ident("Blosc parameters and compression modes", BloscCompression),
+        HUGE_PAGES=Simple("Back shared memory buffers with huge pages - /dev/shm must be "
+                          "mounted with huge=", bool),
+        LIVE_VIEW=Ident("Live view rate and compression", LiveViewSettings)
     )
 
     def create_odin_data_process(self, server, ready, release, meta, buffer_size, buffer_idx, plugin_config):
+        # The 3M template receives from 6 FEMs, the 1M from the first 2
+        udp_port = self.allocate_udp_ports(self.BASE_UDP_PORT, 6)
         process = _ExcaliburOdinData(server, ready, release, meta, buffer_size, buffer_idx, plugin_config,
-                                     self.sensor, self.BASE_UDP_PORT)
-        self.BASE_UDP_PORT += 6
+                                     self.sensor, udp_port)
         return process
 
+    def frame_dimensions(self):
+        return EXCALIBUR_DIMENSIONS[self.sensor]
+
 
 class ExcaliburOdinControlServer(_OdinControlServer):
 
@@ -625,7 +674,7 @@ class _ExcaliburGapFillPlugin(_FrameProcessorPlugin):
         self.chip_gap = CHIP_GAP
         self.module_gap = MODULE_GAP
 
-    def create_extra_config_entries(self, rank, total):
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
 
         chip_size = [256, 256]
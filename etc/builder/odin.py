@@ -1,3 +1,5 @@
+import os
+
 from iocbuilder import AutoSubstitution, Device
 from iocbuilder.arginfo import makeArgInfo, Simple, Ident, Choice
 from iocbuilder.iocinit import IocDataStream
@@ -14,6 +16,39 @@ from util import (
     create_config_entry,
     write_batch_file,
     ADODIN_ROOT,
+    LOCAL_HOSTS,
+)
+from capacity import CapacityPlan
+from chunking import (
+    DEFAULT_CHUNK_BYTES,
+    DEFAULT_CHUNK_CACHE,
+    ChunkPlanner,
+    parse_overrides,
+)
+from placement import CorePlanner, HostTopology, numa_call
+from plugin_cost import CostModel, load_measured, parse_costs
+from plugin_graph import check_mode, describe, topological_order
+from ports import (
+    FP_CTRL_OFFSET,
+    FR_CTRL_OFFSET,
+    META_OFFSET,
+    META_WRITER_CTRL_PORT,
+    ODIN_DATA_BASE_PORT,
+    ODIN_DATA_BLOCK_SIZE,
+    ODIN_DATA_OFFSETS,
+    PORTS,
+    READY_OFFSET,
+    RELEASE_OFFSET,
+)
+from sizing import (
+    DEFAULT_BUFFER_SECONDS,
+    HUGE_PAGE_SIZE,
+    PAGE_SIZE,
+    bytes_per_pixel,
+    check_shm_capacity,
+    frame_size,
+    round_to_pages,
+    shared_mem_size,
 )
 
 
@@ -55,6 +90,8 @@ class _OdinData(Device):
     RANK = None
     FP_ENDPOINT = ""
     FR_ENDPOINT = ""
+    FR_CTRL_PORT = None
+    FP_CTRL_PORT = None
 
     # Device attributes
     AutoInstantiate = True
@@ -82,13 +119,16 @@ class _OdinData(Device):
         if extra_macros is not None:
             macros.update(extra_macros)
         if self.plugins is not None:
+            self.plugins.validate()
             load_entries = []
             connect_entries = []
             config_entries = []
             for plugin in self.plugins:
                 load_entries.append(plugin.create_config_load_entry())
                 connect_entries.append(create_config_entry(plugin.create_config_connect_entry()))
-                config_entries += plugin.create_extra_config_entries(self.RANK, self.TOTAL)
+                config_entries += plugin.create_extra_config_entries(
+                    self.RANK, self.TOTAL, self.server.chunks
+                )
             for mode in self.plugins.modes:
                 valid_entries = False
                 mode_config_dict = {'store': {'index': mode, 'value': [{'plugin': {'disconnect': 'all'}}]}}
@@ -97,6 +137,7 @@ class _OdinData(Device):
                     if entry is not None:
                         valid_entries = True
                         mode_config_dict['store']['value'].append(entry)
+                        mode_config_dict['store']['value'] += plugin.create_mode_config_entries(mode)
                 if valid_entries:
                     connect_entries.append(create_config_entry(mode_config_dict))
 
@@ -169,9 +210,44 @@ class _FrameProcessorPlugin(Device):
             }
         return entry
 
-    def create_extra_config_entries(self, rank, total):
+    def create_extra_config_entries(self, rank, total, chunks=None):
+        """Return the config of the plugin in the process of the given rank
+
+        Args:
+            rank(int): Rank of the process
+            total(int): Total number of processes
+            chunks(dict): {dataset: chunks} planned for the server of the process, or None
+                for the defaults of the datasets
+
+        """
+        return []
+
+    def create_mode_config_entries(self, mode):
+        """Return plugin config to store with the connections of a mode
+
+        Returns:
+            list: Config dicts applied whenever the mode is executed
+
+        """
         return []
 
+    def threads(self, mode=None):
+        """Return the number of threads the plugin processes each frame with in a mode"""
+        return 1
+
+    def allocate_ports(self, allocator, ip, rank):
+        """Reserve any ports the plugin binds in the process of the given rank"""
+        pass
+
+    def plan_chunks(self, planner, frame_rate, event_rate, compressed):
+        """Plan the chunks of the datasets this plugin creates
+
+        Returns:
+            dict: {dataset: (chunks, chunks per second)}
+
+        """
+        return {}
+
     def create_template(self, template_args):
         if self.TEMPLATE is not None and not self.TEMPLATE_INSTANTIATED:
             makeTemplateInstance(self.TEMPLATE, locals(), template_args)
@@ -185,59 +261,415 @@ _FrameProcessorPlugin.ArgInfo = makeArgInfo(_FrameProcessorPlugin.__init__,
 
 class _PluginConfig(Device):
 
+    """A graph of FrameProcessor plugins, each connected to a source plugin
+
+    Any number of plugins can be given, in any order - PLUGIN_1..PLUGIN_16, which are also
+    the builder arguments, and then any further plugins positionally. They are loaded and
+    connected in the order given, except that a plugin given before its source is moved to
+    just after it. For example, in the XML of a plugin config that uses this ArgInfo, a
+    second writer after the 8 plugins of the Excalibur chain:
+
+        <ADOdin.MyPluginConfig PLUGIN_1="Excalibur" ... PLUGIN_8="Writer" PLUGIN_9="RawWriter"/>
+
+    """
+
+    # States of the Mode PV of the mode templates
+    MAX_MODES = 8
+    # Plugins that can be given as builder arguments
+    MAX_PLUGINS = 16
+
     def __init__(self, PLUGIN_1=None, PLUGIN_2=None, PLUGIN_3=None, PLUGIN_4=None, PLUGIN_5=None,
-                 PLUGIN_6=None, PLUGIN_7=None, PLUGIN_8=None):
-        self.plugins = [plugin for plugin in
-                        [PLUGIN_1, PLUGIN_2, PLUGIN_3, PLUGIN_4,
-                         PLUGIN_5, PLUGIN_6, PLUGIN_7, PLUGIN_8]
-                        if plugin is not None]
+                 PLUGIN_6=None, PLUGIN_7=None, PLUGIN_8=None, PLUGIN_9=None, PLUGIN_10=None,
+                 PLUGIN_11=None, PLUGIN_12=None, PLUGIN_13=None, PLUGIN_14=None,
+                 PLUGIN_15=None, PLUGIN_16=None, *PLUGINS):
+        plugins = [plugin for plugin in
+                   [PLUGIN_1, PLUGIN_2, PLUGIN_3, PLUGIN_4, PLUGIN_5, PLUGIN_6, PLUGIN_7,
+                    PLUGIN_8, PLUGIN_9, PLUGIN_10, PLUGIN_11, PLUGIN_12, PLUGIN_13,
+                    PLUGIN_14, PLUGIN_15, PLUGIN_16] + list(PLUGINS)
+                   if plugin is not None]
+        names = [plugin.NAME for plugin in plugins]
+        for name in names:
+            if names.count(name) > 1:
+                raise ValueError("Plugin '{}' is loaded more than once".format(name))
+
+        by_name = dict((plugin.NAME, plugin) for plugin in plugins)
+        order = topological_order(names, dict((plugin.NAME, plugin.source) for plugin in plugins))
+        self.plugins = [by_name[name] for name in order]
         self.modes = []
+        self.validated = False
 
-    ArgInfo = makeArgInfo(__init__,
-        PLUGIN_1=Ident("Plugin 1", _FrameProcessorPlugin),
-        PLUGIN_2=Ident("Plugin 2", _FrameProcessorPlugin),
-        PLUGIN_3=Ident("Plugin 3", _FrameProcessorPlugin),
-        PLUGIN_4=Ident("Plugin 4", _FrameProcessorPlugin),
-        PLUGIN_5=Ident("Plugin 5", _FrameProcessorPlugin),
-        PLUGIN_6=Ident("Plugin 6", _FrameProcessorPlugin),
-        PLUGIN_7=Ident("Plugin 7", _FrameProcessorPlugin),
-        PLUGIN_8=Ident("Plugin 8", _FrameProcessorPlugin)
-    )
+    ArgInfo = makeArgInfo(__init__, **dict(
+        ("PLUGIN_{}".format(index), Ident("Plugin {}".format(index), _FrameProcessorPlugin))
+        for index in range(1, MAX_PLUGINS + 1)
+    ))
+
+    def mode_sources(self, mode):
+        """Return {plugin: source} of the plugins connected in a mode"""
+        return dict(
+            (plugin.NAME, plugin.connections[mode])
+            for plugin in self.plugins if mode in plugin.connections
+        )
+
+    def validate(self):
+        """Check the connections of every mode form a complete graph from the FrameReceiver
+
+        Modes are added after the plugins, so are checked when the config is first used.
+
+        Raises:
+            ValueError: If a mode is not listed in modes, connects a plugin to one not
+                connected in the mode or connects plugins in a cycle
+
+        """
+        if self.validated:
+            return
+
+        names = [plugin.NAME for plugin in self.plugins]
+        debug_print("Plugins: {}".format(
+            describe(names, dict((plugin.NAME, plugin.source) for plugin in self.plugins))), 1)
+        for plugin in self.plugins:
+            for mode in plugin.connections:
+                if mode not in self.modes:
+                    raise ValueError("Plugin '{}' is connected in mode '{}', which is not one "
+                                     "of the modes {}".format(plugin.NAME, mode, self.modes))
+        for mode in self.modes:
+            connections = check_mode(mode, names, self.mode_sources(mode))
+            if connections is not None:
+                debug_print("Mode {}: {}".format(mode, connections), 1)
+
+        self.validated = True
 
     def detector_setup(self, od_args):
         # No op, should be overridden by specific detector
         pass
 
+    def mode_macros(self):
+        """Return the MODE0..MODE7 state names of a mode template"""
+        if len(self.modes) > self.MAX_MODES:
+            raise ValueError("{} modes configured - the Mode PV has {} states".format(
+                len(self.modes), self.MAX_MODES))
+        for mode in self.modes:
+            if self.modes.count(mode) > 1:
+                raise ValueError("Mode '{}' is configured more than once".format(mode))
+            if len(mode) > 25:
+                raise ValueError("Mode name '{}' is longer than the 25 characters of a "
+                                 "Mode PV state".format(mode))
+        modes = self.modes + [""] * (self.MAX_MODES - len(self.modes))
+        return dict(("MODE{}".format(index), mode) for index, mode in enumerate(modes))
+
     def __iter__(self):
         for plugin in self.plugins:
             yield plugin
 
 
+class OdinHostTopology(Device):
+
+    """Plan placement of odin processes on the cores of a server
+
+    FrameReceiver and FrameProcessor processes are bound to cores on the NUMA node of the
+    data NIC, away from its IRQ cores, and auxiliary processes to cores of their own.
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, IP, DATA_NIC, TOPOLOGY_FILE=None, FR_CORES=2, FP_CORES=2, AUX_CORES=2):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+        if TOPOLOGY_FILE is not None:
+            topology = HostTopology.from_file(TOPOLOGY_FILE)
+        elif IP in LOCAL_HOSTS:
+            topology = HostTopology.from_sysfs()
+        else:
+            raise ValueError(
+                "TOPOLOGY_FILE must be given for remote host {} - "
+                "see etc/tools/capture_topology.py".format(IP)
+            )
+
+        self.planner = CorePlanner(topology, DATA_NIC)
+
+    ArgInfo = makeArgInfo(__init__,
+        IP=Simple("IP address of server", str),
+        DATA_NIC=Simple("Name of the network interface receiving detector data", str),
+        TOPOLOGY_FILE=Simple("Host topology JSON file (None -> read /sys if IP is local)", str),
+        FR_CORES=Simple("Number of cores for each FrameReceiver", int),
+        FP_CORES=Simple("Number of cores for each FrameProcessor", int),
+        AUX_CORES=Simple("Number of cores for each auxiliary process (MetaWriter, EigerFan)",
+                         int)
+    )
+
+    def rank_numa_calls(self):
+        """Return the NUMA node and numactl calls for the FrameReceiver and FrameProcessor
+        of one rank"""
+        node, fr_cores, fp_cores = self.planner.allocate_rank(self.FR_CORES, self.FP_CORES)
+        return node, numa_call(node, fr_cores), numa_call(node, fp_cores)
+
+    def auxiliary_numa_call(self):
+        node, cores = self.planner.allocate_auxiliary(self.AUX_CORES)
+        return numa_call(node, cores)
+
+
+class OdinCapacityBudget(Device):
+
+    """Bandwidth available to the OdinData processes of a server
+
+    Servers given a budget have the data rate implied by their FRAME_RATE checked against
+    it when the IOC is built. Exceeding a budget fails the build; using most of one prints
+    a warning. A budget of 0 is not checked.
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, LINK_SPEED=0, PROCESS_BANDWIDTH=0, STORAGE_BANDWIDTH=0,
+                 COMPRESSION_RATIO=1.0):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+        if COMPRESSION_RATIO < 1:
+            raise ValueError("COMPRESSION_RATIO must be at least 1")
+
+    ArgInfo = makeArgInfo(__init__,
+        LINK_SPEED=Simple("Total speed of the data links into the server (Gb/s)", float),
+        PROCESS_BANDWIDTH=Simple("Data rate a single OdinData process can sustain (MB/s)",
+                                 float),
+        STORAGE_BANDWIDTH=Simple("Rate the server can write to storage (MB/s)", float),
+        COMPRESSION_RATIO=Simple("Expected compression ratio of the data, applied to writes "
+                                 "when compressing and to ingress of compressed streams",
+                                 float)
+    )
+
+
+class OdinChunkPlanner(Device):
+
+    """Plan the HDF5 chunk shapes of the datasets written by OdinData
+
+    Replaces the default chunks of the datasets created by each plugin with shapes planned
+    from the datatype, the frame (or event) rate of each writer, the filesystem block size
+    and a target chunk size, and reports the rate each writer creates chunks at.
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, CHUNK_BYTES=DEFAULT_CHUNK_BYTES, BLOCK_SIZE=0,
+                 CHUNK_CACHE=DEFAULT_CHUNK_CACHE, MAX_CHUNK_RATE=0, OVERRIDES=""):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+        self.planner = ChunkPlanner(
+            CHUNK_BYTES, BLOCK_SIZE, CHUNK_CACHE, parse_overrides(OVERRIDES)
+        )
+
+    ArgInfo = makeArgInfo(__init__,
+        CHUNK_BYTES=Simple("Target size of a chunk in bytes", int),
+        BLOCK_SIZE=Simple("Block size of the filesystem written to in bytes, to align "
+                          "chunks to (0 -> no alignment)", int),
+        CHUNK_CACHE=Simple("HDF5 chunk cache size in bytes - limits chunks filled a frame "
+                           "at a time", int),
+        MAX_CHUNK_RATE=Simple("Chunks per second a writer may create before warning "
+                              "(0 -> no limit)", float),
+        OVERRIDES=Simple("Chunks to use for specific datasets, e.g. "
+                         "\"raw_data:1048576;image:1,3043,4183\"", str)
+    )
+
+    def plan(self, server, total_processes):
+        """Plan the chunks of the datasets written by the processes of a server
+
+        Returns:
+            dict: {dataset: chunks}, or None if the server does not take planned chunks
+
+        """
+        if server.plugins is None or not server.CHUNK_PLANNING:
+            return None
+
+        compressed = any(plugin.NAME == "blosc" for plugin in server.plugins)
+        planned = {}
+        for plugin in server.plugins:
+            planned.update(
+                plugin.plan_chunks(
+                    self.planner,
+                    server.process_frame_rate(total_processes),
+                    server.process_event_rate(total_processes),
+                    compressed
+                )
+            )
+
+        self.planner.report("{} writer".format(server.IP), planned, self.MAX_CHUNK_RATE)
+        return dict((name, plan[0]) for name, plan in planned.items())
+
+
+class OdinPluginCosts(Device):
+
+    """Estimate the time each FrameProcessor plugin takes per frame
+
+    Reports the time per frame of each plugin of the chain of every OdinDataServer, for
+    each of its modes, and the critical stage limiting the frame rate of a process. Costs
+    are estimated from the size of a frame, unless measured on a running system.
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, COSTS="", MEASURED=""):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+        self.model = CostModel(
+            parse_costs(COSTS), load_measured(MEASURED) if MEASURED else None
+        )
+
+    ArgInfo = makeArgInfo(__init__,
+        COSTS=Simple("Costs of plugin classes, replacing the defaults - "
+                     "\"ClassName:fixed_us:ms_per_mb[:touched];...\"", str),
+        MEASURED=Simple("Plugin times measured by etc/tools/plugin_costs.py", str)
+    )
+
+    def report(self, server, total_processes):
+        """Report the cost of each plugin of the processes of a server, in every mode"""
+        if server.plugins is None:
+            return
+        try:
+            frame_bytes = server.frame_bytes()
+        except NotImplementedError:
+            debug_print(
+                "{}: Frame size unknown - not estimating plugin costs".format(server.IP), 1
+            )
+            return
+
+        plugins = server.plugins
+        plugins.validate()
+        for mode in [None] + plugins.modes:
+            if mode is None:
+                sources = dict((plugin.NAME, plugin.source) for plugin in plugins)
+            else:
+                sources = plugins.mode_sources(mode)
+            if not sources:
+                continue
+
+            by_name = dict((plugin.NAME, plugin) for plugin in plugins)
+            order = topological_order([plugin.NAME for plugin in plugins if plugin.NAME in sources],
+                                      sources)
+            stages = self.model.stages([by_name[name] for name in order], sources, frame_bytes,
+                                       server.compression_ratio(), mode)
+            self.model.report("{} {} mode".format(server.IP, mode or "default"), stages,
+                              server.process_frame_rate(total_processes))
+
+
+class OdinLiveViewProxy(Device):
+
+    """Merge the live view of every FrameProcessor onto one endpoint
+
+    Runs live_view_proxy.py, which subscribes to the LiveViewPlugin of each process and
+    republishes the newest frame from any of them at no more than RATE frames per second.
+    The detector's LiveViewEndpoint is set to the proxy after IOC init. Receive statistics
+    of each process are served as JSON to requests on STATUS_PORT.
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, IP="127.0.0.1", PORT=5000, STATUS_PORT=5001, RATE=10):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+    ArgInfo = makeArgInfo(__init__,
+        IP=Simple("IP address of server to run the proxy on", str),
+        PORT=Simple("Port to publish merged live view frames on", int),
+        STATUS_PORT=Simple("Port to serve receive statistics on", int),
+        RATE=Simple("Maximum frames per second to publish (0 -> no limit)", float)
+    )
+
+    def create_startup_script(self, odin_data_servers):
+        numa_call = ""
+        for server in odin_data_servers:
+            if server.IP == self.IP and server.TOPOLOGY is not None:
+                # Each call takes more auxiliary cores, so only place the proxy once
+                numa_call = server.TOPOLOGY.auxiliary_numa_call()
+                break
+
+        subscribe = []
+        for server in odin_data_servers:
+            for process in server.processes:
+                for plugin in process.plugins or []:
+                    if plugin.CLASS_NAME == "LiveViewPlugin":
+                        endpoint = "tcp://{}:{}".format(process.IP, plugin.port(process.RANK))
+                        subscribe.append((process.RANK, endpoint))
+        if not subscribe:
+            raise ValueError("No LiveViewPlugin in any OdinData process for the live view proxy")
+
+        port = PORTS.allocate(self.IP, self.PORT, "live view proxy")
+        self.endpoint = "tcp://{}:{}".format(self.IP, port)
+        status_port = PORTS.allocate(self.IP, self.STATUS_PORT, "live view proxy status")
+        macros = dict(
+            NUMA=numa_call,
+            PYTHON=os.path.join(OdinPaths.ODIN_DATA_PYTHON, "bin/python"),
+            PROXY=data_file_path("live_view_proxy.py"),
+            SUBSCRIBE=",".join(endpoint for _, endpoint in sorted(subscribe)),
+            PUBLISH="tcp://0.0.0.0:{}".format(port),
+            STATUS="tcp://0.0.0.0:{}".format(status_port),
+            RATE=self.RATE,
+        )
+        debug_print("Live view proxy publishing on {}".format(self.endpoint), 1)
+        expand_template_file(
+            "live_view_proxy_startup", macros, "stLiveViewProxy.sh", executable=True
+        )
+
+
 class _OdinDataServer(Device):
 
     """Store configuration for an OdinDataServer"""
-    PORT_BASE = 10000
+    PORT_BASE = ODIN_DATA_BASE_PORT
     PROCESS_COUNT = 0
+    DEFAULT_BIT_DEPTH = 16
+    # Frames arrive over ZeroMQ through the IO_THREADS, rather than as UDP packets
+    ZMQ_INGRESS = False
+    # Frames arrive compressed by the detector
+    COMPRESSED_INGRESS = False
+    # The FrameProcessor config takes the chunks of the plugin datasets from the plan
+    CHUNK_PLANNING = True
 
     # Device attributes
     AutoInstantiate = True
 
     def __init__(self, IP, PROCESSES, SHARED_MEM_SIZE, PLUGIN_CONFIG=None,
-                 IO_THREADS=1, TOTAL_NUMA_NODES=0):
+                 IO_THREADS=1, TOTAL_NUMA_NODES=0, FRAME_RATE=0, BIT_DEPTH=0,
+                 BUFFER_SECONDS=DEFAULT_BUFFER_SECONDS, SHM_AVAILABLE=0, TOPOLOGY=None,
+                 BUDGET=None, HUGE_PAGES=False):
         self.__super.__init__()
+        if HUGE_PAGES:
+            SHARED_MEM_SIZE = round_to_pages(SHARED_MEM_SIZE, HUGE_PAGE_SIZE)
         # Update attributes with parameters
         self.__dict__.update(locals())
 
+        if TOPOLOGY is not None and TOPOLOGY.IP != IP:
+            raise ValueError(
+                "TOPOLOGY for {} given to OdinDataServer on {}".format(TOPOLOGY.IP, IP)
+            )
+
         self.plugins = PLUGIN_CONFIG
+        # {dataset: chunks} from an OdinChunkPlanner, replacing the defaults of the plugins
+        self.chunks = None
 
         self.processes = []
         for idx in range(PROCESSES):
-            self.processes.append(
-                self.create_odin_data_process(
-                    self, self.PORT_BASE + 1, self.PORT_BASE + 2, self.PORT_BASE + 8, 
-                    SHARED_MEM_SIZE, idx + 1, PLUGIN_CONFIG)
+            # Take the next block of ports free on this host, so servers can share it
+            owners = dict(
+                ("{} process {} {}".format(IP, idx + 1, name), offset)
+                for name, offset in ODIN_DATA_OFFSETS.items()
             )
-            self.PORT_BASE += 10
+            base = PORTS.allocate_block(IP, self.PORT_BASE, ODIN_DATA_BLOCK_SIZE, owners)
+            process = self.create_odin_data_process(
+                self, base + READY_OFFSET, base + RELEASE_OFFSET, base + META_OFFSET,
+                SHARED_MEM_SIZE, idx + 1, PLUGIN_CONFIG)
+            process.FR_CTRL_PORT = base + FR_CTRL_OFFSET
+            process.FP_CTRL_PORT = base + FP_CTRL_OFFSET
+            self.processes.append(process)
 
         self.instantiated = False  # Make sure instances are only used once
 
@@ -248,32 +680,138 @@ class _OdinDataServer(Device):
         PLUGIN_CONFIG=Ident("Define a custom set of plugins", _PluginConfig),
         IO_THREADS=Simple("Number of FR Ipc Channel IO threads to use", int),
         TOTAL_NUMA_NODES=Simple("Total number of numa nodes available to distribute processes over"
-                                " - Optional for performance tuning", int)
+                                " - Optional for performance tuning", int),
+        FRAME_RATE=Simple("Detector frame rate (Hz) - if set, SHARED_MEM_SIZE is derived "
+                          "from the sensor geometry and this rate", float),
+        BIT_DEPTH=Simple("Bit depth of frames, for shared memory sizing (0 -> detector default)",
+                         int),
+        BUFFER_SECONDS=Simple("Seconds of backlog each FrameReceiver buffer should absorb",
+                              float),
+        SHM_AVAILABLE=Simple("Size of /dev/shm on this server in bytes, to check buffers fit "
+                             "(0 -> check local /dev/shm if IP is local)", int),
+        TOPOLOGY=Ident("Host topology for core placement (overrides TOTAL_NUMA_NODES)",
+                       OdinHostTopology),
+        BUDGET=Ident("Bandwidth budget to check FRAME_RATE against", OdinCapacityBudget),
+        HUGE_PAGES=Simple("Back shared memory buffers with huge pages - /dev/shm must be "
+                          "mounted with huge=", bool)
     )
 
     def create_odin_data_process(self, server, ready, release, meta, buffer_size, buffer_idx, plugin_config):
         raise NotImplementedError("Method must be implemented by child classes")
 
+    def allocate_udp_ports(self, base, count):
+        """Reserve count consecutive UDP ports for the next process, at base if free
+
+        Returns:
+            int: The first port
+
+        """
+        owners = dict(
+            ("{} process {} UDP {}".format(self.IP, len(self.processes) + 1, idx + 1), idx)
+            for idx in range(count)
+        )
+        return PORTS.allocate_block(self.IP, base, count, owners, "udp")
+
     def configure_processes(self, server_rank, total_servers, total_processes):
         rank = server_rank
         for idx, process in enumerate(self.processes):
             process.RANK = rank
             process.TOTAL = total_processes
+            self.allocate_plugin_ports(process)
             rank += total_servers
 
+    def allocate_plugin_ports(self, process):
+        """Reserve the ports of the plugins of a process, once its RANK is assigned"""
+        if process.plugins is not None:
+            for plugin in process.plugins:
+                plugin.allocate_ports(PORTS, self.IP, process.RANK)
+
+    def frame_dimensions(self):
+        """Return the (width, height) of frames received by each process"""
+        raise NotImplementedError("Method must be implemented by child classes")
+
+    def process_frame_rate(self, total_processes):
+        """Return the rate of frames arriving at each process on this server
+
+        By default frames are distributed evenly across all processes
+        """
+        return self.FRAME_RATE / float(total_processes)
+
+    def process_event_rate(self, total_processes):
+        """Return the rate of events arriving at each process, for event mode detectors"""
+        return 0
+
+    def frame_bytes(self):
+        """Return the size of a frame buffer in each process"""
+        width, height = self.frame_dimensions()
+        return frame_size(width, height, self.BIT_DEPTH or self.DEFAULT_BIT_DEPTH)
+
+    def process_ingress(self, total_processes):
+        """Return the rate of data arriving at each process on this server (bytes/s)"""
+        width, height = self.frame_dimensions()
+        pixel_bytes = bytes_per_pixel(self.BIT_DEPTH or self.DEFAULT_BIT_DEPTH)
+        ingress = width * height * pixel_bytes * self.process_frame_rate(total_processes)
+        if self.COMPRESSED_INGRESS:
+            ingress /= self.compression_ratio()
+        return ingress
+
+    def process_write(self, total_processes):
+        """Return the rate each process on this server writes to storage (bytes/s)"""
+        ingress = self.process_ingress(total_processes)
+        if self.plugins is None or self.COMPRESSED_INGRESS:
+            return ingress
+        if any(plugin.NAME == "blosc" for plugin in self.plugins):
+            return ingress / self.compression_ratio()
+        return ingress
+
+    def compression_ratio(self):
+        return self.BUDGET.COMPRESSION_RATIO if self.BUDGET is not None else 1.0
+
+    def size_shared_memory(self, total_processes):
+        """Derive SHARED_MEM_SIZE for each process from the frame geometry and FRAME_RATE"""
+        if not self.FRAME_RATE:
+            return
+
+        self.SHARED_MEM_SIZE = shared_mem_size(
+            self.frame_bytes(), self.process_frame_rate(total_processes), self.BUFFER_SECONDS,
+            HUGE_PAGE_SIZE if self.HUGE_PAGES else PAGE_SIZE
+        )
+        debug_print(
+            "{}: Sized shared memory at {} bytes per process".format(self.IP, self.SHARED_MEM_SIZE),
+            1
+        )
+        for process in self.processes:
+            process.SHARED_MEM_SIZE = self.SHARED_MEM_SIZE
+
+    @property
+    def total_shared_mem_size(self):
+        return sum(process.SHARED_MEM_SIZE for process in self.processes)
+
     def create_od_startup_scripts(self):
         for idx, process in enumerate(self.processes):
-            fp_port_number = 10004 + (10 * idx)
-            fr_port_number = 10000 + (10 * idx)
-            ready_port_number = 10001 + (10 * idx)
-            release_port_number = 10002 + (10 * idx)
+            fp_port_number = process.FP_CTRL_PORT
+            fr_port_number = process.FR_CTRL_PORT
 
+            numa_node = None
+            if self.TOPOLOGY is not None:
+                # Bind FR and FP to their own cores on the node of the data NIC
+                numa_node, fr_numa_call, fp_numa_call = self.TOPOLOGY.rank_numa_calls()
             # If TOTAL_NUMA_NODES was set, we enable the NUMA call macro instantitation
-            if self.TOTAL_NUMA_NODES > 0:
+            elif self.TOTAL_NUMA_NODES > 0:
                 numa_node = idx % int(self.TOTAL_NUMA_NODES)
-                numa_call = "numactl --membind={node} --cpunodebind={node} ".format(node=numa_node)
+                fr_numa_call = fp_numa_call = \
+                    "numactl --membind={node} --cpunodebind={node} ".format(node=numa_node)
             else:
-                numa_call = ""
+                fr_numa_call = fp_numa_call = ""
+
+            huge_pages_check = ""
+            if self.HUGE_PAGES:
+                # Check /dev/shm provides huge pages, with room on the node the buffer is bound to
+                # - run with bash, as data files are installed without execute permission
+                huge_pages_check = "bash {} check {} {} || exit 1\n".format(
+                    data_file_path("shm_hugepages.sh"), process.SHARED_MEM_SIZE,
+                    numa_node if numa_node is not None else ""
+                )
 
             # Store server designation on OdinData object
             process.FP_ENDPOINT = "{}:{}".format(self.IP, fp_port_number)
@@ -285,7 +823,7 @@ class _OdinDataServer(Device):
                 ODIN_DATA=OdinPaths.ODIN_DATA_TOOL,
                 CTRL_PORT=fr_port_number, IO_THREADS=self.IO_THREADS,
                 LOG_CONFIG=data_file_path("log4cxx.xml"),
-                NUMA=numa_call)
+                NUMA=fr_numa_call, HUGE_PAGES_CHECK=huge_pages_check)
             expand_template_file("fr_startup", macros, output_file, executable=True)
 
             output_file = "stFrameProcessor{}.sh".format(process.RANK + 1)
@@ -295,7 +833,7 @@ class _OdinDataServer(Device):
                 HDF5_FILTERS=OdinPaths.HDF5_FILTERS,
                 CTRL_PORT=fp_port_number,
                 LOG_CONFIG=data_file_path("log4cxx.xml"),
-                NUMA=numa_call)
+                NUMA=fp_numa_call)
             expand_template_file("fp_startup", macros, output_file, executable=True)
 
 
@@ -353,6 +891,9 @@ class _OdinControlServer(Device):
         self.detector_model = DETECTOR
 
         self.meta_writer_ip = META_WRITER_IP or ODIN_DATA_SERVER_1.IP
+        PORTS.reserve(IP, PORT, "{} odin control server".format(DETECTOR))
+        PORTS.reserve(self.meta_writer_ip, META_WRITER_CTRL_PORT,
+                      "{} meta writer control".format(DETECTOR))
 
         self.odin_data_servers = [
             server for server in [
@@ -440,9 +981,9 @@ class _OdinControlServer(Device):
         return (
             "[adapter.meta_listener]\n"
             "module = odin_data.control.meta_listener_adapter.MetaListenerAdapter\n"
-            "endpoints = {}:5659\n"
+            "endpoints = {}:{}\n"
             "update_interval = 0.5"
-        ).format(self.meta_writer_ip)
+        ).format(self.meta_writer_ip, META_WRITER_CTRL_PORT)
 
     def _create_odin_data_config_entry(self):
         fp_endpoints = []
@@ -476,18 +1017,17 @@ class _MetaWriter(object):
     DETECTOR = ""
     SENSOR_SHAPE = None
     TEMPLATE = _MetaWriterTemplate
+    DEFAULT_NUMA = "numactl --membind=0 --cpunodebind=0 "
 
-    def __init__(self, detector_model, odin_data_servers):
+    def __init__(self, detector_model, odin_data_servers, topology=None):
         self.detector_model = detector_model
+        self.topology = topology
 
         self.data_endpoints = []
         for server in odin_data_servers:
             if server is not None:
-                base_port = 10000
                 for odin_data in server.processes:
-                    port = base_port + 8
-                    self.data_endpoints.append("tcp://{}:{}".format(odin_data.IP, port))
-                    base_port += 10
+                    self.data_endpoints.append("tcp://{}:{}".format(odin_data.IP, odin_data.META))
 
         self.create_startup_script()
 
@@ -502,7 +1042,13 @@ class _MetaWriter(object):
         else:
             sensor_shape = ""
 
+        if self.topology is not None:
+            numa_call = self.topology.auxiliary_numa_call()
+        else:
+            numa_call = self.DEFAULT_NUMA
+
         macros = dict(
+            NUMA=numa_call,
             APP_PATH=self.APP_PATH,
             APP_NAME=self.APP_NAME,
             WRITER=writer,
@@ -564,6 +1110,14 @@ class _OdinDetector(AsynPort):
               "%(CONTROL_SERVER_PORT)d, \"%(DETECTOR)s\", " \
               "%(BUFFERS)d, %(MEMORY)d)" % self.__dict__
 
+    def PostIocInitialise(self):
+        # Point the detector live view at the proxy merging the live view of all processes
+        driver = getattr(self, "ODIN_DATA_DRIVER", None)
+        if driver is not None and driver.LIVE_VIEW_PROXY is not None:
+            print "dbpf \"%s%sLiveViewEndpoint\", \"%s\"" % (
+                self.args["P"], self.args["R"], driver.LIVE_VIEW_PROXY.endpoint
+            )
+
 
 class _OdinDataDriverTemplate(AutoSubstitution):
     TemplateFile = "OdinDataDriver.template"
@@ -581,7 +1135,8 @@ class _OdinDataDriver(AsynPort):
     META_WRITER_CLASS = _MetaWriter
 
     def __init__(self, PORT, ODIN_CONTROL_SERVER, DETECTOR=None, DATASET="data",
-                 BUFFERS=0, MEMORY=0, **args):
+                 BUFFERS=0, MEMORY=0, CHUNKING=None, COSTS=None, LIVE_VIEW_PROXY=None,
+                 **args):
         # Init the superclass (AsynPort)
         self.__super.__init__(PORT)
         # Update the attributes of self from the commandline args
@@ -609,6 +1164,11 @@ class _OdinDataDriver(AsynPort):
                 server.instantiated = True
 
             server.configure_processes(server_idx, self.server_count, self.odin_data_processes)
+            server.size_shared_memory(self.odin_data_processes)
+            if CHUNKING is not None:
+                server.chunks = CHUNKING.plan(server, self.odin_data_processes)
+            if COSTS is not None:
+                COSTS.report(server, self.odin_data_processes)
 
             process_idx = server_idx
             for odin_data in server.processes:
@@ -637,6 +1197,10 @@ class _OdinDataDriver(AsynPort):
 
             server.create_od_startup_scripts()
 
+        self.check_shared_memory()
+        self.check_capacity()
+        PORTS.report()
+
         if plugin_config is not None:
             od_args = dict((key, args[key]) for key in ["P", "TIMEOUT"])
             od_args["PORT"] = PORT
@@ -645,7 +1209,8 @@ class _OdinDataDriver(AsynPort):
             plugin_config.detector_setup(od_args)
 
         self.meta_writer = self.META_WRITER_CLASS(
-            self.control_server.detector_model, self.control_server.odin_data_servers
+            self.control_server.detector_model, self.control_server.odin_data_servers,
+            self.meta_writer_topology()
         )
         template_args = {
             "P": args["P"],
@@ -657,6 +1222,9 @@ class _OdinDataDriver(AsynPort):
         # Now OdinData instances are configured, OdinControlServer can generate its config from them
         self.control_server.create_config_file()
 
+        if LIVE_VIEW_PROXY is not None:
+            LIVE_VIEW_PROXY.create_startup_script(self.control_server.odin_data_servers)
+
     # __init__ arguments
     ArgInfo = (
         ADBaseTemplate.ArgInfo
@@ -669,6 +1237,12 @@ class _OdinDataDriver(AsynPort):
             ODIN_CONTROL_SERVER=Ident("Odin control server", _OdinControlServer),
             DATASET=Simple("Name of Dataset", str),
             DETECTOR=Simple("Detector type", str),
+            CHUNKING=Ident("Chunk planner for the datasets written (None -> plugin "
+                           "defaults)", OdinChunkPlanner),
+            COSTS=Ident("Plugin cost model to report the critical stage of each plugin "
+                        "chain with", OdinPluginCosts),
+            LIVE_VIEW_PROXY=Ident("Proxy merging the live view of all processes",
+                                  OdinLiveViewProxy),
         )
     )
 
@@ -686,6 +1260,34 @@ class _OdinDataDriver(AsynPort):
               "\"%(DATASET)s\", \"%(DETECTOR_PLUGIN)s\", " \
               "%(BUFFERS)d, %(MEMORY)d)" % self.__dict__
 
+    def meta_writer_topology(self):
+        """Return the topology of the host running the MetaWriter, if one was given"""
+        for server in self.control_server.odin_data_servers:
+            if server.IP == self.control_server.meta_writer_ip and server.TOPOLOGY is not None:
+                return server.TOPOLOGY
+        return None
+
+    def check_shared_memory(self):
+        """Check the shared memory of all servers on each host fits in its /dev/shm"""
+        hosts = {}
+        checked_hosts = set()
+        for server in self.control_server.odin_data_servers:
+            total, available = hosts.get(server.IP, (0, 0))
+            hosts[server.IP] = (
+                total + server.total_shared_mem_size, available or server.SHM_AVAILABLE
+            )
+            if server.FRAME_RATE or server.SHM_AVAILABLE:
+                checked_hosts.add(server.IP)
+
+        for ip in checked_hosts:
+            check_shm_capacity(ip, *hosts[ip])
+
+    def check_capacity(self):
+        """Check the data rates of all servers fit within their bandwidth budgets"""
+        plan = CapacityPlan(self.control_server.odin_data_servers, self.odin_data_processes)
+        plan.report()
+        plan.check()
+
     def gui_macro(self, port, name):
         top = port[:port.find(".")]
         return "{}.{}".format(top, name)
@@ -701,12 +1303,16 @@ class OdinStartAllScript(Device):
     """Create a start-up script for this IOC"""
 
     def __init__(self, driver):
+        self.driver = driver
         self.create_start_all_script(driver.DETECTOR.upper(), driver.odin_data_processes)
 
     ArgInfo = makeArgInfo(__init__, driver=Ident("OdinDataDriver", _OdinDataDriver))
 
     def create_start_all_script(self, detector_name, odin_data_processes):
         scripts, kdl = self.create_scripts(odin_data_processes)
+        if self.driver.LIVE_VIEW_PROXY is not None:
+            scripts.append(self.create_script_entry("LiveViewProxy", "stLiveViewProxy.sh"))
+            kdl.append(self.create_kdl_entry("stLiveViewProxy.sh"))
         macros = dict(DETECTOR=getattr(OdinPaths, "{}_TOOL".format(detector_name)),
                       ODIN_DATA=OdinPaths.ODIN_DATA_TOOL,
                       SCRIPTS="\n".join([script for script in scripts]),
@@ -834,6 +1440,8 @@ class OdinProcServ(Device):
                 number += 1
 
         application_names.append("MetaWriter")
+        if self.odin_data_driver.LIVE_VIEW_PROXY is not None:
+            application_names.append("LiveViewProxy")
         application_names.extend(self.extra_applications)
 
         return application_names
@@ -0,0 +1,169 @@
+import glob
+import json
+import os
+
+
+def parse_cpu_list(cpu_list):
+    """Parse a kernel cpulist string (e.g. "0-3,8,10-11") into a list of cores
+
+    Lists of integers are returned unchanged, so topology files may use either form.
+
+    """
+    if isinstance(cpu_list, list):
+        return [int(core) for core in cpu_list]
+
+    cores = []
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cores.extend(range(int(first), int(last) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+def format_cpu_list(cores):
+    return ",".join(str(core) for core in cores)
+
+
+def numa_call(node, cores):
+    """Return a numactl prefix binding memory to node and the process to cores"""
+    return "numactl --membind={} --physcpubind={} ".format(node, format_cpu_list(cores))
+
+
+class HostTopology(object):
+
+    """The NUMA nodes and cores of a host and the NUMA affinity of its NICs
+
+    A topology file is JSON of the form written by etc/tools/capture_topology.py:
+
+        {
+          "nodes": {"0": "0-15", "1": "16-31"},
+          "nics": {"em1": {"numa_node": 1, "irq_cores": "16-19"}}
+        }
+
+    """
+
+    def __init__(self, nodes, nics):
+        # {node: [cores]}
+        self.nodes = dict(
+            (int(node), parse_cpu_list(cores)) for node, cores in nodes.items()
+        )
+        # {nic: (node, [irq cores])}
+        self.nics = dict(
+            (nic, (max(int(info.get("numa_node", 0)), 0),
+                   parse_cpu_list(info.get("irq_cores", []))))
+            for nic, info in nics.items()
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as topology_file:
+            topology = json.load(topology_file)
+        return cls(topology["nodes"], topology.get("nics", {}))
+
+    @classmethod
+    def from_sysfs(cls, sys_root="/sys", proc_root="/proc"):
+        """Read the topology of this host"""
+        topology = read_topology(sys_root, proc_root)
+        return cls(topology["nodes"], topology["nics"])
+
+
+def read_topology(sys_root="/sys", proc_root="/proc"):
+    """Read the NUMA nodes and physical NICs of this host, in the topology file form"""
+    nodes = {}
+    for node_path in glob.glob(os.path.join(sys_root, "devices/system/node/node[0-9]*")):
+        with open(os.path.join(node_path, "cpulist")) as cpulist:
+            nodes[os.path.basename(node_path)[len("node"):]] = cpulist.read().strip()
+
+    all_cores = set(core for cores in nodes.values() for core in parse_cpu_list(cores))
+    nics = {}
+    for nic_path in glob.glob(os.path.join(sys_root, "class/net/*")):
+        numa_path = os.path.join(nic_path, "device/numa_node")
+        if not os.path.exists(numa_path):
+            continue  # Virtual interface
+        with open(numa_path) as numa_node:
+            # -1 if the kernel does not know the node
+            info = dict(numa_node=max(int(numa_node.read()), 0), irq_cores=[])
+
+        msi_path = os.path.join(nic_path, "device/msi_irqs")
+        irqs = os.listdir(msi_path) if os.path.isdir(msi_path) else []
+        irq_cores = set()
+        for irq in irqs:
+            affinity_path = os.path.join(proc_root, "irq", irq, "smp_affinity_list")
+            if os.path.exists(affinity_path):
+                with open(affinity_path) as affinity:
+                    irq_cores.update(parse_cpu_list(affinity.read()))
+        # An IRQ allowed on every core is not pinned, so it excludes nothing
+        if irq_cores != all_cores:
+            info["irq_cores"] = sorted(irq_cores)
+        nics[os.path.basename(nic_path)] = info
+
+    return dict(nodes=nodes, nics=nics)
+
+
+class CorePlanner(object):
+
+    """Allocate cores on a host to odin processes
+
+    FrameReceiver / FrameProcessor pairs are placed on the NUMA node of the data NIC,
+    avoiding the cores servicing its IRQs, taking the lowest free cores. Auxiliary
+    processes (MetaWriter, EigerFan) are placed on other nodes where possible, taking
+    the highest free cores, so they do not compete with the data path.
+
+    """
+
+    def __init__(self, topology, nic):
+        if nic not in topology.nics:
+            raise ValueError(
+                "NIC {} not in host topology - have {}".format(nic, sorted(topology.nics))
+            )
+        self.nic_node, irq_cores = topology.nics[nic]
+        self.free = dict(
+            (node, [core for core in cores if core not in irq_cores])
+            for node, cores in topology.nodes.items()
+        )
+
+    def _take(self, node, count, highest=False):
+        if count == 0:
+            return []
+        cores = self.free[node]
+        if highest:
+            taken, self.free[node] = cores[-count:], cores[:-count]
+        else:
+            taken, self.free[node] = cores[:count], cores[count:]
+        return taken
+
+    def allocate_rank(self, fr_cores, fp_cores):
+        """Allocate cores for a FrameReceiver and FrameProcessor on one node
+
+        Returns:
+            (node, [fr cores], [fp cores])
+
+        """
+        other_nodes = sorted(node for node in self.free if node != self.nic_node)
+        for node in [self.nic_node] + other_nodes:
+            if len(self.free[node]) >= fr_cores + fp_cores:
+                return node, self._take(node, fr_cores), self._take(node, fp_cores)
+
+        raise ValueError(
+            "Not enough free cores for a FrameReceiver ({}) and FrameProcessor ({})".format(
+                fr_cores, fp_cores
+            )
+        )
+
+    def allocate_auxiliary(self, cores):
+        """Allocate cores for a process outside the data path
+
+        Returns:
+            (node, [cores])
+
+        """
+        other_nodes = sorted(node for node in self.free if node != self.nic_node)
+        for node in other_nodes + [self.nic_node]:
+            if len(self.free[node]) >= cores:
+                return node, self._take(node, cores, highest=True)
+
+        raise ValueError("Not enough free cores for an auxiliary process ({})".format(cores))
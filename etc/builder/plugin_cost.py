@@ -0,0 +1,185 @@
+from __future__ import division, print_function
+
+import json
+import sys
+
+from util import debug_print
+from plugin_graph import FRAME_RECEIVER
+
+
+MEGABYTE = 1e6
+# Fraction of the time available per frame above which the critical stage is warned about
+WARNING_UTILISATION = 0.8
+
+
+class PluginCost(object):
+
+    """Time a plugin takes to process one frame
+
+    Args:
+        fixed(float): Seconds per frame, regardless of its size
+        per_megabyte(float): Seconds per megabyte of frame data touched
+        touched(float): Passes over the frame data, e.g. 2 to read and write a copy
+
+    """
+
+    def __init__(self, fixed=0.0, per_megabyte=0.0, touched=1.0):
+        self.fixed = fixed
+        self.per_megabyte = per_megabyte
+        self.touched = touched
+
+    def frame_time(self, frame_bytes, threads=1):
+        return self.fixed + self.touched * frame_bytes / MEGABYTE * self.per_megabyte / threads
+
+
+# Rough figures for one core of a recent Xeon, by CLASS_NAME - measure the plugins of a
+# running system with etc/tools/plugin_costs.py for real figures
+DEFAULT_COSTS = {
+    # Decoders reorder the pixels of each frame into a new buffer
+    "ExcaliburProcessPlugin": PluginCost(10e-6, 0.4e-3, 2),
+    "ArcProcessPlugin": PluginCost(10e-6, 0.4e-3, 2),
+    # Frames arrive over ZeroMQ already compressed, or as event lists
+    "EigerProcessPlugin": PluginCost(20e-6, 0.1e-3, 1),
+    "LATRDProcessPlugin": PluginCost(10e-6, 0.5e-3, 1),
+    "XspressProcessPlugin": PluginCost(10e-6, 0.3e-3, 1),
+    # Parameter adjustments only touch frame metadata
+    "OffsetAdjustmentPlugin": PluginCost(5e-6, 0, 0),
+    "ParameterAdjustmentPlugin": PluginCost(5e-6, 0, 0),
+    "SumPlugin": PluginCost(5e-6, 0.3e-3, 1),
+    "GapFillPlugin": PluginCost(10e-6, 0.3e-3, 2),
+    # Only a fraction of frames are sent on by default
+    "LiveViewPlugin": PluginCost(5e-6, 0, 0),
+    "BloscPlugin": PluginCost(10e-6, 1.0e-3, 1),
+    "FileWriterPlugin": PluginCost(20e-6, 0.3e-3, 1),
+    "KafkaProducerPlugin": PluginCost(20e-6, 0.5e-3, 1),
+}
+# Cost of plugins not in DEFAULT_COSTS
+UNKNOWN_COST = PluginCost(10e-6, 0.3e-3, 1)
+
+
+def parse_costs(costs):
+    """Parse costs of the form "ClassName:fixed_us:ms_per_mb[:touched];..."
+
+    Returns:
+        dict: {class name: PluginCost}
+
+    """
+    parsed = {}
+    for cost in costs.split(";"):
+        if not cost.strip():
+            continue
+        try:
+            fields = cost.split(":")
+            if not 3 <= len(fields) <= 4:
+                raise ValueError()
+            values = [float(field) for field in fields[1:]]
+        except ValueError:
+            raise ValueError(
+                "Invalid plugin cost '{}' - expected "
+                "ClassName:fixed_us:ms_per_mb[:touched]".format(cost)
+            )
+        touched = values[2] if len(values) > 2 else 1.0
+        parsed[fields[0].strip()] = PluginCost(values[0] * 1e-6, values[1] * 1e-3, touched)
+    return parsed
+
+
+def load_measured(path):
+    """Load plugin times measured by etc/tools/plugin_costs.py
+
+    Returns:
+        tuple: (frame bytes, {plugin name: seconds per frame})
+
+    """
+    with open(path) as f:
+        measured = json.load(f)
+    return measured["frame_bytes"], dict(
+        (name, time * 1e-6) for name, time in measured["plugins"].items()
+    )
+
+
+class CostModel(object):
+
+    """Estimate the time each plugin of a chain takes per frame
+
+    Plugins run in their own threads, so a FrameProcessor keeps up with the slowest plugin
+    of a chain - the critical stage.
+
+    """
+
+    def __init__(self, costs=None, measured=None):
+        """
+        Args:
+            costs(dict): {class name: PluginCost} overriding DEFAULT_COSTS
+            measured(tuple): (frame bytes, {plugin name: seconds per frame}) measured
+                on a running system, overriding both
+
+        """
+        self.costs = dict(DEFAULT_COSTS)
+        self.costs.update(costs or {})
+        self.measured = measured
+
+    def stage_time(self, plugin, size, frame_bytes, mode=None):
+        """Return the seconds a plugin takes to process size bytes of a frame_bytes frame"""
+        if self.measured is not None and plugin.NAME in self.measured[1]:
+            # Scale the measured time from the measured frame size
+            return self.measured[1][plugin.NAME] * frame_bytes / self.measured[0]
+
+        cost = self.costs.get(plugin.CLASS_NAME)
+        if cost is None:
+            debug_print("No cost for {}, assuming {} s/MB".format(
+                plugin.CLASS_NAME, UNKNOWN_COST.per_megabyte), 1)
+            cost = UNKNOWN_COST
+        return cost.frame_time(size, plugin.threads(mode))
+
+    def stages(self, plugins, sources, frame_bytes, compression_ratio, mode=None):
+        """Return the time per frame of each plugin in a chain
+
+        Plugins downstream of a BloscPlugin process compressed frames.
+
+        Args:
+            plugins(list): Plugins connected, in topological order
+            sources(dict): {plugin name: source name}
+            frame_bytes(int): Size of an uncompressed frame
+            compression_ratio(float): Expected compression ratio
+            mode(str): Mode the plugins are connected in, or None for the default chain
+
+        Returns:
+            list: [(plugin, seconds per frame)]
+
+        """
+        compressed = {FRAME_RECEIVER: False}
+        stages = []
+        for plugin in plugins:
+            source_compressed = compressed[sources[plugin.NAME]]
+            compressed[plugin.NAME] = source_compressed or plugin.CLASS_NAME == "BloscPlugin"
+            size = frame_bytes / compression_ratio if source_compressed else frame_bytes
+            stages.append((plugin, self.stage_time(plugin, size, frame_bytes, mode)))
+        return stages
+
+    def report(self, description, stages, frame_rate=0):
+        """Print the time of each stage and the frame rate the critical stage allows
+
+        Args:
+            description(str): Description of the chain
+            stages(list): [(plugin, seconds per frame)]
+            frame_rate(float): Frames per second each process must keep up with
+
+        """
+        critical, critical_time = max(stages, key=lambda stage: stage[1])
+        max_rate = 1 / critical_time if critical_time else 0
+        debug_print("{}: {:.0f} Hz max - limited by {}".format(
+            description, max_rate, critical.NAME), 1)
+        for plugin, time in stages:
+            debug_print("  {}{} ({}): {:.3f} ms/frame".format(
+                "*" if plugin is critical else " ", plugin.NAME, plugin.CLASS_NAME,
+                time * 1e3), 1)
+
+        if frame_rate and critical_time * frame_rate > WARNING_UTILISATION:
+            print(
+                "WARNING: {} needs {:.0f} Hz - {} is {:.0%} busy, limiting it to {:.0f} "
+                "Hz".format(
+                    description, frame_rate, critical.NAME, critical_time * frame_rate,
+                    max_rate
+                ),
+                file=sys.stderr,
+            )
@@ -0,0 +1,93 @@
+from __future__ import print_function
+
+import sys
+
+
+FRAME_RECEIVER = "frame_receiver"
+
+
+def topological_order(names, sources):
+    """Order plugins so that every plugin comes after its source
+
+    The order given is kept wherever it is valid - a plugin given before its source is
+    moved to the first place after it, and every other plugin keeps its place.
+
+    Args:
+        names(list): Plugin names in the order given
+        sources(dict): {plugin: name of the plugin it is connected to, or FRAME_RECEIVER}
+
+    Returns:
+        list: Plugin names in order
+
+    Raises:
+        ValueError: If a source is not one of the plugins, or the connections form a cycle
+
+    """
+    for name in names:
+        source = sources[name]
+        if source != FRAME_RECEIVER and source not in names:
+            raise ValueError(
+                "Plugin '{}' is connected to '{}', which is missing".format(name, source)
+            )
+
+    ordered = []
+    remaining = list(names)
+    placed = set([FRAME_RECEIVER])
+    while remaining:
+        # Take the first plugin given whose source is placed
+        for name in remaining:
+            if sources[name] in placed:
+                break
+        else:
+            raise ValueError(
+                "Plugins {} are connected in a cycle".format(", ".join(remaining))
+            )
+        ordered.append(name)
+        placed.add(name)
+        remaining.remove(name)
+    return ordered
+
+
+def describe(names, sources):
+    """Return the connections as a tree, with one line per branch
+
+    e.g. "frame_receiver -> excalibur -> gap -> [view | blosc -> hdf]"
+
+    """
+    def branch(source):
+        children = [name for name in names if sources[name] == source]
+        if not children:
+            return source
+        elif len(children) == 1:
+            return "{} -> {}".format(source, branch(children[0]))
+        return "{} -> [{}]".format(source, " | ".join(branch(child) for child in children))
+
+    return branch(FRAME_RECEIVER)
+
+
+def check_mode(mode, names, sources):
+    """Check the connections of a mode form a complete graph from the FrameReceiver
+
+    Args:
+        mode(str): Name of the mode
+        names(list): Plugin names in load order
+        sources(dict): {plugin: source} of the plugins connected in the mode
+
+    Returns:
+        str: The connections of the mode, or None if it connects no plugins
+
+    Raises:
+        ValueError: If a plugin is connected to one not connected in the mode or the
+            connections form a cycle
+
+    """
+    if not sources:
+        print("WARNING: Mode '{}' connects no plugins".format(mode), file=sys.stderr)
+        return None
+
+    mode_names = [name for name in names if name in sources]
+    try:
+        topological_order(mode_names, sources)
+    except ValueError as error:
+        raise ValueError("Mode '{}' is incomplete - {}".format(mode, error))
+    return describe(mode_names, sources)
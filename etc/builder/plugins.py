@@ -1,5 +1,5 @@
-from iocbuilder import AutoSubstitution
-from iocbuilder.arginfo import makeArgInfo, Simple, Ident
+from iocbuilder import AutoSubstitution, Device
+from iocbuilder.arginfo import makeArgInfo, Simple, Ident, Choice
 
 from util import OneLineEntry, create_config_entry
 from odin import _FrameProcessorPlugin
@@ -27,8 +27,17 @@ class _DatasetCreationPlugin(_FrameProcessorPlugin):
 
     DATASETS = []
 
-    def create_extra_config_entries(self, rank, total):
-        entries = super(_DatasetCreationPlugin, self).create_extra_config_entries(rank, total)
+    def plan_chunks(self, planner, frame_rate, event_rate, compressed):
+        planned = {}
+        if self.DATASETS is not None:
+            for dset in self.DATASETS:
+                planned[dset['name']] = planner.plan(dset, frame_rate, event_rate, compressed)
+        return planned
+
+    def create_extra_config_entries(self, rank, total, chunks=None):
+        entries = super(_DatasetCreationPlugin, self).create_extra_config_entries(
+            rank, total, chunks
+        )
         if self.DATASETS is not None:
             for dset in self.DATASETS:
                 dset_desc = {
@@ -36,7 +45,9 @@ class _DatasetCreationPlugin(_FrameProcessorPlugin):
                 }
                 if 'dims' in dset:
                     dset_desc['dims'] = OneLineEntry(dset['dims'])
-                if 'chunks' in dset:
+                if chunks is not None and dset['name'] in chunks:
+                    dset_desc['chunks'] = OneLineEntry(chunks[dset['name']])
+                elif 'chunks' in dset:
                     dset_desc['chunks'] = OneLineEntry(dset['chunks'])
                 else:
                     dset_desc['chunks'] = OneLineEntry([1000])
@@ -76,8 +87,10 @@ class _ParameterAdjustmentPlugin(_DatasetCreationPlugin):
             self.PARAMETER_PLUGIN_INSTANTIATED = True
         super(_ParameterAdjustmentPlugin, self).create_template(template_args)
 
-    def create_extra_config_entries(self, rank, total):
-        entries = super(_ParameterAdjustmentPlugin, self).create_extra_config_entries(rank, total)
+    def create_extra_config_entries(self, rank, total, chunks=None):
+        entries = super(_ParameterAdjustmentPlugin, self).create_extra_config_entries(
+            rank, total, chunks
+        )
         parameter_entry = {
             self.NAME: {
                 "parameter": {
@@ -132,20 +145,39 @@ class _KafkaPlugin(_FrameProcessorPlugin):
     NAME = "kafka"
     CLASS_NAME = "KafkaProducerPlugin"
 
-    def __init__(self, servers, source=None):
+    def __init__(self, servers, source=None, dataset="data", topic="data", partition=None,
+                 partitions=0, name=None):
+        """
+        Args:
+            partition: Partition to send to - an int, "rank" to send the frames of each
+                process to its own partition, or None to let the producer choose
+            partitions(int): Partitions of the topic, with "rank" (0 -> one per process)
+            name(str): Plugin index, to load one for each dataset
+
+        """
         super(_KafkaPlugin, self).__init__(source)
 
         self.servers = servers
-
-    def create_extra_config_entries(self, rank, total):
+        self.dataset = dataset
+        self.topic = topic
+        self.partition = partition
+        self.partitions = partitions
+        if name is not None:
+            self.NAME = name
+
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
         source_entry = {
             self.NAME: {
-                "dataset": "data",
-                "topic": "data",
+                "dataset": self.dataset,
+                "topic": self.topic,
                 "servers": self.servers
             }
         }
+        if self.partition == "rank":
+            source_entry[self.NAME]["partition"] = rank % (self.partitions or total)
+        elif self.partition is not None:
+            source_entry[self.NAME]["partition"] = self.partition
         entries.append(create_config_entry(source_entry))
 
         return entries
@@ -156,6 +188,82 @@ class _KafkaPlugin(_FrameProcessorPlugin):
     )
 
 
+def parse_kafka_topics(topics):
+    """Parse dataset to topic mappings of the form "dataset=topic;..."
+
+    Returns:
+        list: [(dataset, topic)] in the order given
+
+    """
+    parsed = []
+    for mapping in topics.split(";"):
+        if not mapping.strip():
+            continue
+        try:
+            dataset, topic = [part.strip() for part in mapping.split("=")]
+            if not dataset or not topic:
+                raise ValueError()
+        except ValueError:
+            raise ValueError(
+                "Invalid Kafka topic mapping '{}' - expected dataset=topic".format(mapping)
+            )
+        parsed.append((dataset, topic))
+    if not parsed:
+        raise ValueError("No Kafka topic mappings given")
+    return parsed
+
+
+class KafkaSettings(Device):
+
+    """Kafka servers and topics for the FrameProcessors to send to
+
+    A KafkaProducerPlugin is loaded for each dataset to topic mapping. Frames are sent to
+    the partition of the rank of each process, to a fixed partition, or to the partition
+    the producer chooses.
+
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, SERVERS, TOPICS="data=data", PARTITION="auto", PARTITIONS=0):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+        self.topics = parse_kafka_topics(TOPICS)
+        if PARTITION == "auto":
+            self.partition = None
+        elif PARTITION == "rank":
+            self.partition = "rank"
+        else:
+            try:
+                self.partition = int(PARTITION)
+            except ValueError:
+                raise ValueError(
+                    "Kafka PARTITION must be auto, rank or a number, not '{}'".format(PARTITION)
+                )
+
+    ArgInfo = makeArgInfo(__init__,
+        SERVERS=Simple("Kafka servers (comma separated)", str),
+        TOPICS=Simple("Topic to send each dataset to - \"dataset=topic;...\"", str),
+        PARTITION=Simple("Partition to send to - auto, rank or a partition number", str),
+        PARTITIONS=Simple("Partitions of each topic, with rank (0 -> one per process)", int)
+    )
+
+    def create_plugins(self, source):
+        """Return a KafkaProducerPlugin for each dataset, connected to source"""
+        plugins = []
+        for dataset, topic in self.topics:
+            # Keep the plain index for a single dataset, as before
+            name = None if len(self.topics) == 1 else "kafka_{}".format(dataset)
+            plugins.append(_KafkaPlugin(
+                self.SERVERS, source=source, dataset=dataset, topic=topic,
+                partition=self.partition, partitions=self.PARTITIONS, name=name
+            ))
+        return plugins
+
+
 class _FileWriterPlugin(_FrameProcessorPlugin):
 
     NAME = "hdf"
@@ -168,7 +276,7 @@ class _FileWriterPlugin(_FrameProcessorPlugin):
 
         self.indexes = indexes
 
-    def create_extra_config_entries(self, rank, total):
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
 
         # Tell this node its place in the world
@@ -232,26 +340,72 @@ class _LiveViewPlugin(_FrameProcessorPlugin):
     CLASS_NAME = "LiveViewPlugin"
     TEMPLATE = _LiveViewPluginTemplate
     BASE_PORT = 5005
+    # Spacing of the preferred port of each rank
+    PORT_STEP = 10
 
-    def __init__(self, source=None):
+    def __init__(self, source=None, settings=None):
         super(_LiveViewPlugin, self).__init__(source)
 
         self.endpoint = None
+        self.ports = {}
+        self.settings = settings or {}
+
+    def allocate_ports(self, allocator, ip, rank):
+        self.ports[rank] = allocator.allocate(
+            ip, self.BASE_PORT + rank * self.PORT_STEP, "live view of process {}".format(rank + 1)
+        )
+
+    def port(self, rank):
+        """Return the port the live view of the process of the given rank publishes on"""
+        return self.ports.get(rank, self.BASE_PORT + rank * self.PORT_STEP)
 
-    def create_extra_config_entries(self, rank, total):
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
-        self.endpoint = "tcp://0.0.0.0:{}".format(self.BASE_PORT + rank * 10)
+        self.endpoint = "tcp://0.0.0.0:{}".format(self.port(rank))
         source_entry = {
             self.NAME: {
                 "dataset_name": _FileWriterPlugin.DATASET_NAME,
                 "live_view_socket_addr": self.endpoint
             }
         }
+        source_entry[self.NAME].update(self.settings)
         entries.append(create_config_entry(source_entry))
 
         return entries
 
 
+class LiveViewSettings(Device):
+
+    """Rate and form of the frames the FrameProcessors send to live view
+
+    The LiveViewPlugin sends a frame if either limit allows it, and sends every other
+    frame by default, so FRAME_FREQUENCY is disabled unless given to keep the cost of
+    live view bounded by PER_SECOND at any frame rate. COMPRESSED sends frames after the
+    BloscPlugin, in the modes that compress, so the live view consumer must decompress.
+
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, PER_SECOND=10, FRAME_FREQUENCY=0, COMPRESSED=False):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+        if PER_SECOND < 0 or FRAME_FREQUENCY < 0:
+            raise ValueError("Live view PER_SECOND and FRAME_FREQUENCY cannot be negative")
+        if not PER_SECOND and not FRAME_FREQUENCY:
+            raise ValueError("Live view PER_SECOND and FRAME_FREQUENCY are both disabled")
+        self.settings = dict(per_second=PER_SECOND, frame_frequency=FRAME_FREQUENCY)
+
+    ArgInfo = makeArgInfo(__init__,
+        PER_SECOND=Simple("Maximum frames per second from each process (0 -> no limit)", int),
+        FRAME_FREQUENCY=Simple("Send every Nth frame as well (0 -> disabled)", int),
+        COMPRESSED=Simple("Send Blosc compressed frames when compressing", bool)
+    )
+
+
 class _BloscPluginTemplate(AutoSubstitution):
     TemplateFile = "BloscPlugin.template"
 
@@ -262,5 +416,134 @@ class _BloscPlugin(_FrameProcessorPlugin):
     CLASS_NAME = "BloscPlugin"
     TEMPLATE = _BloscPluginTemplate
 
-    def __init__(self, source=None):
+    def __init__(self, source=None, settings=None):
         super(_BloscPlugin, self).__init__(source)
+        self.settings = settings or {}
+        self.mode_settings = {}
+
+    def add_mode(self, mode, source=None, settings=None):
+        super(_BloscPlugin, self).add_mode(mode, source)
+        if settings:
+            self.mode_settings[mode] = settings
+
+    def create_extra_config_entries(self, rank, total, chunks=None):
+        entries = []
+        if self.settings:
+            entries.append(create_config_entry({self.NAME: self.settings}))
+        return entries
+
+    def threads(self, mode=None):
+        return self.full_settings(mode)["threads"]
+
+    def create_template(self, template_args):
+        # The Compressor and Shuffle records are processed at init, so start them with the
+        # configured values rather than overwriting them with the first state
+        settings = self.full_settings()
+        template_args = dict(template_args,
+                             COMPRESSOR=settings["compressor"],
+                             SHUFFLE=settings["shuffle"])
+        super(_BloscPlugin, self).create_template(template_args)
+
+    def full_settings(self, mode=None):
+        """Return every parameter of the mode, taking the defaults for those not set"""
+        settings = dict(BLOSC_DEFAULTS)
+        settings.update(self.settings)
+        settings.update(self.mode_settings.get(mode, {}))
+        return settings
+
+    def create_mode_config_entries(self, mode):
+        # Every mode sets all of its parameters, so switching back to a mode restores them
+        if mode in self.connections:
+            return [{self.NAME: self.full_settings(mode)}]
+        return []
+
+
+# Indexes are the values of the BloscPlugin compressor and shuffle parameters
+BLOSC_COMPRESSORS = ["blosclz", "lz4", "lz4hc", "snappy", "zlib", "zstd"]
+BLOSC_SHUFFLES = ["noshuffle", "shuffle", "bitshuffle"]
+
+
+def blosc_settings(compressor=None, level=None, shuffle=None, threads=None):
+    """Return the BloscPlugin config of the given parameters, leaving out those not given"""
+    settings = {}
+    if compressor is not None:
+        if compressor not in BLOSC_COMPRESSORS:
+            raise ValueError("Unknown Blosc compressor '{}' - expected one of {}".format(
+                compressor, ", ".join(BLOSC_COMPRESSORS)))
+        settings["compressor"] = BLOSC_COMPRESSORS.index(compressor)
+    if level is not None:
+        if not 0 <= level <= 9:
+            raise ValueError("Blosc compression level must be 0-9, not {}".format(level))
+        settings["level"] = level
+    if shuffle is not None:
+        if shuffle not in BLOSC_SHUFFLES:
+            raise ValueError("Unknown Blosc shuffle '{}' - expected one of {}".format(
+                shuffle, ", ".join(BLOSC_SHUFFLES)))
+        settings["shuffle"] = BLOSC_SHUFFLES.index(shuffle)
+    if threads is not None:
+        settings["threads"] = threads
+    return settings
+
+
+# Parameters the BloscPlugin starts with
+BLOSC_DEFAULTS = blosc_settings("lz4", 1, "bitshuffle", 1)
+
+
+def parse_blosc_profiles(profiles):
+    """Parse profiles of the form "name=compressor:level:shuffle[:threads];..."
+
+    Returns:
+        list: [(name, settings)] in the order given
+
+    """
+    parsed = []
+    for profile in profiles.split(";"):
+        if not profile.strip():
+            continue
+        try:
+            name, params = profile.split("=")
+            params = params.split(":")
+            if not 3 <= len(params) <= 4:
+                raise ValueError()
+            compressor, level, shuffle = params[:3]
+            numbers = [int(param) for param in params[1:2] + params[3:]]
+        except ValueError:
+            raise ValueError(
+                "Invalid compression profile '{}' - expected "
+                "name=compressor:level:shuffle[:threads]".format(profile)
+            )
+        numbers += [None] * (2 - len(numbers))
+        level, threads = numbers
+        parsed.append((name.strip(), blosc_settings(compressor, level, shuffle, threads)))
+    return parsed
+
+
+class BloscCompression(Device):
+
+    """Blosc parameters of the FrameProcessors and named profiles to switch between
+
+    Parameters not given take the BloscPlugin defaults. Each profile becomes a mode of the
+    OdinData Mode PV, compressing with the profile parameters, and parameters the profile
+    leaves out take those of the compression mode.
+
+    """
+
+    # Device attributes
+    AutoInstantiate = True
+
+    def __init__(self, COMPRESSOR=None, LEVEL=None, SHUFFLE=None, THREADS=None, PROFILES=""):
+        self.__super.__init__()
+        # Update attributes with parameters
+        self.__dict__.update(locals())
+
+        self.settings = blosc_settings(COMPRESSOR, LEVEL, SHUFFLE, THREADS)
+        self.profiles = parse_blosc_profiles(PROFILES)
+
+    ArgInfo = makeArgInfo(__init__,
+        COMPRESSOR=Choice("Blosc compressor", BLOSC_COMPRESSORS),
+        LEVEL=Simple("Compression level (0-9)", int),
+        SHUFFLE=Choice("Shuffle filter", BLOSC_SHUFFLES),
+        THREADS=Simple("Compression threads of each FrameProcessor", int),
+        PROFILES=Simple("Named compression modes - "
+                        "name=compressor:level:shuffle[:threads];...", str)
+    )
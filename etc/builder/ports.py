@@ -0,0 +1,102 @@
+from util import LOCAL_HOSTS, debug_print
+
+
+# Each OdinData process (a FrameReceiver and FrameProcessor pair) takes a block of ports
+ODIN_DATA_BASE_PORT = 10000
+ODIN_DATA_BLOCK_SIZE = 10
+# Offsets within the block of an OdinData process
+FR_CTRL_OFFSET = 0
+READY_OFFSET = 1
+RELEASE_OFFSET = 2
+FP_CTRL_OFFSET = 4
+META_OFFSET = 8
+ODIN_DATA_OFFSETS = {
+    "FrameReceiver control": FR_CTRL_OFFSET,
+    "frame ready": READY_OFFSET,
+    "frame release": RELEASE_OFFSET,
+    "FrameProcessor control": FP_CTRL_OFFSET,
+    "meta": META_OFFSET,
+}
+# Fixed by the meta writer
+META_WRITER_CTRL_PORT = 5659
+MAX_PORT = 65535
+
+
+class PortAllocator(object):
+
+    """Reserve the ports of every process on each host, so none are used twice
+
+    Ports are allocated from a preferred base and move up to the next free port or block
+    if it is taken, so a single detector gets the same ports it always has, while further
+    detectors or processes on the same host are packed in after it. Ports reserved at a
+    fixed number raise a ValueError if they are already taken.
+
+    """
+
+    def __init__(self):
+        # {(host, protocol): {port: owner}}
+        self.hosts = {}
+
+    @staticmethod
+    def host(ip):
+        return "localhost" if ip in LOCAL_HOSTS else ip
+
+    def ports(self, ip, protocol):
+        return self.hosts.setdefault((self.host(ip), protocol), {})
+
+    def owner(self, ip, port, protocol="tcp"):
+        """Return the owner of a port, or None if it is free"""
+        return self.ports(ip, protocol).get(port)
+
+    def reserve(self, ip, port, owner, protocol="tcp"):
+        """Reserve a specific port
+
+        Raises:
+            ValueError: If the port is out of range or already reserved
+
+        """
+        if not 0 < port <= MAX_PORT:
+            raise ValueError("{} port {} on {} is out of range".format(owner, port, ip))
+        ports = self.ports(ip, protocol)
+        if port in ports:
+            raise ValueError("{} port {} on {} is already used by {}".format(
+                protocol.upper(), port, ip, ports[port]))
+        ports[port] = owner
+        return port
+
+    def allocate(self, ip, base, owner, protocol="tcp"):
+        """Reserve the first free port at or above base"""
+        return self.allocate_block(ip, base, 1, {owner: 0}, protocol)
+
+    def allocate_block(self, ip, base, size, offsets, protocol="tcp"):
+        """Reserve ports at offsets within the first free block of ports at or above base
+
+        Args:
+            ip(str): Host the ports are bound on
+            base(int): Preferred start of the block
+            size(int): Size of the block - blocks are tried at multiples of this from base
+            offsets(dict): {owner: offset} of the ports in the block to reserve
+
+        Returns:
+            int: The start of the block
+
+        """
+        ports = self.ports(ip, protocol)
+        while any(base + offset in ports for offset in offsets.values()):
+            base += size
+        if base + max(offsets.values()) > MAX_PORT:
+            raise ValueError("No free block of {} {} ports on {}".format(size, protocol, ip))
+        for owner, offset in offsets.items():
+            self.reserve(ip, base + offset, owner, protocol)
+        return base
+
+    def report(self):
+        for host, protocol in sorted(self.hosts):
+            ports = self.hosts[(host, protocol)]
+            debug_print("{} {} ports:".format(host, protocol.upper()), 2)
+            for port in sorted(ports):
+                debug_print("  {}: {}".format(port, ports[port]), 2)
+
+
+# Shared by all builder classes, as every process of the IOC must be allocated together
+PORTS = PortAllocator()
@@ -0,0 +1,109 @@
+from __future__ import division, print_function
+
+import math
+import os
+import sys
+
+from util import LOCAL_HOSTS, debug_print
+
+
+# Allowance per frame for the decoder frame header (packet states, frame number, etc)
+FRAME_HEADER_BYTES = 65536
+# The FrameReceiver cannot run with fewer buffers than this, whatever the frame rate
+MIN_BUFFER_FRAMES = 10
+# Default amount of backlog each FrameReceiver should be able to absorb
+DEFAULT_BUFFER_SECONDS = 1.0
+PAGE_SIZE = 4096
+# Transparent huge page size of a /dev/shm mounted with huge=
+HUGE_PAGE_SIZE = 2 * 1024 * 1024
+
+
+def bytes_per_pixel(bit_depth):
+    """Return the size of the container a pixel of the given bit depth is stored in
+
+    e.g. 12-bit data is stored in uint16 -> 2 bytes
+
+    """
+    container = 1
+    while container * 8 < bit_depth:
+        container *= 2
+    return container
+
+
+def frame_size(width, height, bit_depth):
+    """Return the size in bytes of one frame buffer in the FrameReceiver"""
+    return width * height * bytes_per_pixel(bit_depth) + FRAME_HEADER_BYTES
+
+
+def buffer_frames(frame_rate, buffer_seconds):
+    """Return the number of frame buffers needed to hold buffer_seconds at frame_rate"""
+    return max(int(math.ceil(frame_rate * buffer_seconds)), MIN_BUFFER_FRAMES)
+
+
+def round_to_pages(size, page_size=PAGE_SIZE):
+    """Return size rounded up to a whole number of pages"""
+    return int(math.ceil(size / page_size)) * page_size
+
+
+def shared_mem_size(frame_bytes, frame_rate, buffer_seconds=DEFAULT_BUFFER_SECONDS,
+                    page_size=PAGE_SIZE):
+    """Return the shared memory size for one FrameReceiver process
+
+    Args:
+        frame_bytes(int): Size of a single frame buffer
+        frame_rate(float): Rate of frames arriving at this process (Hz)
+        buffer_seconds(float): Length of backlog the process should be able to absorb
+        page_size(int): Size of the pages backing the buffer
+
+    Returns:
+        int: Size in bytes, rounded up to a whole number of pages
+
+    """
+    size = frame_bytes * buffer_frames(frame_rate, buffer_seconds)
+    return round_to_pages(size, page_size)
+
+
+def available_shm(ip, path="/dev/shm"):
+    """Return the space available in the shared memory tmpfs if ip is this host
+
+    Returns:
+        int: Bytes available, or None if it cannot be determined from here
+
+    """
+    if ip not in LOCAL_HOSTS:
+        return None
+
+    try:
+        stat = os.statvfs(path)
+    except OSError:
+        return None
+
+    return stat.f_bavail * stat.f_frsize
+
+
+def check_shm_capacity(ip, total_size, available=0):
+    """Check the total shared memory requested on a host fits in its /dev/shm
+
+    If available is given it is taken to be the /dev/shm size of the target host and an
+    error is raised if it is exceeded. Otherwise, if the host is this machine, the local
+    /dev/shm is checked and a warning is printed, as the IOC may be deployed elsewhere.
+
+    """
+    if available:
+        if total_size > available:
+            raise ValueError(
+                "Shared memory buffers on {} require {} bytes, but only {} are available".format(
+                    ip, total_size, available
+                )
+            )
+        return
+
+    available = available_shm(ip)
+    if available is None:
+        debug_print("Cannot check /dev/shm on {} - skipping".format(ip), 1)
+    elif total_size > available:
+        print(
+            "WARNING: Shared memory buffers on {} require {} bytes, "
+            "but only {} are available in local /dev/shm".format(ip, total_size, available),
+            file=sys.stderr,
+        )
@@ -13,8 +13,11 @@ from odin import (
     _OdinDetector,
     _PluginConfig,
     DETECTOR_CHOICES,
+    OdinCapacityBudget,
+    OdinHostTopology,
 )
 from plugins import _DatasetCreationPlugin, _FileWriterPlugin
+from sizing import DEFAULT_BUFFER_SECONDS
 from util import OdinPaths, create_config_entry, debug_print, expand_template_file
 
 debug_print(
@@ -27,6 +30,8 @@ TRISTAN_DIMENSIONS = {
     "2M": (2048, 1024),
     "10M": (4183, 3043)
 }
+# Size of a raw event word
+EVENT_BYTES = 8
 
 class _TristanProcessPlugin(_DatasetCreationPlugin):
 
@@ -35,10 +40,10 @@ class _TristanProcessPlugin(_DatasetCreationPlugin):
     LIBRARY_PATH = OdinPaths.TRISTAN_TOOL
     DATASETS = [
         dict(name="data", datatype="uint32", chunks=[1]),
-        dict(name="raw_data", datatype="uint64", chunks=[2097152]),
-        dict(name="event_id", datatype="uint32", chunks=[2097152]),
-        dict(name="event_time_offset", datatype="uint64", chunks=[2097152]),
-        dict(name="event_energy", datatype="uint32", chunks=[2097152]),
+        dict(name="raw_data", datatype="uint64", chunks=[2097152], events=True),
+        dict(name="event_id", datatype="uint32", chunks=[2097152], events=True),
+        dict(name="event_time_offset", datatype="uint64", chunks=[2097152], events=True),
+        dict(name="event_energy", datatype="uint32", chunks=[2097152], events=True),
         dict(name="image", datatype="uint16", dims=[3043, 4183], chunks=[1, 3043, 4183]),
         dict(name="cue_timestamp_zero", datatype="uint64", chunks=[2097152]),
         dict(name="cue_id", datatype="uint16", chunks=[2097152])
@@ -48,9 +53,11 @@ class _TristanProcessPlugin(_DatasetCreationPlugin):
         super(_TristanProcessPlugin, self).__init__(None)
         self._sensor = sensor
 
-    def create_extra_config_entries(self, rank, total):
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
-        entries = super(_TristanProcessPlugin, self).create_extra_config_entries(rank, total)
+        entries = super(_TristanProcessPlugin, self).create_extra_config_entries(
+            rank, total, chunks
+        )
         entries.append(
             create_config_entry(
                 {
@@ -411,9 +418,15 @@ class TristanOdinDataServer(_OdinDataServer):
 
     def __init__(self, IP, PROCESSES, SENSOR, FEM_DEST_MAC, FEM_DEST_IP="127.0.0.1",
                  FEM_DEST_NAME="em0", FEM_DEST_SUBNET=24,
-                 SHARED_MEM_SIZE=1048576000, PLUGIN_CONFIG=None):
+                 SHARED_MEM_SIZE=1048576000, PLUGIN_CONFIG=None,
+                 FRAME_RATE=0, BIT_DEPTH=0, BUFFER_SECONDS=DEFAULT_BUFFER_SECONDS,
+                 SHM_AVAILABLE=0, TOPOLOGY=None, EVENT_RATE=0, BUDGET=None,
+                 HUGE_PAGES=False):
         self.sensor = SENSOR
-        self.__super.__init__(IP, PROCESSES, SHARED_MEM_SIZE, PLUGIN_CONFIG)
+        self.__super.__init__(IP, PROCESSES, SHARED_MEM_SIZE, PLUGIN_CONFIG,
+                              FRAME_RATE=FRAME_RATE, BIT_DEPTH=BIT_DEPTH,
+                              BUFFER_SECONDS=BUFFER_SECONDS, SHM_AVAILABLE=SHM_AVAILABLE,
+                              TOPOLOGY=TOPOLOGY, BUDGET=BUDGET, HUGE_PAGES=HUGE_PAGES)
         # Update attributes with parameters
         self.__dict__.update(locals())
 
@@ -426,19 +439,46 @@ class TristanOdinDataServer(_OdinDataServer):
         FEM_DEST_NAME=Simple("Name of the destination network interface", str),
         FEM_DEST_SUBNET=Simple("Subnet mask node transmits on", int),
         SHARED_MEM_SIZE=Simple("Size of shared memory buffers in bytes", int),
-        PLUGIN_CONFIG=Ident("Define a custom set of plugins", _PluginConfig)
+        PLUGIN_CONFIG=Ident("Define a custom set of plugins", _PluginConfig),
+        FRAME_RATE=Simple("Detector frame rate (Hz) - if set, SHARED_MEM_SIZE is derived "
+                          "from the sensor geometry and this rate", float),
+        BIT_DEPTH=Simple("Bit depth of frames, for shared memory sizing (0 -> 16)", int),
+        BUFFER_SECONDS=Simple("Seconds of backlog each FrameReceiver buffer should absorb",
+                              float),
+        SHM_AVAILABLE=Simple("Size of /dev/shm on this server in bytes, to check buffers fit "
+                             "(0 -> check local /dev/shm if IP is local)", int),
+        TOPOLOGY=Ident("Host topology for core placement", OdinHostTopology),
+        EVENT_RATE=Simple("Detector event rate (events/s) - if set, the data rate is "
+                          "checked against BUDGET instead of FRAME_RATE and event "
+                          "datasets are chunked for it", float),
+        BUDGET=Ident("Bandwidth budget to check FRAME_RATE against", OdinCapacityBudget),
+        HUGE_PAGES=Simple("Back shared memory buffers with huge pages - /dev/shm must be "
+                          "mounted with huge=", bool)
     )
 
     def create_odin_data_process(self, server, ready, release, meta, buffer_size, buffer_idx, plugin_config):
-        process = _TristanOdinData(server, ready, release, meta, buffer_size, buffer_idx, self.sensor, self.BASE_UDP_PORT)
-        self.BASE_UDP_PORT += 1
+        udp_port = self.allocate_udp_ports(self.BASE_UDP_PORT, 1)
+        process = _TristanOdinData(server, ready, release, meta, buffer_size, buffer_idx, self.sensor, udp_port)
         return process
 
+    def frame_dimensions(self):
+        return TRISTAN_DIMENSIONS[self.sensor]
+
+    def process_event_rate(self, total_processes):
+        # Events are spread evenly across all processes
+        return self.EVENT_RATE / float(total_processes)
+
+    def process_ingress(self, total_processes):
+        if self.EVENT_RATE:
+            return self.process_event_rate(total_processes) * EVENT_BYTES
+        return self.__super.process_ingress(total_processes)
+
     def configure_processes(self, server_rank, total_servers, total_processes):
         rank = server_rank * len(self.processes)
         for idx, process in enumerate(self.processes):
             process.RANK = rank
             process.TOTAL = total_processes
+            self.allocate_plugin_ports(process)
             rank += 1
 
 class _TristanFPTemplate(AutoSubstitution):
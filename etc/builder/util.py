@@ -15,6 +15,8 @@ def debug_print(message, level):
         print(message)
 
 
+LOCAL_HOSTS = ["127.0.0.1", "localhost"]
+
 ADODIN_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
 ADODIN_DATA = os.path.join(ADODIN_ROOT, "data")
 
@@ -1,4 +1,9 @@
+from __future__ import print_function
+
+import json
 import os
+import sys
+from collections import OrderedDict
 
 from iocbuilder import AutoSubstitution
 from iocbuilder.arginfo import makeArgInfo, Simple, Ident, Choice
@@ -10,6 +15,7 @@ from util import (
     debug_print,
     create_config_entry,
     OneLineEntry,
+    LOCAL_HOSTS,
 )
 from odin import (
     _OdinDetector,
@@ -21,6 +27,8 @@ from odin import (
     _PluginConfig,
     OdinProcServ,
     OdinStartAllScript,
+    OdinCapacityBudget,
+    OdinHostTopology,
     _FrameProcessorPlugin,
     DETECTOR_CHOICES,
 )
@@ -33,6 +41,8 @@ from plugins import (
     _FileWriterPlugin,
     _DatasetCreationPlugin,
 )
+from ports import PORTS
+from sizing import DEFAULT_BUFFER_SECONDS
 
 
 debug_print(
@@ -40,6 +50,49 @@ debug_print(
     1
 )
 
+SENSOR_CHANNELS = {
+    "36CHAN": 36,
+    "8CHAN": 8,
+}
+
+
+def channels_per_process(max_channels, total_processes):
+    """Return the most channels any one process has"""
+    count, remainder = divmod(max_channels, total_processes)
+    return count + 1 if remainder else count
+
+
+def process_channels(rank, max_channels, total_processes):
+    """Return the channels of the process of the given rank
+
+    Channels are split into contiguous blocks, one for each process. The blocks differ in
+    size by at most one, with the first processes taking the extra channels.
+
+    Raises:
+        ValueError: If there are more processes than channels
+
+    """
+    if total_processes > max_channels:
+        raise ValueError(
+            "{} Xspress processes is more than the {} channels - use fewer "
+            "processes".format(total_processes, max_channels)
+        )
+    count, remainder = divmod(max_channels, total_processes)
+    first = rank * count + min(rank, remainder)
+    if rank < remainder:
+        count += 1
+    return list(range(first, first + count))
+
+
+def hdf_postfix(rank):
+    """Return the file postfix of the process of the given rank - _A to _Z, then _AA..."""
+    letters = ""
+    number = rank + 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return "_" + letters
+
 
 class XspressOdinProcServ(OdinProcServ):
 
@@ -61,13 +114,28 @@ class _XspressProcessPlugin(_DatasetCreationPlugin):
 
         self.size_dataset = size_dataset
 
-    def create_extra_config_entries(self, rank, total):
+    def plan_chunks(self, planner, frame_rate, event_rate, compressed):
+        # The datasets are only written with size_dataset
+        if not self.size_dataset:
+            return {}
+        return super(_XspressProcessPlugin, self).plan_chunks(planner, frame_rate, event_rate, compressed)
+
+    def create_extra_config_entries(self, rank, total, chunks=None):
         entries = []
         if self.size_dataset:
-            entries = super(_XspressProcessPlugin, self).create_extra_config_entries(rank, total)
+            entries = super(_XspressProcessPlugin, self).create_extra_config_entries(
+                rank, total, chunks
+            )
 
         return entries
 
+class _XspressLiveViewPlugin(_LiveViewPlugin):
+
+    # The live view merge subscribes to consecutive ports
+    BASE_PORT = 15500
+    PORT_STEP = 1
+
+
 class XspressPlugins(_PluginConfig):
     """Plugin Singleton"""
     _instance = None
@@ -75,7 +143,8 @@ class XspressPlugins(_PluginConfig):
         if self._instance:
             return self._instance
         xspress_plugin = _XspressProcessPlugin(size_dataset=False)
-        live_plugin = _LiveViewPlugin(source=xspress_plugin)
+        live_plugin = _XspressLiveViewPlugin(source=xspress_plugin)
+        self.live_view = live_plugin
         blosc_plugin = _BloscPlugin(source=live_plugin)
         fw_plugin = _FileWriterPlugin(source=blosc_plugin)
 
@@ -104,35 +173,49 @@ class _XspressOdinData(_OdinData):
     }
     fp_template = "fp_xspress.json"
     fr_template = "fr_xspress.json"
-    hdf_postfix = ["_A", "_B", "_C", "_D", "_E", "_F", "_G", "_H", "_I"]
-    chans_per_processs_mca = 4
-    chans_per_processs_list = 5
-    base_rx_port = 15150
-    base_lv_port = 15500
-
-
+    rx_port = None
 
     def __init__(self, server, READY, RELEASE, META, SHARED_MEM_SIZE, BUFFER_IDX, SENSOR):
         super(_XspressOdinData, self).__init__(server, READY, RELEASE, META, SHARED_MEM_SIZE, BUFFER_IDX, XspressPlugins())
         self.sensor = SENSOR
 
+    @property
+    def lv_port(self):
+        return self.plugins.live_view.port(self.RANK)
+
+    def create_mca_dataset_entries(self, channels):
+        return ",\n    ".join(
+            create_config_entry({
+                "hdf": {
+                    "dataset": {
+                        "mca_{}".format(channel): OrderedDict([
+                            ("datatype", "uint32"),
+                            ("chunks", OneLineEntry([256, 1, self.server.SPECTRUM_BINS])),
+                            ("dims", OneLineEntry([1, self.server.SPECTRUM_BINS])),
+                            ("compression", "blosc"),
+                            ("indexes", True),
+                        ])
+                    }
+                }
+            })
+            for channel in channels
+        )
+
     def create_config_files(self, index, total):
-        zero_idx = index - 1
-        base_mca = zero_idx * self.chans_per_processs_mca
-        base_list = zero_idx * self.chans_per_processs_list
+        channels = process_channels(self.RANK, self.server.max_channels, total)
+        raw_datasets = OrderedDict(
+            ("raw_{}".format(channel), dict(datatype="uint64", chunks=OneLineEntry([524288])))
+            for channel in channels
+        )
         macros = dict(DETECTOR_ROOT=OdinPaths.XSPRESS_TOOL,
-                      HDF_POSTFIX = self.hdf_postfix[zero_idx],
-                      MCA1 = base_mca,
-                      MCA2 = base_mca + 1,
-                      MCA3 = base_mca + 2,
-                      MCA4 = base_mca + 3,
-                      LIST1 = base_list,
-                      LIST2 = base_list + 1,
-                      LIST3 = base_list + 2,
-                      LIST4 = base_list + 3,
-                      LIST5 = base_list + 4,
-                      RX_PORT = self.base_rx_port + zero_idx,
-                      LV_PORT = self.base_lv_port + zero_idx)
+                      HDF_POSTFIX=hdf_postfix(self.RANK),
+                      MCA_DATASETS=self.create_mca_dataset_entries(channels),
+                      MCA_MASTER="mca_{}".format(channels[-1]),
+                      LIST_CHANNELS=json.dumps(channels),
+                      RAW_DATASETS=create_config_entry(raw_datasets),
+                      DAQ_IP=self.server.daq_ip,
+                      RX_PORT=self.rx_port,
+                      LV_PORT=self.lv_port)
 
         # Generate the frame processor config files
         super(_XspressOdinData, self).create_config_file(
@@ -148,9 +231,25 @@ class XspressOdinDataServer(_OdinDataServer):
 
     """Store configuration for a XspressOdinDataServer"""
 
-    def __init__(self, IP, PROCESSES, SENSOR, SHARED_MEM_SIZE=1048576000, PLUGIN_CONFIG=None):
+    DEFAULT_BIT_DEPTH = 32
+    SPECTRUM_BINS = 4096
+    ZMQ_INGRESS = True
+    # Host the DAQ publishes frames to the FrameReceivers from, set by the control server
+    daq_ip = "127.0.0.1"
+    BASE_RX_PORT = 15150
+    # fp_xspress.json fixes the chunks of its datasets
+    CHUNK_PLANNING = False
+
+    def __init__(self, IP, PROCESSES, SENSOR, SHARED_MEM_SIZE=1048576000, PLUGIN_CONFIG=None,
+                 FRAME_RATE=0, BIT_DEPTH=0, BUFFER_SECONDS=DEFAULT_BUFFER_SECONDS,
+                 SHM_AVAILABLE=0, TOPOLOGY=None, BUDGET=None, HUGE_PAGES=False):
         self.sensor = SENSOR
-        self.__super.__init__(IP, PROCESSES, SHARED_MEM_SIZE, XspressPlugins())
+        self.max_channels = SENSOR_CHANNELS[SENSOR]
+        self.channels_per_process = channels_per_process(self.max_channels, PROCESSES)
+        self.__super.__init__(IP, PROCESSES, SHARED_MEM_SIZE, XspressPlugins(),
+                              FRAME_RATE=FRAME_RATE, BIT_DEPTH=BIT_DEPTH,
+                              BUFFER_SECONDS=BUFFER_SECONDS, SHM_AVAILABLE=SHM_AVAILABLE,
+                              TOPOLOGY=TOPOLOGY, BUDGET=BUDGET, HUGE_PAGES=HUGE_PAGES)
         # Update attributes with parameters
         self.__dict__.update(locals())
 
@@ -159,53 +258,48 @@ class XspressOdinDataServer(_OdinDataServer):
         PROCESSES=Simple("Number of OdinData processes on this server", int),
         SENSOR=Choice("Sensor type", ["36CHAN","8CHAN"]),
         SHARED_MEM_SIZE=Simple("Size of shared memory buffers in bytes", int),
-        PLUGIN_CONFIG=Ident("Define a custom set of plugins", _PluginConfig)
+        PLUGIN_CONFIG=Ident("Define a custom set of plugins", _PluginConfig),
+        FRAME_RATE=Simple("Time frame rate (Hz) - if set, SHARED_MEM_SIZE is derived "
+                          "from the channels per process and this rate", float),
+        BIT_DEPTH=Simple("Bit depth of MCA bins, for shared memory sizing (0 -> 32)", int),
+        BUFFER_SECONDS=Simple("Seconds of backlog each FrameReceiver buffer should absorb",
+                              float),
+        SHM_AVAILABLE=Simple("Size of /dev/shm on this server in bytes, to check buffers fit "
+                             "(0 -> check local /dev/shm if IP is local)", int),
+        TOPOLOGY=Ident("Host topology for core placement", OdinHostTopology),
+        BUDGET=Ident("Bandwidth budget to check FRAME_RATE against", OdinCapacityBudget),
+        HUGE_PAGES=Simple("Back shared memory buffers with huge pages - /dev/shm must be "
+                          "mounted with huge=", bool)
     )
 
     def create_odin_data_process(self, server, ready, release, meta, buffer_size, buffer_idx, plugin_config):
         process = _XspressOdinData(server, ready, release, meta, buffer_size, buffer_idx, self.sensor)
         return process
 
+    def configure_processes(self, server_rank, total_servers, total_processes):
+        self.__super.configure_processes(server_rank, total_servers, total_processes)
+        self.channels_per_process = channels_per_process(self.max_channels, total_processes)
+        for process in self.processes:
+            process.rx_port = PORTS.allocate(
+                self.daq_ip, self.BASE_RX_PORT + process.RANK,
+                "Xspress DAQ to process {}".format(process.RANK + 1)
+            )
+
+    def frame_dimensions(self):
+        # Each process receives a spectrum for each of its channels in every time frame
+        return self.SPECTRUM_BINS, self.channels_per_process
+
+    def process_frame_rate(self, total_processes):
+        # Channels are split across processes, so every process sees every time frame
+        return self.FRAME_RATE
+
 class XspressOdinControlServer(_OdinControlServer):
 
     """Store configuration for an ArcOdinControlServer"""
 
     ODIN_SERVER = os.path.join(OdinPaths.XSPRESS_PYTHON, "bin/xspress_control")
     PYTHON_MODULES = {}
-    DAQ_ENDPOINTS = [
-        "tcp://127.0.0.1:15150",
-        "tcp://127.0.0.1:15151",
-        "tcp://127.0.0.1:15152",
-        "tcp://127.0.0.1:15153",
-        "tcp://127.0.0.1:15154",
-        "tcp://127.0.0.1:15155",
-        "tcp://127.0.0.1:15156",
-        "tcp://127.0.0.1:15157",
-        "tcp://127.0.0.1:15158"
-    ]
-    FP_ENDPOINTS = [
-        "127.0.0.1:10004",
-        "127.0.0.1:10014",
-        "127.0.0.1:10024",
-        "127.0.0.1:10034",
-        "127.0.0.1:10044",
-        "127.0.0.1:10054",
-        "127.0.0.1:10064",
-        "127.0.0.1:10074",
-        "127.0.0.1:10084",
-    ]
 
-    FR_ENDPOINTS = [
-        "127.0.0.1:10000",
-        "127.0.0.1:10010",
-        "127.0.0.1:10020",
-        "127.0.0.1:10030",
-        "127.0.0.1:10040",
-        "127.0.0.1:10050",
-        "127.0.0.1:10060",
-        "127.0.0.1:10070",
-        "127.0.0.1:10080",
-    ]
     def __init__(
         self,
         SETTINGS_PATH,
@@ -225,10 +319,13 @@ class XspressOdinControlServer(_OdinControlServer):
         ODIN_DATA_SERVER_2=None,
         ODIN_DATA_SERVER_3=None,
         ODIN_DATA_SERVER_4=None,
+        ODIN_DATA_SERVER_5=None,
+        ODIN_DATA_SERVER_6=None,
+        ODIN_DATA_SERVER_7=None,
+        ODIN_DATA_SERVER_8=None,
     ):
         self.__dict__.update(locals())
         self.ADAPTERS.append("xspress")
-        self.num_process = ODIN_DATA_SERVER_1.PROCESSES
 
         super(XspressOdinControlServer, self).__init__(
             IP,
@@ -239,7 +336,13 @@ class XspressOdinControlServer(_OdinControlServer):
             ODIN_DATA_SERVER_2,
             ODIN_DATA_SERVER_3,
             ODIN_DATA_SERVER_4,
+            ODIN_DATA_SERVER_5,
+            ODIN_DATA_SERVER_6,
+            ODIN_DATA_SERVER_7,
+            ODIN_DATA_SERVER_8,
         )
+        self.num_process = len(self.odin_data_processes)
+        self.configure_servers()
         self.create_wrapper_start_up_script_and_config()
 
     # __init__ arguments
@@ -264,8 +367,41 @@ class XspressOdinControlServer(_OdinControlServer):
         ODIN_DATA_SERVER_2=Ident("OdinDataServer 2 configuration", _OdinDataServer),
         ODIN_DATA_SERVER_3=Ident("OdinDataServer 3 configuration", _OdinDataServer),
         ODIN_DATA_SERVER_4=Ident("OdinDataServer 4 configuration", _OdinDataServer),
+        ODIN_DATA_SERVER_5=Ident("OdinDataServer 5 configuration", _OdinDataServer),
+        ODIN_DATA_SERVER_6=Ident("OdinDataServer 6 configuration", _OdinDataServer),
+        ODIN_DATA_SERVER_7=Ident("OdinDataServer 7 configuration", _OdinDataServer),
+        ODIN_DATA_SERVER_8=Ident("OdinDataServer 8 configuration", _OdinDataServer),
     )
 
+    @property
+    def daq_ip(self):
+        # The DAQ runs with the control application, on the host attached to the hardware
+        return self.HARDWARE_ENDPOINT.split(":")[0]
+
+    def configure_servers(self):
+        """Give every OdinDataServer the channel count and the DAQ host to receive from"""
+        remote = [
+            server.IP for server in self.odin_data_servers
+            if server.IP not in LOCAL_HOSTS and server.IP != self.daq_ip
+        ]
+        if remote and self.daq_ip in LOCAL_HOSTS:
+            raise ValueError(
+                "OdinDataServers on {} cannot receive from the DAQ on {} - give "
+                "HARDWARE_ENDPOINT as an address they can reach".format(
+                    ", ".join(remote), self.daq_ip
+                )
+            )
+        # Check every process has some channels
+        process_channels(0, self.MAX_CHANNELS, self.num_process)
+
+        for server in self.odin_data_servers:
+            server.max_channels = self.MAX_CHANNELS
+            server.daq_ip = self.daq_ip
+
+    @property
+    def ranked_processes(self):
+        return sorted(self.odin_data_processes, key=lambda process: process.RANK)
+
     def create_odin_server_config_entries(self):
         '''
         TODO: undo this method override
@@ -292,7 +428,10 @@ class XspressOdinControlServer(_OdinControlServer):
                 "run_flags = {}".format(self.RUN_FLAGS),
                 "debug = {}".format(self.DEBUG),
                 "num_process = {}".format(self.num_process),
-                "daq_endpoints = {}".format(",".join(self.DAQ_ENDPOINTS[:self.num_process])),
+                "daq_endpoints = {}".format(",".join(
+                    "tcp://{}:{}".format(self.daq_ip, process.rx_port)
+                    for process in self.ranked_processes
+                )),
             ]
         )
 
@@ -302,12 +441,16 @@ class XspressOdinControlServer(_OdinControlServer):
         return "\n".join([
             "[adapter.fp]",
             "module = xspress_detector.control.fp_xspress_adapter.FPXspressAdapter",
-            "endpoints = {}".format(",".join(self.FP_ENDPOINTS[:self.num_process])),
+            "endpoints = {}".format(
+                ",".join(process.FP_ENDPOINT for process in self.ranked_processes)
+            ),
             "update_interval = 0.2",
             "",
             "[adapter.fr]",
             "module = odin_data.control.frame_receiver_adapter.FrameReceiverAdapter",
-            "endpoints = {}".format(",".join(self.FR_ENDPOINTS[:self.num_process])),
+            "endpoints = {}".format(
+                ",".join(process.FR_ENDPOINT for process in self.ranked_processes)
+            ),
             "update_interval = 0.2",
 
         ])
@@ -372,24 +515,11 @@ class XspressDetector(_OdinDetector):
         ODIN_DATA_DRIVER,
         BUFFERS=0,
         MEMORY=0,
-        NUM_PROCESSES=1,
+        NUM_PROCESSES=0,
         MAX_CHANNELS=8,
         NUM_CARDS=2,
         **args
     ):
-
-
-        LV_ENDPOINTS = [
-            "15500",
-            "15501",
-            "15502",
-            "15503",
-            "15504",
-            "15505",
-            "15506",
-            "15507",
-            "15508",]
-
         args["R"] = ":CAM:"
         # Init the superclass (OdinDetector)
         self.__super.__init__(
@@ -445,7 +575,7 @@ class XspressDetector(_OdinDetector):
                 int,
             ),
             NUM_PROCESSES=Simple(
-                "Number of Live View processes necessary.",
+                "Number of processes to merge the live view of (0 -> all)",
                 int
             ),
             MAX_CHANNELS=Choice(
@@ -462,14 +592,27 @@ class XspressDetector(_OdinDetector):
 
     def create_live_startup_script(self):
 
+        processes = self.control_server.ranked_processes
+        if self.NUM_PROCESSES:
+            processes = processes[:self.NUM_PROCESSES]
+        remote = set(
+            process.IP for process in processes
+            if process.IP not in LOCAL_HOSTS and process.IP != self.control_server.IP
+        )
+        if remote:
+            print(
+                "WARNING: The live view merge subscribes to local ports, so will not receive "
+                "the live view of processes on {}".format(", ".join(sorted(remote))),
+                file=sys.stderr,
+            )
+
         macros = dict(
             XSPRESS_APP=os.path.join(OdinPaths.XSPRESS_PYTHON, "bin/xspress_live_merge")
         )
-        LV_endpoints=[]
-        macros["XSPRESS_APP"]+=' --sub_ports {}'.format(self.LV_ENDPOINTS[0])
-        for i in range(1,self.NUM_PROCESSES):
-            macros["XSPRESS_APP"] += ',' + str(self.LV_ENDPOINTS[i])
-        print(macros["XSPRESS_APP"])
+        macros["XSPRESS_APP"] += " --sub_ports {}".format(
+            ",".join(str(process.lv_port) for process in processes)
+        )
+        debug_print(macros["XSPRESS_APP"], 1)
         expand_template_file("xspress_live_startup", macros, "stLiveViewMerge.sh", executable=True)
 
 class XspressStartupScript(OdinStartAllScript):
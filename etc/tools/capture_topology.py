@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+from argparse import ArgumentParser
+
+# The topology is read by the builder's placement module, so the file matches what the
+# builder reads from sysfs itself for local servers
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "builder"))
+from placement import read_topology  # noqa: E402
+
+
+def main():
+    parser = ArgumentParser(
+        description="Capture the NUMA / NIC topology of this host for OdinHostTopology "
+        "TOPOLOGY_FILE"
+    )
+    parser.add_argument(
+        "nics", nargs="*", help="Network interfaces to include (default: all physical)"
+    )
+    parser.add_argument("-o", "--output", default=None, help="File to write (default: stdout)")
+    args = parser.parse_args()
+
+    topology = read_topology()
+    if args.nics:
+        missing = [nic for nic in args.nics if nic not in topology["nics"]]
+        if missing:
+            parser.error(f"Not physical network interfaces of this host: {', '.join(missing)}")
+        topology["nics"] = {nic: topology["nics"][nic] for nic in args.nics}
+
+    output = json.dumps(topology, indent=2, sort_keys=True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import List, NamedTuple, Optional, Tuple
+
+import blosc
+import numpy as np
+
+MEGABYTE = 1e6
+# Sensor: (Width, Height), from the dimensions in etc/builder
+SENSORS = {
+    "excalibur-1M": (2048, 512),
+    "excalibur-3M": (2048, 1536),
+    "tristan-1M": (2048, 512),
+    "tristan-2M": (2048, 1024),
+    "tristan-10M": (4183, 3043),
+    "eiger-500K": (1028, 512),
+    "eiger-4M": (2068, 2162),
+    "eiger-9M": (3108, 3262),
+    "eiger-16M": (4148, 4362),
+}
+BIT_DEPTH_DTYPES = {8: np.uint8, 16: np.uint16, 32: np.uint32}
+# Indexes match BLOSC_COMPRESSORS and BLOSC_SHUFFLES in etc/builder/plugins.py
+COMPRESSORS = ["blosclz", "lz4", "lz4hc", "snappy", "zlib", "zstd"]
+SHUFFLES = {
+    "noshuffle": blosc.NOSHUFFLE,
+    "shuffle": blosc.SHUFFLE,
+    "bitshuffle": blosc.BITSHUFFLE,
+}
+# Bright spots per megapixel in synthetic frames, standing in for Bragg peaks
+SPOTS_PER_MEGAPIXEL = 20
+
+
+class Setting(NamedTuple):
+    compressor: str
+    level: int
+    shuffle: str
+    threads: int
+
+    def describe(self) -> str:
+        return f"{self.compressor}:{self.level}:{self.shuffle}:{self.threads}"
+
+
+class Result(NamedTuple):
+    setting: Setting
+    ratio: float
+    rate: float  # Uncompressed bytes per second compressed
+    cores: float  # Cores needed per FrameProcessor at the target frame rate
+
+    @property
+    def rate_per_core(self) -> float:
+        return self.rate / self.setting.threads
+
+    def keeps_up(self) -> bool:
+        return self.cores <= self.setting.threads
+
+
+def synthetic_frames(
+    sensor: str, bit_depth: int, count: int, mean_counts: float, seed: Optional[int]
+) -> np.ndarray:
+    """Return photon counting frames of Poisson background and bright spots"""
+    width, height = SENSORS[sensor]
+    dtype = BIT_DEPTH_DTYPES[bit_depth]
+    rng = np.random.default_rng(seed)
+    frames = rng.poisson(mean_counts, (count, height, width))
+    spots = int(SPOTS_PER_MEGAPIXEL * width * height / 1e6)
+    for frame in frames:
+        rows = rng.integers(0, height, spots)
+        columns = rng.integers(0, width, spots)
+        frame[rows, columns] += rng.integers(100, 1000, spots)
+    return np.minimum(frames, np.iinfo(dtype).max).astype(dtype)
+
+
+def sample_frames(path: str, dataset: str, count: int) -> np.ndarray:
+    """Return frames from a data file, as the FrameProcessor would receive them"""
+    import h5py
+
+    with h5py.File(path, "r") as f:
+        data = f[dataset]
+        if data.ndim < 3:
+            raise ValueError(f"{path}:{dataset} is not a stack of frames")
+        return data[:count]
+
+
+def benchmark(frames: np.ndarray, setting: Setting, repeats: int, frame_rate: float,
+              processes: int) -> Result:
+    """Compress each frame as the BloscPlugin would and time it"""
+    blosc.set_nthreads(setting.threads)
+    typesize = frames.dtype.itemsize
+    buffers = [frame.tobytes() for frame in frames]
+    compressed = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for buffer in buffers:
+            compressed += len(
+                blosc.compress(
+                    buffer,
+                    typesize=typesize,
+                    clevel=setting.level,
+                    shuffle=SHUFFLES[setting.shuffle],
+                    cname=setting.compressor,
+                )
+            )
+    elapsed = time.perf_counter() - start
+
+    raw = frames.nbytes * repeats
+    rate = raw / elapsed
+    process_load = frames[0].nbytes * frame_rate / processes
+    return Result(setting, raw / compressed, rate, process_load * setting.threads / rate)
+
+
+def recommend(results: List[Result]) -> Result:
+    """Return the best compressing setting that keeps up, or the fastest if none do"""
+    keeping_up = [result for result in results if result.keeps_up()]
+    if keeping_up:
+        return max(keeping_up, key=lambda result: (result.ratio, -result.cores))
+    return min(results, key=lambda result: result.cores)
+
+
+def blosc_config(setting: Setting) -> dict:
+    return {
+        "blosc": {
+            "compressor": COMPRESSORS.index(setting.compressor),
+            "level": setting.level,
+            "shuffle": list(SHUFFLES).index(setting.shuffle),
+            "threads": setting.threads,
+        }
+    }
+
+
+def builder_config(setting: Setting, profiles: List[Tuple[str, Setting]]) -> str:
+    attributes = (
+        f'COMPRESSOR="{setting.compressor}" LEVEL="{setting.level}" '
+        f'SHUFFLE="{setting.shuffle}" THREADS="{setting.threads}"'
+    )
+    if profiles:
+        attributes += ' PROFILES="{}"'.format(
+            ";".join(
+                f"{name}={profile.describe()}" for name, profile in profiles
+            )
+        )
+    return f'<ADOdin.BloscCompression {attributes} name="Compression"/>'
+
+
+def report(results: List[Result], frame_bytes: int, frame_rate: float, processes: int):
+    print(
+        f"{frame_bytes / MEGABYTE:.2f} MB frames at {frame_rate:g} Hz over {processes} "
+        f"FrameProcessor(s)"
+    )
+    print(f"{'Setting':<28} {'Ratio':>7} {'MB/s':>9} {'MB/s/core':>10} {'Cores':>7}")
+    for result in sorted(results, key=lambda result: -result.ratio):
+        print(
+            f"{result.setting.describe():<28} {result.ratio:>7.2f} "
+            f"{result.rate / MEGABYTE:>9.1f} {result.rate_per_core / MEGABYTE:>10.1f} "
+            f"{result.cores:>7.2f}{'' if result.keeps_up() else ' *'}"
+        )
+    print("* needs more cores than its threads to keep up")
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark Blosc settings on sample frames and recommend a BloscPlugin "
+        "configuration for a target frame rate"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sample", help="HDF5 file to take frames from")
+    source.add_argument(
+        "--sensor", choices=list(SENSORS), help="Generate synthetic frames of this sensor"
+    )
+    parser.add_argument("--dataset", default="/data", help="Dataset of frames in --sample")
+    parser.add_argument(
+        "--bit-depth",
+        default=16,
+        type=int,
+        choices=list(BIT_DEPTH_DTYPES),
+        help="Bits per pixel of synthetic frames",
+    )
+    parser.add_argument(
+        "--mean-counts",
+        default=0.5,
+        type=float,
+        help="Mean counts per pixel of synthetic frames",
+    )
+    parser.add_argument("--seed", default=None, type=int, help="Random seed")
+    parser.add_argument("-n", "--frames", default=10, type=int, help="Frames to sample")
+    parser.add_argument(
+        "--repeats", default=3, type=int, help="Times to compress each frame"
+    )
+    parser.add_argument(
+        "-r", "--frame-rate", required=True, type=float, help="Target frame rate (Hz)"
+    )
+    parser.add_argument(
+        "--processes",
+        default=1,
+        type=int,
+        help="FrameProcessors sharing the frame rate",
+    )
+    parser.add_argument(
+        "--compressors",
+        default="lz4,zstd,blosclz",
+        help="Comma separated compressors to try",
+    )
+    parser.add_argument(
+        "--levels", default="1,3,5,9", help="Comma separated levels to try"
+    )
+    parser.add_argument(
+        "--shuffles",
+        default="shuffle,bitshuffle",
+        help="Comma separated shuffle filters to try",
+    )
+    parser.add_argument(
+        "--threads", default="1,2,4", help="Comma separated thread counts to try"
+    )
+    parser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Settings to benchmark in parallel (default: cores / largest thread count)",
+    )
+    parser.add_argument(
+        "--profiles",
+        action="store_true",
+        default=False,
+        help="Add the fastest and best compressing settings that keep up as profiles of "
+        "the builder configuration",
+    )
+    parser.add_argument(
+        "--json", default=None, help="File to write the results and recommendation to"
+    )
+    args = parser.parse_args()
+
+    compressors = args.compressors.split(",")
+    unavailable = set(compressors) - set(blosc.compressor_list())
+    if unavailable - set(COMPRESSORS):
+        parser.error(f"Unknown compressors {', '.join(sorted(unavailable))}")
+    elif unavailable:
+        print(
+            f"Skipping {', '.join(sorted(unavailable))} - not built into this blosc",
+            file=sys.stderr,
+        )
+        compressors = [name for name in compressors if name not in unavailable]
+    shuffles = args.shuffles.split(",")
+    if set(shuffles) - set(SHUFFLES):
+        parser.error(f"Shuffles must be from {', '.join(SHUFFLES)}")
+    threads = [int(count) for count in args.threads.split(",")]
+    settings = [
+        Setting(*setting)
+        for setting in product(
+            compressors, [int(level) for level in args.levels.split(",")], shuffles, threads
+        )
+    ]
+
+    if args.sample is not None:
+        frames = sample_frames(args.sample, args.dataset, args.frames)
+    else:
+        frames = synthetic_frames(
+            args.sensor, args.bit_depth, args.frames, args.mean_counts, args.seed
+        )
+
+    cores = os.cpu_count() or 1
+    workers = args.workers or max(cores // max(threads), 1)
+    if workers * max(threads) > cores:
+        print(
+            f"WARNING: {workers} workers of up to {max(threads)} threads share {cores} "
+            "cores - rates will be understated",
+            file=sys.stderr,
+        )
+    print(f"Benchmarking {len(settings)} settings with {workers} workers", file=sys.stderr)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(
+                benchmark, frames, setting, args.repeats, args.frame_rate, args.processes
+            )
+            for setting in settings
+        ]
+        results = [future.result() for future in futures]
+
+    report(results, frames[0].nbytes, args.frame_rate, args.processes)
+
+    best = recommend(results)
+    if not best.keeps_up():
+        print(
+            f"WARNING: No setting keeps up with {args.frame_rate:g} Hz - "
+            "recommending the fastest",
+            file=sys.stderr,
+        )
+    profiles = []
+    if args.profiles:
+        keeping_up = [result for result in results if result.keeps_up()] or [best]
+        candidates = [
+            ("fast", min(keeping_up, key=lambda result: result.cores).setting),
+            ("small", max(keeping_up, key=lambda result: result.ratio).setting),
+        ]
+        # The compression mode already uses the recommended setting
+        profiles = [profile for profile in candidates if profile[1] != best.setting]
+
+    print(
+        f"\nRecommended {best.setting.describe()}: ratio {best.ratio:.2f}, "
+        f"{best.cores:.2f} cores per FrameProcessor"
+    )
+    print(f"FrameProcessor config: {json.dumps(blosc_config(best.setting))}")
+    print(f"Builder: {builder_config(best.setting, profiles)}")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "results": [
+                        dict(
+                            result.setting._asdict(),
+                            ratio=result.ratio,
+                            rate=result.rate,
+                            cores=result.cores,
+                        )
+                        for result in results
+                    ],
+                    "recommended": blosc_config(best.setting),
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
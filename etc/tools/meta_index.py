@@ -0,0 +1,106 @@
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+STATISTICS = ["count", "total", "min", "max"]
+# Number of files to index between commits
+COMMIT_INTERVAL = 1000
+
+
+def summarise(values: np.ndarray) -> List[Optional[float]]:
+    """Return the STATISTICS of values, with None for those undefined when empty"""
+    if not values.size:
+        return [0, 0, None, None]
+    return [values.size, float(values.sum()), float(values.min()), float(values.max())]
+
+
+class MetaIndex:
+    """Persistent index of meta files and summary statistics of their datasets
+
+    Files are keyed by path and identified by mtime and size, so a file only needs to be
+    read again if it has changed since it was indexed. Files that could not be read are
+    indexed as invalid and retried when they change.
+    """
+
+    def __init__(self, path: Path, datasets: List[str]):
+        self.datasets = datasets
+        self.columns = [f"{name}_{stat}" for name in datasets for stat in STATISTICS]
+        self.connection = sqlite3.connect(str(path))
+        self.connection.row_factory = sqlite3.Row
+        self.pending = 0
+
+        columns = ", ".join(f"{column} REAL" for column in self.columns)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            f"(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, valid INTEGER, {columns})"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime)")
+
+    def stale(self, files: Iterable[Tuple[Path, float, int]]) -> List[Tuple[Path, float, int]]:
+        """Return the (path, mtime, size) of files not indexed at their current version"""
+        indexed = {
+            row["path"]: (row["mtime"], row["size"])
+            for row in self.connection.execute("SELECT path, mtime, size FROM files")
+        }
+        return [
+            (path, mtime, size)
+            for path, mtime, size in files
+            if indexed.get(str(path)) != (mtime, size)
+        ]
+
+    def add(
+        self, path: Path, mtime: float, size: int, durations: Optional[Dict[str, np.ndarray]]
+    ):
+        """Index a file with the datasets read from it, or None if it could not be read"""
+        if durations is None:
+            values = [None] * len(self.columns)
+        else:
+            values = [value for name in self.datasets for value in summarise(durations[name])]
+
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO files VALUES ({', '.join('?' * (len(values) + 4))})",
+            [str(path), mtime, size, durations is not None] + values,
+        )
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    def query(
+        self, roots: List[Path] = None, start: float = None, end: float = None
+    ) -> List[sqlite3.Row]:
+        """Return indexed files under roots last modified between start and end
+
+        Rows are ordered by mtime and have columns path, mtime, size, valid and
+        <dataset>_<statistic> for each dataset and STATISTICS.
+        """
+        conditions, parameters = [], []
+        if roots:
+            conditions.append(" OR ".join(["path LIKE ? ESCAPE '\\'"] * len(roots)))
+            for root in roots:
+                escaped = str(root.resolve()).replace("\\", "\\\\")
+                escaped = escaped.replace("%", "\\%").replace("_", "\\_")
+                parameters.append(f"{escaped}/%")
+        if start is not None:
+            conditions.append("mtime >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("mtime <= ?")
+            parameters.append(end)
+
+        where = " AND ".join(f"({condition})" for condition in conditions)
+        return self.connection.execute(
+            "SELECT * FROM files"
+            + (f" WHERE {where}" if where else "")
+            + " ORDER BY mtime",
+            parameters,
+        ).fetchall()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
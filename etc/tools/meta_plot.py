@@ -1,60 +1,304 @@
+import calendar
 import os
 import sys
 from argparse import ArgumentParser
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from datetime import datetime, timezone
+from fnmatch import fnmatch
 from pathlib import Path
-from time import gmtime, strftime, struct_time
-from typing import List
+from time import gmtime, strftime
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import h5py as h5
 import matplotlib.pyplot as plt
 import numpy as np
 from progress.bar import Bar
 
+from meta_index import MetaIndex
+from meta_report import FRAME_WRITTEN, STRAGGLER_FACTOR, MetaReport
+
 META_SUFFIX = "*_meta.h5"
 WRITE_DURATION = "write_duration"
 FLUSH_DURATION = "flush_duration"
 CREATE_DURATION = "create_duration"
 CLOSE_DURATION = "close_duration"
+DURATIONS = [WRITE_DURATION, FLUSH_DURATION, CREATE_DURATION, CLOSE_DURATION]
 ISO_FORMAT_WTIMEZONE = "%Y-%m-%dT%H:%M:%S (%z)"
 WARNING_DURATION = 500000  # 0.5 seconds
+# Files each worker process may have read ahead of the one being consumed
+READ_AHEAD = 4
 
 
-def files_between(files: List[Path], start: str = None, end: str = None) -> List[Path]:
-    """Return files last modified between start and end"""
+def files_between(mtimes: np.ndarray, start: str = None, end: str = None) -> slice:
+    """Return the slice of files, sorted by mtime, last modified between start and end"""
+    first, last = 0, len(mtimes)
     if start is not None:
-        start_tuple = datetime.fromisoformat(start).timetuple()
-        start_idx = file_newer_than(files, start_tuple)
-        files = files[start_idx:]
-
+        first = file_newer_than(mtimes, timestamp(start))
     if end is not None:
-        end_tuple = datetime.fromisoformat(end).timetuple()
-        end_idx = file_newer_than(files, end_tuple)
-        files = files[:end_idx]
+        last = file_newer_than(mtimes, timestamp(end), inclusive=False)
+    return slice(first, last)
 
-    return files
 
+def file_newer_than(mtimes: np.ndarray, target: float, inclusive: bool = True) -> int:
+    """Return the index of the first of the sorted mtimes at (or after) target"""
+    return int(np.searchsorted(mtimes, target, side="left" if inclusive else "right"))
 
-def file_newer_than(files: List[Path], target: struct_time) -> int:
-    """Return the index of the first file in the list last modified after target"""
-    target_idx = 0
-    for idx in range(len(files)):
-        if gmtime(os.path.getmtime(files[idx])) > target:
-            target_idx = idx
-            break
 
-    return target_idx
+def find_meta_files(
+    root: Path, recursive: bool = False, prune_before: float = None
+) -> Iterator[Tuple[Path, os.stat_result]]:
+    """Yield the path and stat of each meta file under root, stat'ing each file once
 
+    Args:
+        root: Directory to search
+        recursive: Search subdirectories
+        prune_before: Do not descend into subdirectories last modified before this time
 
-def find_meta_files(root: Path, recursive: bool = False):
-    if recursive:
-        return root.rglob(META_SUFFIX)
-    else:
-        return root.glob(META_SUFFIX)
+    """
+    directories = [root]
+    while directories:
+        try:
+            entries = list(os.scandir(directories.pop()))
+        except OSError:
+            continue  # Unreadable or removed while searching
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and (
+                        prune_before is None or entry.stat().st_mtime >= prune_before
+                    ):
+                        directories.append(entry.path)
+                elif fnmatch(entry.name, META_SUFFIX):
+                    yield Path(entry.path), entry.stat()
+            except OSError:
+                continue
+
+
+def scan_meta_files(
+    roots: List[Path], recursive: bool = False, prune_before: float = None
+) -> Tuple[List[Path], np.ndarray, np.ndarray]:
+    """Find meta files under roots
+
+    Returns:
+        paths, mtimes, sizes - sorted by mtime
+
+    """
+    paths, mtimes, sizes = [], [], []
+    for root in roots:
+        for path, stat in find_meta_files(root, recursive, prune_before):
+            paths.append(path)
+            mtimes.append(stat.st_mtime)
+            sizes.append(stat.st_size)
+
+    mtimes = np.array(mtimes, dtype=np.float64)
+    order = np.argsort(mtimes, kind="stable")
+    return [paths[idx] for idx in order], mtimes[order], np.array(sizes, dtype=np.int64)[order]
+
+
+def iso_time(mtime: float) -> str:
+    return strftime(ISO_FORMAT_WTIMEZONE, gmtime(mtime))
+
+
+def timestamp(iso_time: Optional[str]) -> Optional[float]:
+    """Convert an ISO format time, taken as UTC like file mtimes, to a timestamp"""
+    if iso_time is None:
+        return None
+    return calendar.timegm(datetime.fromisoformat(iso_time).timetuple())
+
+
+def read_meta_file(
+    path: Path, optional: Tuple[str, ...] = ()
+) -> Optional[Dict[str, np.ndarray]]:
+    """Read the duration datasets, and any optional datasets present, of a meta file
+
+    Returns:
+        {dataset: values}, or None if the file could not be read
+
+    """
+    try:
+        with h5.File(path, "r") as h5_file:
+            data = {name: h5_file[name][()] for name in DURATIONS}
+            data.update({name: h5_file[name][()] for name in optional if name in h5_file})
+            return data
+    except Exception:
+        # Probably still open for writing
+        return None
+
+
+def read_meta_files(
+    paths: List[Path], workers: int, optional: Tuple[str, ...] = ()
+) -> Iterator[Tuple[Path, Optional[Dict[str, np.ndarray]]]]:
+    """Read meta files concurrently, yielding results in the order of paths
+
+    At most READ_AHEAD files per worker are submitted ahead of the result being yielded,
+    so memory is bounded however many files there are.
+    """
+    read = partial(read_meta_file, optional=optional)
+    if workers == 1:
+        yield from zip(paths, map(read, paths))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        remaining = iter(paths)
+        for path in remaining:
+            pending.append((path, executor.submit(read, path)))
+            if len(pending) >= workers * READ_AHEAD:
+                break
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(read, next_path)))
+
+
+class DurationSeries:
+    """Accumulate a series of durations, keeping every sample
+
+    Samples are kept as a list of chunks and joined once, rather than reallocating the
+    whole series for every file.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.samples = 0
+        self.max = 0
+
+    def add(self, values: np.ndarray):
+        if values.size:
+            self.chunks.append(values)
+            self.samples += values.size
+            self.max = max(self.max, values.max())
+
+    def plot(self, ax, color):
+        values = np.concatenate(self.chunks) if self.chunks else np.array([])
+        ax.plot(values, color=color, linewidth=0.1)
+
+
+class DecimatedDurationSeries(DurationSeries):
+    """Accumulate a series of durations as at most `points` min/max buckets
+
+    Memory is bounded regardless of the number of samples: when the buckets are full,
+    adjacent pairs are merged and the number of samples per bucket doubles.
+    """
+
+    def __init__(self, points: int):
+        super().__init__()
+        self.capacity = points + points % 2  # Must be even to merge pairs
+        self.bucket_size = 1
+        self.buckets = 0
+        self.mins = np.empty(self.capacity)
+        self.maxs = np.empty(self.capacity)
+        self.pending = np.empty(0)
+
+    def add(self, values: np.ndarray):
+        if not values.size:
+            return
+        self.samples += values.size
+        self.max = max(self.max, values.max())
+
+        values = np.concatenate((self.pending, values))
+        while len(values) >= self.bucket_size:
+            count = min(self.capacity - self.buckets, len(values) // self.bucket_size)
+            chunk = values[: count * self.bucket_size].reshape(count, self.bucket_size)
+            self.mins[self.buckets : self.buckets + count] = chunk.min(axis=1)
+            self.maxs[self.buckets : self.buckets + count] = chunk.max(axis=1)
+            self.buckets += count
+            values = values[count * self.bucket_size :]
+            if self.buckets == self.capacity:
+                self._merge()
+        self.pending = values
+
+    def _merge(self):
+        half = self.buckets // 2
+        mins, maxs = self.mins[: self.buckets], self.maxs[: self.buckets]
+        self.mins[:half] = np.minimum(mins[0::2], mins[1::2])
+        self.maxs[:half] = np.maximum(maxs[0::2], maxs[1::2])
+        self.buckets = half
+        self.bucket_size *= 2
+
+    def plot(self, ax, color):
+        index = np.arange(self.buckets) * self.bucket_size
+        ax.fill_between(
+            index, self.mins[: self.buckets], self.maxs[: self.buckets], color=color, linewidth=0
+        )
+
+
+def plot(series: Dict[str, DurationSeries]):
+    write, flush = series[WRITE_DURATION], series[FLUSH_DURATION]
+    create, close = series[CREATE_DURATION], series[CLOSE_DURATION]
+
+    _, ax = plt.subplots(2)
+    ax[0].set_title("H5 Call Durations")
+    ax[1].set_xlabel("Frame Index")
+
+    ax[0].set_ylabel("Write Duration (us)", color="tab:blue")
+    ax[0].set_ylim(0, write.max + flush.max)
+    write.plot(ax[0], "tab:blue")
+
+    ax2 = ax[0].twinx()
+    ax2.set_ylabel("Flush Duration (us)", color="tab:red")
+    ax2.set_ylim(write.max + flush.max, 0)
+    flush.plot(ax2, "tab:red")
 
+    ax[1].set_ylabel("Create Duration (us)", color="tab:blue")
+    ax[1].set_ylim(0, create.max + close.max)
+    create.plot(ax[1], "tab:blue")
 
-def iso_time_of_file(file: Path):
-    return strftime(ISO_FORMAT_WTIMEZONE, gmtime(os.path.getmtime(file)))
+    ax2 = ax[1].twinx()
+    ax2.set_ylabel("Close Duration (us)", color="tab:red")
+    ax2.set_ylim(create.max + close.max, 0)
+    close.plot(ax2, "tab:red")
+
+    plt.show()
+
+
+def update_index(index: MetaIndex, stale: List[Tuple[Path, float, int]], workers: int):
+    """Read the stale files and add them to the index"""
+    bar = Bar(
+        "Indexing files...",
+        suffix="%(index)d / %(max)d [ETA: %(eta)ds]",
+        max=len(stale),
+    )
+    stale_paths = [path for path, _, _ in stale]
+    for (path, mtime, size), (_, durations) in zip(
+        stale, read_meta_files(stale_paths, workers)
+    ):
+        index.add(path, mtime, size, durations)
+        bar.next()
+    bar.finish()
+    index.commit()
+
+
+def indexed_slowest(row) -> float:
+    """Return the longest write or flush of an indexed file"""
+    return max(row[f"{WRITE_DURATION}_max"] or 0, row[f"{FLUSH_DURATION}_max"] or 0)
+
+
+def plot_summary(rows: list):
+    """Plot the per-file statistics of indexed files against their mtime"""
+    times = [datetime.fromtimestamp(row["mtime"], timezone.utc) for row in rows]
+
+    def statistic(name, stat):
+        return np.array([row[f"{name}_{stat}"] for row in rows], dtype=float)
+
+    _, ax = plt.subplots(2, sharex=True)
+    ax[0].set_title("H5 Call Durations per File")
+    ax[1].set_xlabel("File Modified (UTC)")
+    pairs = [(WRITE_DURATION, FLUSH_DURATION), (CREATE_DURATION, CLOSE_DURATION)]
+    for axis, names in zip(ax, pairs):
+        axis.set_ylabel("Duration (us)")
+        for name, color in zip(names, ("tab:blue", "tab:red")):
+            label = name.replace("_", " ").capitalize()
+            mean = statistic(name, "total") / statistic(name, "count")
+            axis.plot(times, statistic(name, "max"), ".", color=color, label=f"{label} (max)")
+            axis.plot(times, mean, color=color, linewidth=0.5, label=f"{label} (mean)")
+        axis.legend()
+
+    plt.show()
 
 
 def main():
@@ -71,89 +315,209 @@ def main():
     parser.add_argument(
         "-r", "--recursive", default=False, action="store_true", help="Recursive glob"
     )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        default=os.cpu_count(),
+        type=int,
+        help="Number of processes reading files concurrently",
+    )
+    parser.add_argument(
+        "--max-points",
+        default=0,
+        type=int,
+        help="Downsample each series to this many min/max points for plotting, "
+        "bounding memory use (default: keep every sample)",
+    )
+    parser.add_argument(
+        "--index",
+        default=None,
+        type=Path,
+        help="Index file of per-file statistics, so only new or changed files are read",
+    )
+    parser.add_argument(
+        "--cached",
+        default=False,
+        action="store_true",
+        help="Take files from the index rather than scanning directories (requires --index)",
+    )
+    parser.add_argument(
+        "--summary",
+        default=False,
+        action="store_true",
+        help="Plot per-file statistics from the index rather than every sample "
+        "(requires --index)",
+    )
+    parser.add_argument(
+        "--prune-dirs",
+        default=None,
+        type=float,
+        metavar="SECONDS",
+        help="With --recursive and --start, do not descend into directories last modified "
+        "more than SECONDS before --start. Directory mtimes only change when entries are "
+        "added or removed, so this assumes files finish changing within SECONDS of the "
+        "last entry being added to their directory",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        type=Path,
+        metavar="DIRECTORY",
+        help="Write latency percentiles, histograms and the slowest files to DIRECTORY "
+        "as CSV, JSON, PNG and HTML instead of plotting",
+    )
+    parser.add_argument(
+        "--slowest",
+        default=20,
+        type=int,
+        help="Number of slowest files to rank in the report",
+    )
+    parser.add_argument(
+        "--processes",
+        default=0,
+        type=int,
+        help="Number of FrameProcessors that wrote the files, to report per rank",
+    )
+    parser.add_argument(
+        "--block-size",
+        default=1,
+        type=int,
+        help="Number of consecutive frames written by each FrameProcessor in turn",
+    )
+    parser.add_argument(
+        "--hosts",
+        default=None,
+        type=lambda hosts: hosts.split(","),
+        help="Comma separated hosts of the OdinDataServers, in IOC order, to report per host",
+    )
+    parser.add_argument(
+        "--straggler-factor",
+        default=STRAGGLER_FACTOR,
+        type=float,
+        help="Flag ranks with a mean or p99 write duration this many times the median "
+        "across ranks",
+    )
     args = parser.parse_args()
 
-    dirs = "\n".join([f"  - {str(path)}" for path in args.directories])
-    print(f"Finding files matching {META_SUFFIX} in \n{dirs}")
-    h5_paths = []
-    for root in args.directories:
-        for path in find_meta_files(root, args.recursive):
-            h5_paths.append(path)
-    h5_paths.sort(key=os.path.getmtime)
-
-    if not h5_paths:
-        print("No files found")
-        exit(1)
-
-    if True:
-        start = iso_time_of_file(h5_paths[0])
-        end = iso_time_of_file(h5_paths[-1])
-        print(f"Range: {start} - {end}")
-        #exit(0)
-
-    print(f"Filtering to files between {args.start} and {args.end}")
-    h5_paths = files_between(h5_paths, args.start, args.end)
-
-    if not h5_paths:
+    if (args.cached or args.summary) and args.index is None:
+        parser.error("--cached and --summary require --index")
+    if args.summary and args.report is not None:
+        parser.error("--summary and --report are mutually exclusive")
+    index = MetaIndex(args.index, DURATIONS) if args.index is not None else None
+    roots = [root.resolve() for root in args.directories]
+
+    if args.cached:
+        print(f"Querying {args.index} for files between {args.start} and {args.end}")
+        rows = index.query(roots, timestamp(args.start), timestamp(args.end))
+        h5_files = [(Path(row["path"]), row["mtime"], row["size"]) for row in rows]
+    else:
+        dirs = "\n".join([f"  - {str(path)}" for path in roots])
+        print(f"Finding files matching {META_SUFFIX} in \n{dirs}")
+        prune_before = None
+        if args.prune_dirs is not None and args.start is not None:
+            prune_before = timestamp(args.start) - args.prune_dirs
+        h5_paths, mtimes, sizes = scan_meta_files(roots, args.recursive, prune_before)
+
+        if not h5_paths:
+            print("No files found")
+            exit(1)
+
+        if True:
+            start = iso_time(mtimes[0])
+            end = iso_time(mtimes[-1])
+            print(f"Range: {start} - {end}")
+            #exit(0)
+
+        print(f"Filtering to files between {args.start} and {args.end}")
+        between = files_between(mtimes, args.start, args.end)
+        h5_files = list(
+            zip(h5_paths[between], mtimes[between].tolist(), sizes[between].tolist())
+        )
+
+    if not h5_files:
         print("No files matching range")
         exit(1)
 
-    write_durations = np.array([])
-    flush_durations = np.array([])
-    create_durations = np.array([])
-    close_durations = np.array([])
+    stale = index.stale(h5_files) if index is not None else []
+    if args.summary:
+        update_index(index, stale, args.workers)
+        scanned = {str(path) for path, _, _ in h5_files}
+        rows = [
+            row
+            for row in index.query(roots, timestamp(args.start), timestamp(args.end))
+            if row["path"] in scanned
+        ]
+        index.close()
+
+        for row in rows:
+            if not row["valid"]:
+                print(f"Ignoring {row['path']}")
+            elif indexed_slowest(row) > WARNING_DURATION:
+                print(f" - {row['path']} was slow ({iso_time(row['mtime'])})")
+
+        print("Plotting")
+        plot_summary([row for row in rows if row["valid"]])
+        return
+
+    report, series, optional = None, None, ()
+    if args.report is not None:
+        report = MetaReport(DURATIONS, args.processes, args.block_size, args.hosts)
+        optional = (FRAME_WRITTEN,)
+    elif args.max_points:
+        series = {name: DecimatedDurationSeries(args.max_points) for name in DURATIONS}
+    else:
+        series = {name: DurationSeries() for name in DURATIONS}
+
+    stale = {path: (mtime, size) for path, mtime, size in stale}
     bar = Bar(
         "Reading files...",
         suffix="%(index)d / %(max)d [ETA: %(eta)ds]",
-        max=len(h5_paths),
+        max=len(h5_files),
     )
-    for h5_path in h5_paths:
-        try:
-            with h5.File(h5_path, "r") as h5_file:
-                _write_durations = h5_file[WRITE_DURATION]
-                _flush_durations = h5_file[FLUSH_DURATION]
-                _create_durations = h5_file[CREATE_DURATION]
-                _close_durations = h5_file[CLOSE_DURATION]
-
-                if max(np.append(_write_durations, _flush_durations)) > WARNING_DURATION:
-                    print(f" - {h5_path} was slow ({iso_time_of_file(h5_path)})")
-
-                write_durations = np.append(write_durations, _write_durations)
-                flush_durations = np.append(flush_durations, _flush_durations)
-                create_durations = np.append(create_durations, _create_durations)
-                close_durations = np.append(close_durations, _close_durations)
-        except Exception:
+    h5_paths = [path for path, _, _ in h5_files]
+    h5_mtimes = {path: mtime for path, mtime, _ in h5_files}
+    for h5_path, durations in read_meta_files(h5_paths, args.workers, optional):
+        if h5_path in stale:
+            # Already read, so index it on the way past
+            index.add(h5_path, *stale[h5_path], durations)
+
+        if durations is None:
             print(f"Ignoring {h5_path}")
-            # Probably still open for writing
-            pass
+        else:
+            slowest = max(
+                durations[WRITE_DURATION].max(initial=0),
+                durations[FLUSH_DURATION].max(initial=0),
+            )
+            if slowest > WARNING_DURATION:
+                print(f" - {h5_path} was slow ({iso_time(h5_mtimes[h5_path])})")
+
+            if report is not None:
+                report.add(h5_path, h5_mtimes[h5_path], durations)
+            else:
+                for name in DURATIONS:
+                    series[name].add(durations[name])
         bar.next()
     bar.finish()
+    if index is not None:
+        index.close()
+
+    if report is not None:
+        stragglers = report.write(
+            args.report, args.slowest, [WRITE_DURATION, FLUSH_DURATION], args.straggler_factor
+        )
+        for rank in stragglers:
+            host = f" on {rank['host']}" if rank["host"] else ""
+            print(
+                f" - Rank {rank['rank']}{host} is a straggler: mean {rank['mean']:.0f}us "
+                f"({rank['mean_ratio']:.1f}x median), p99 {rank['p99']:.0f}us "
+                f"({rank['p99_ratio']:.1f}x median) - limits all ranks to "
+                f"{rank['bound_rate']:.0f} frames/s"
+            )
+        print(f"Report written to {args.report / 'report.html'}")
+        return
 
     print("Plotting")
-
-    _, ax = plt.subplots(2)
-    ax[0].set_title("H5 Call Durations")
-    ax[1].set_xlabel("Frame Index")
-
-    ax[0].set_ylabel("Write Duration (us)", color="tab:blue")
-    ax[0].set_ylim(0, write_durations.max() + flush_durations.max())
-    ax[0].plot(write_durations, color="tab:blue", linewidth=0.1)
-
-    ax2 = ax[0].twinx()
-    ax2.set_ylabel("Flush Duration (us)", color="tab:red")
-    ax2.set_ylim(write_durations.max() + flush_durations.max(), 0)
-    ax2.plot(flush_durations, color="tab:red", linewidth=0.1)
-
-    ax[1].set_ylabel("Create Duration (us)", color="tab:blue")
-    ax[1].set_ylim(0, create_durations.max() + close_durations.max())
-    ax[1].plot(create_durations, color="tab:blue", linewidth=0.1)
-
-    ax2 = ax[1].twinx()
-    ax2.set_ylabel("Close Duration (us)", color="tab:red")
-    ax2.set_ylim(create_durations.max() + close_durations.max(), 0)
-    ax2.plot(close_durations, color="tab:red", linewidth=0.1)
-
-    plt.show()
+    plot(series)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,394 @@
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime, timezone
+from html import escape
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from matplotlib.figure import Figure
+
+PERCENTILES = [50, 90, 99, 99.9]
+PERCENTILE_NAMES = [f"p{percentile:g}" for percentile in PERCENTILES]
+# Log spaced histogram bins from 1 us to 1000 s - percentiles are resolved to one bin (~5%)
+BINS_PER_DECADE = 50
+BIN_EDGES = np.logspace(0, 9, 9 * BINS_PER_DECADE + 1)
+# Dataset of frame numbers written, one per write_duration sample
+FRAME_WRITTEN = "frame_written"
+# A rank is a straggler if its mean or p99 is this many times the median across ranks
+STRAGGLER_FACTOR = 2.0
+
+
+class LatencyHistogram:
+    """Histogram of durations in fixed log spaced bins
+
+    Memory does not grow with the number of samples, so it can aggregate any number of
+    files. The first and last bins collect samples below and above BIN_EDGES.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(len(BIN_EDGES) + 1, dtype=np.int64)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, values: np.ndarray):
+        if values.size:
+            bins = np.searchsorted(BIN_EDGES, values, side="right")
+            self.counts += np.bincount(bins, minlength=len(self.counts))
+            self.total += float(values.sum())
+            self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: "LatencyHistogram"):
+        self.counts += other.counts
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def percentiles(self) -> np.ndarray:
+        """Return PERCENTILES as the upper edge of the bin each falls in"""
+        cumulative = np.cumsum(self.counts)
+        targets = np.array(PERCENTILES) / 100 * cumulative[-1]
+        bins = np.searchsorted(cumulative, targets, side="left")
+        return np.minimum(np.append(BIN_EDGES, np.inf)[bins], self.max)
+
+    def summary(self) -> Dict[str, float]:
+        count = self.count
+        if not count:
+            return dict(count=0)
+        return dict(
+            count=count,
+            mean=self.total / count,
+            max=self.max,
+            **dict(zip(PERCENTILE_NAMES, self.percentiles().tolist())),
+        )
+
+
+def summarise(values: np.ndarray) -> Dict[str, float]:
+    """Return the exact count, mean, max and PERCENTILES of values"""
+    if not values.size:
+        return dict(count=0)
+    return dict(
+        count=int(values.size),
+        mean=float(values.mean()),
+        max=float(values.max()),
+        **dict(zip(PERCENTILE_NAMES, np.percentile(values, PERCENTILES).tolist())),
+    )
+
+
+def ratio(value: float, reference: float) -> Optional[float]:
+    """Return value / reference, or None if reference is not positive"""
+    return float(value / reference) if reference > 0 else None
+
+
+class MetaReport:
+    """Latency statistics of meta files per day, per file writer rank and per acquisition
+
+    Days and ranks are aggregated in LatencyHistograms; each meta file is one acquisition
+    and is summarised exactly as it is added.
+
+    Ranks can only be determined if each meta file has a FRAME_WRITTEN dataset and the
+    number of FrameProcessor processes is given. Frames are distributed to processes in
+    blocks of block_size in turn, so rank = (frame // block_size) % processes. Only
+    datasets with one sample per frame written can be attributed to ranks.
+
+    If the hosts of the OdinDataServers are given, in the order of the servers in the
+    IOC, ranks are also grouped by host. The builder assigns ranks to servers in turn, so
+    rank r runs on hosts[r % len(hosts)].
+    """
+
+    def __init__(
+        self,
+        datasets: List[str],
+        processes: int = 0,
+        block_size: int = 1,
+        hosts: List[str] = None,
+    ):
+        self.datasets = datasets
+        self.processes = processes
+        self.block_size = block_size
+        self.hosts = hosts or []
+
+        def histograms():
+            return {name: LatencyHistogram() for name in datasets}
+
+        self.overall = histograms()
+        self.by_day = defaultdict(histograms)
+        self.by_rank = defaultdict(histograms)
+        self.acquisitions = []
+
+    def ranks_of(self, data: Dict[str, np.ndarray]) -> Optional[np.ndarray]:
+        if not self.processes or FRAME_WRITTEN not in data:
+            return None
+        return (data[FRAME_WRITTEN] // self.block_size) % self.processes
+
+    def add(self, path: Path, mtime: float, data: Dict[str, np.ndarray]):
+        day = datetime.fromtimestamp(mtime, timezone.utc).date().isoformat()
+        ranks = self.ranks_of(data)
+
+        acquisition = dict(path=str(path), mtime=mtime)
+        for name in self.datasets:
+            values = data[name]
+            self.overall[name].add(values)
+            self.by_day[day][name].add(values)
+            acquisition[name] = summarise(values)
+
+            if ranks is not None and len(ranks) == len(values):
+                for rank in np.unique(ranks):
+                    self.by_rank[int(rank)][name].add(values[ranks == rank])
+
+        self.acquisitions.append(acquisition)
+
+    def host_of(self, rank: int) -> str:
+        return self.hosts[rank % len(self.hosts)] if self.hosts else ""
+
+    def by_host(self) -> Dict[str, Dict[str, LatencyHistogram]]:
+        """Return the rank histograms merged per host"""
+        hosts = {}
+        for rank, histograms in self.by_rank.items():
+            merged = hosts.setdefault(
+                self.host_of(rank), {name: LatencyHistogram() for name in self.datasets}
+            )
+            for name in self.datasets:
+                merged[name].merge(histograms[name])
+        return hosts
+
+    def rank_throughput(self, name: str, factor: float = STRAGGLER_FACTOR) -> List[dict]:
+        """Compare ranks by the given dataset and flag stragglers
+
+        Each rank writes 1/processes of the frames, so the slowest rank bounds the rate of
+        all of them: the combined rate is at most processes * the slowest rank's rate.
+
+        Returns:
+            A row per rank with its mean and p99, their ratio to the median across ranks,
+            the frame rate the mean duration allows and whether it is a straggler
+
+        """
+        ranks = sorted(rank for rank in self.by_rank if self.by_rank[rank][name].count)
+        if not ranks:
+            return []
+
+        summaries = [self.by_rank[rank][name].summary() for rank in ranks]
+        means = np.array([summary["mean"] for summary in summaries])
+        p99s = np.array([summary["p99"] for summary in summaries])
+        median_mean = np.median(means)
+        median_p99 = np.median(p99s)
+        # Durations are in us. A zero duration, as for an empty phase, bounds no rate
+        rates = [float(1e6 / mean) if mean > 0 else None for mean in means]
+        limited = [rate for rate in rates if rate is not None]
+        bound_rate = min(limited) * len(ranks) if limited else None
+
+        rows = []
+        for rank, mean, p99, rate in zip(ranks, means, p99s, rates):
+            mean_ratio = ratio(mean, median_mean)
+            p99_ratio = ratio(p99, median_p99)
+            rows.append(
+                dict(
+                    rank=rank,
+                    host=self.host_of(rank),
+                    mean=mean,
+                    p99=p99,
+                    mean_ratio=mean_ratio,
+                    p99_ratio=p99_ratio,
+                    max_rate=rate,
+                    bound_rate=bound_rate,
+                    straggler=any(
+                        value is not None and value > factor
+                        for value in (mean_ratio, p99_ratio)
+                    ),
+                )
+            )
+        return rows
+
+    def slowest(self, count: int, names: List[str]) -> List[dict]:
+        """Return the count acquisitions with the longest max of the given datasets"""
+
+        def longest(acquisition):
+            return max(acquisition[name].get("max", 0) for name in names)
+
+        return sorted(self.acquisitions, key=longest, reverse=True)[:count]
+
+    def grouped_rows(self, groups: dict, group_name: str) -> List[dict]:
+        return [
+            {group_name: group, "dataset": name, **histograms[name].summary()}
+            for group, histograms in sorted(groups.items())
+            for name in self.datasets
+            if histograms[name].count
+        ]
+
+    def acquisition_rows(self, acquisitions: List[dict]) -> List[dict]:
+        return [
+            {"acquisition": acquisition["path"], "dataset": name, **acquisition[name]}
+            for acquisition in acquisitions
+            for name in self.datasets
+        ]
+
+    def write(
+        self,
+        directory: Path,
+        slowest: int = 20,
+        slow_datasets: List[str] = None,
+        straggler_factor: float = STRAGGLER_FACTOR,
+    ) -> List[dict]:
+        """Write CSV, JSON, PNG and HTML reports into directory
+
+        Args:
+            directory: Directory to write into, created if necessary
+            slowest: Number of acquisitions to list in the slowest ranking
+            slow_datasets: Datasets to rank acquisitions by and compare ranks by the first
+                of (default: all)
+            straggler_factor: Ratio to the median across ranks to flag stragglers at
+
+        Returns:
+            The rank_throughput rows of stragglers
+
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        slow_datasets = slow_datasets or self.datasets
+        slowest_acquisitions = self.slowest(slowest, slow_datasets)
+        ranks = self.rank_throughput(slow_datasets[0], straggler_factor)
+
+        tables = {
+            "overall": self.grouped_rows({"all": self.overall}, "group"),
+            "by_day": self.grouped_rows(self.by_day, "day"),
+            "by_rank": self.grouped_rows(self.by_rank, "rank"),
+            "by_host": self.grouped_rows(self.by_host(), "host") if self.hosts else [],
+            "rank_throughput": ranks,
+            "by_acquisition": self.acquisition_rows(self.acquisitions),
+            "slowest": self.acquisition_rows(slowest_acquisitions),
+        }
+        for table, rows in tables.items():
+            write_csv(directory / f"{table}.csv", rows)
+        with open(directory / "report.json", "w") as f:
+            json.dump(
+                {table: rows for table, rows in tables.items() if table != "by_acquisition"},
+                f,
+                indent=2,
+            )
+
+        self.plot_histograms(directory / "histograms.png")
+        self.plot_by_day(directory / "percentiles_by_day.png")
+        images = ["histograms.png", "percentiles_by_day.png"]
+        if ranks:
+            self.plot_by_rank(directory / "percentiles_by_rank.png", ranks)
+            images.append("percentiles_by_rank.png")
+        write_html(
+            directory / "report.html",
+            [
+                ("Overall", tables["overall"]),
+                ("Per Day", tables["by_day"]),
+                (f"Rank Throughput ({slow_datasets[0]})", tables["rank_throughput"]),
+                ("Per Rank", tables["by_rank"]),
+                ("Per Host", tables["by_host"]),
+                (f"Slowest {len(slowest_acquisitions)} Acquisitions", tables["slowest"]),
+            ],
+            images,
+        )
+
+        return [rank for rank in ranks if rank["straggler"]]
+
+    def plot_histograms(self, path: Path):
+        figure = Figure(figsize=(12, 8))
+        for idx, name in enumerate(self.datasets):
+            ax = figure.add_subplot(2, (len(self.datasets) + 1) // 2, idx + 1)
+            # Counts below and above BIN_EDGES are not drawn
+            ax.stairs(self.overall[name].counts[1:-1], BIN_EDGES, fill=True)
+            ax.set_xscale("log")
+            ax.set_title(name)
+            ax.set_xlabel("Duration (us)")
+            ax.set_ylabel("Count")
+        figure.tight_layout()
+        figure.savefig(path)
+
+    def plot_by_day(self, path: Path):
+        days = sorted(self.by_day)
+        figure = Figure(figsize=(12, 8))
+        for idx, name in enumerate(self.datasets):
+            ax = figure.add_subplot(2, (len(self.datasets) + 1) // 2, idx + 1)
+            percentiles = np.array(
+                [self.by_day[day][name].percentiles() for day in days]
+            ).reshape(len(days), len(PERCENTILES))
+            for column, label in enumerate(PERCENTILE_NAMES):
+                ax.plot(days, percentiles[:, column], marker=".", label=label)
+            ax.set_yscale("log")
+            ax.set_title(name)
+            ax.set_ylabel("Duration (us)")
+            ax.tick_params(axis="x", labelrotation=45)
+            ax.legend()
+        figure.tight_layout()
+        figure.savefig(path)
+
+    def plot_by_rank(self, path: Path, ranks: List[dict]):
+        """Plot the percentiles of each rank side by side, with stragglers in red"""
+        names = [name for name in self.datasets if any(
+            self.by_rank[rank["rank"]][name].count for rank in ranks
+        )]
+        labels = [
+            f"{rank['rank']} ({rank['host']})" if rank["host"] else str(rank["rank"])
+            for rank in ranks
+        ]
+        positions = np.arange(len(ranks))
+        width = 0.8 / len(PERCENTILES)
+
+        figure = Figure(figsize=(max(8, len(ranks) * 0.6), 4 * len(names)))
+        for idx, name in enumerate(names):
+            ax = figure.add_subplot(len(names), 1, idx + 1)
+            percentiles = np.array(
+                [self.by_rank[rank["rank"]][name].percentiles() for rank in ranks]
+            )
+            for column, label in enumerate(PERCENTILE_NAMES):
+                ax.bar(positions + column * width, percentiles[:, column], width, label=label)
+            ax.set_xticks(positions + width * (len(PERCENTILES) - 1) / 2)
+            ax.set_xticklabels(labels, rotation=45, ha="right")
+            for tick, rank in zip(ax.get_xticklabels(), ranks):
+                if rank["straggler"]:
+                    tick.set_color("tab:red")
+            ax.set_yscale("log")
+            ax.set_title(f"{name} per rank")
+            ax.set_ylabel("Duration (us)")
+            ax.legend()
+        figure.tight_layout()
+        figure.savefig(path)
+
+
+def write_csv(path: Path, rows: List[dict]):
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_html(path: Path, tables: List[tuple], images: List[str]):
+    def cell(value):
+        if value is None:
+            return ""
+        return f"{value:.1f}" if isinstance(value, float) else escape(str(value))
+
+    sections = []
+    for title, rows in tables:
+        sections.append(f"<h2>{escape(title)}</h2>")
+        if not rows:
+            sections.append("<p>None</p>")
+            continue
+        fields = list(dict.fromkeys(field for row in rows for field in row))
+        sections.append("<table>")
+        sections.append("<tr>" + "".join(f"<th>{escape(f)}</th>" for f in fields) + "</tr>")
+        for row in rows:
+            sections.append(
+                "<tr>" + "".join(f"<td>{cell(row.get(f, ''))}</td>" for f in fields) + "</tr>"
+            )
+        sections.append("</table>")
+    sections.extend(f'<img src="{escape(image)}">' for image in images)
+
+    with open(path, "w") as f:
+        f.write(
+            "<html><head><title>Meta File Latency Report</title>"
+            "<style>td, th { padding: 2px 8px; text-align: right }</style></head><body>"
+            "<h1>Meta File Latency Report</h1>\n"
+            + "\n".join(sections)
+            + "\n</body></html>\n"
+        )
@@ -1,17 +1,54 @@
 import argparse
+import csv
 import ctypes
+import json
 import logging
 from datetime import datetime
 from os import makedirs
 from pathlib import Path
-from time import sleep
+from time import monotonic, sleep
 
-from cothread import Event
+from cothread import Pulse, Timedout
 from cothread.catools import DBR_CHAR_STR, ca_nothing, caget, camonitor, caput
-from timeout_decorator import TimeoutError, timeout
 
 WAIT_PV_TIMEOUT_SECONDS = 30
 ACQ_TIME_DELTA = 1e-7
+# Time to allow after the expected end of an acquisition when not file writing
+ACQUISITION_SETTLE_SECONDS = 1
+
+# Columns of the benchmark results table, in order
+RESULT_FIELDS = [
+    "ID",
+    "time",
+    "success",
+    "acquire_period",
+    "num_images",
+    "target_fps",
+    "arm_time",
+    "time_to_first_frame",
+    "time_to_capture_complete",
+    "frames_captured",
+    "missing_frames",
+    "achieved_fps",
+    "fp_errors",
+    "filename",
+    "filepath",
+]
+# Columns of the sweep stability map, in order
+STABILITY_FIELDS = [
+    "acquire_period",
+    "frame_rate",
+    "num_images",
+    "attempts",
+    "successes",
+    "status",
+]
+# Stability of a sweep point
+STABLE = "stable"  # Every acquisition succeeded
+BORDERLINE = "borderline"  # Succeeded on retry
+UNSTABLE = "unstable"  # Failed more than the retries allowed
+SKIPPED = "skipped"  # Not attempted, as a slower or smaller point was unstable
+STATUS_SYMBOLS = {STABLE: "ok", BORDERLINE: "~", UNSTABLE: "X", SKIPPED: "-"}
 
 
 class EigerUnreachableError(Exception):
@@ -22,11 +59,71 @@ class FPError(Exception):
     pass
 
 
+class MonitorCache:
+    """Latest values of monitored PVs, kept for the life of the cache
+
+    Each PV is monitored on first use and the monitor is kept open, so waits resolve from
+    the cached value immediately and are woken by updates as they arrive, rather than
+    connecting a new monitor for every wait. Timeouts are cothread timeouts, so they do
+    not interrupt channel access with signals.
+    """
+
+    def __init__(self):
+        self.monitors = {}
+        self.values = {}
+        self.listeners = {}
+        self.updated = Pulse()
+
+    def monitor(self, pv, datatype=None):
+        key = (pv, datatype)
+        if key not in self.monitors:
+
+            def update(value):
+                self.values[key] = value
+                for listener in list(self.listeners.get(key, [])):
+                    listener(value)
+                self.updated.Signal()
+
+            self.monitors[key] = camonitor(pv, update, datatype=datatype)
+        return key
+
+    def wait(self, pv, condition, timeout_seconds, datatype=None):
+        """Wait until the value of pv satisfies condition and return it
+
+        Raises:
+            TimeoutError: If it does not within timeout_seconds
+
+        """
+        key = self.monitor(pv, datatype)
+        deadline = monotonic() + timeout_seconds
+        while key not in self.values or not condition(self.values[key]):
+            try:
+                self.updated.Wait(max(deadline - monotonic(), 0))
+            except Timedout:
+                raise TimeoutError(f"Timed out after {timeout_seconds}s waiting on {pv}")
+        return self.values[key]
+
+    def add_listener(self, pv, listener, datatype=None):
+        """Call listener with each update of pv"""
+        key = self.monitor(pv, datatype)
+        self.listeners.setdefault(key, []).append(listener)
+
+    def remove_listener(self, pv, listener, datatype=None):
+        self.listeners[(pv, datatype)].remove(listener)
+
+    def close(self):
+        for monitor in self.monitors.values():
+            monitor.close()
+        self.monitors.clear()
+        self.values.clear()
+
+
 class EigerTestDetector:
     def __init__(self, pv_stem: str, file_writing_enabled: bool, fp_count: int):
         self.pv_stem = pv_stem
         self.file_writing_enabled = file_writing_enabled
         self.fp_count = fp_count
+        self.monitors = MonitorCache()
 
         # We will increment this value each time we complete an acq
         self.acquisition_id = 1
@@ -48,32 +145,12 @@ class EigerTestDetector:
         timeout_seconds=WAIT_PV_TIMEOUT_SECONDS,
         datatype=None,
     ):
-        @timeout(timeout_seconds)
-        def timeout_wait_on_pv_to_val(param, desired_value):
-            current_value = caget(f"{self.pv_stem}:{param}", datatype=datatype)
-            if current_value != desired_value:
-                done = Event()
-
-                def check_equals_desired(value):
-                    if value == desired_value:
-                        done.Signal()
-
-                logging.debug(
-                    f"Waiting for {self.pv_stem}:{param} to be {desired_value}"
-                )
-                m = camonitor(
-                    f"{self.pv_stem}:{param}", check_equals_desired, datatype=datatype
-                )
-                done.Wait()
-                m.close()
-                logging.debug(f"{self.pv_stem}:{param} now equal to {desired_value}")
-            else:
-                logging.debug(
-                    f"Checked {self.pv_stem}:{param} once and it was already equal "
-                    + f"to {desired_value}"
-                )
-
-        return timeout_wait_on_pv_to_val(param, desired_value)
+        pv = f"{self.pv_stem}:{param}"
+        logging.debug(f"Waiting for {pv} to be {desired_value}")
+        self.monitors.wait(
+            pv, lambda value: value == desired_value, timeout_seconds, datatype
+        )
+        logging.debug(f"{pv} now equal to {desired_value}")
 
     def put(self, param, val, datatype=None, wait=True):
         caput(f"{self.pv_stem}:{param}", val, datatype=datatype, wait=wait, timeout=10)
@@ -83,24 +160,55 @@ class EigerTestDetector:
         logging.debug(f"Called caget {param}")
         return caget(f"{self.pv_stem}:{param}", datatype=datatype, timeout=10)
 
+    def put_many(self, params, datatype=None, wait=True):
+        """Put independent params in parallel
+
+        Args:
+            params(dict): {param: value}
+            datatype: Datatype to put all values as
+            wait: Wait for all puts to complete
+
+        """
+        caput(
+            [f"{self.pv_stem}:{param}" for param in params],
+            list(params.values()),
+            datatype=datatype,
+            wait=wait,
+            timeout=10,
+        )
+        logging.debug(f"Put {params}")
+
+    def get_many(self, params, datatype=None):
+        """Get params in parallel and return their values in the same order"""
+        logging.debug(f"Called caget {params}")
+        return caget(
+            [f"{self.pv_stem}:{param}" for param in params], datatype=datatype, timeout=10
+        )
+
     def put_eiger_params(self, acquire_period, num_images):
-        self.put("CAM:ManualTrigger", "Yes")
+        self.put_many(
+            {
+                "CAM:ManualTrigger": "Yes",
+                "CAM:ImageMode": "Multiple",
+                "CAM:NumImages": num_images,
+                "CAM:TriggerMode": "Internal Series",
+                "CAM:NumTriggers": 1,
+                "CAM:StreamEnable": "Yes",
+            }
+        )
+        # The acquire period must not be less than the acquire time, so set them in order
         self.put("CAM:AcquireTime", acquire_period - ACQ_TIME_DELTA)
         self.put("CAM:AcquirePeriod", acquire_period)
-        self.put("CAM:ImageMode", "Multiple")
-        self.put("CAM:NumImages", num_images)
-        self.put("CAM:TriggerMode", "Internal Series")
-        self.put("CAM:NumTriggers", 1)
-        self.put("CAM:StreamEnable", "Yes")
 
     def put_odin_params(self, file_name, file_path):
-        self.put("OD:FileName", str(file_name), datatype=DBR_CHAR_STR)
+        self.put_many(
+            {"OD:FileName": str(file_name), "OD:FilePath": str(file_path)},
+            datatype=DBR_CHAR_STR,
+        )
         # Make sure FileName propagates through database logic
         self.wait_on_pv_to_val("OD:META:FileName_RBV", file_name, datatype=DBR_CHAR_STR)
         self.wait_on_pv_to_val("OD:AcquisitionID_RBV", file_name, datatype=DBR_CHAR_STR)
 
-        self.put("OD:FilePath", str(file_path), datatype=DBR_CHAR_STR)
-
         # Get number of frames to wait for
         num_capture = self.get("CAM:NumImages")
         self.put("OD:NumCapture", num_capture)
@@ -117,20 +225,72 @@ class EigerTestDetector:
         self.wait_on_pv_to_val("OD:Capture_RBV", 1)
         self.wait_on_pv_to_val("OD:META:Writing_RBV", 1)
 
-    def acquire_manual_trigger(self, wait_time):
+    def acquire_manual_trigger(self, wait_time, acquisition_time=10):
+        """Arm, trigger and wait for the acquisition to complete
+
+        Without file writing there is nothing to wait on, so this sleeps for
+        acquisition_time instead.
+
+        Returns:
+            dict of seconds taken to arm, and from the trigger to the first frame being
+            captured and to capture completing, where they can be measured
+
+        """
+        timing = {}
+        start = monotonic()
         self.put("CAM:Acquire", 1, wait=False)
 
         # Wait on fan ready (this waits on detector armed itself)
         if self.file_writing_enabled:
             self.wait_on_pv_to_val("OD:FAN:StateReady_RBV", 1)
-        self.put("CAM:Trigger", 1)
+            timing["arm_time"] = monotonic() - start
+
+        # Listen before triggering, as the trigger put may not return until frames arrive
+        first_frame = []
+        num_captured = f"{self.pv_stem}:OD:NumCaptured_RBV"
+
+        def record_first_frame(captured):
+            if captured > 0 and not first_frame:
+                first_frame.append(monotonic())
 
-        # Block until all images are received then return to allow disarm
         if self.file_writing_enabled:
-            self.wait_on_pv_to_val("OD:Capture_RBV", 0, wait_time)
-        else:
-            sleep(10)
-            print("Finished sleep - file writing should be complete")
+            self.monitors.add_listener(num_captured, record_first_frame)
+
+        try:
+            triggered = monotonic()
+            self.put("CAM:Trigger", 1)
+
+            # Block until all images are received then return to allow disarm
+            if self.file_writing_enabled:
+                self.wait_on_pv_to_val("OD:Capture_RBV", 0, wait_time)
+                timing["time_to_capture_complete"] = monotonic() - triggered
+            else:
+                sleep(acquisition_time)
+                print("Finished sleep - file writing should be complete")
+        finally:
+            if self.file_writing_enabled:
+                self.monitors.remove_listener(num_captured, record_first_frame)
+
+        if first_frame:
+            timing["time_to_first_frame"] = first_frame[0] - triggered
+
+        return timing
+
+    def get_capture_statistics(self, num_images, timing):
+        """Return the frames captured, missing frames and achieved frame rate"""
+        captured = int(self.get("OD:NumCaptured_RBV"))
+        statistics = {
+            "frames_captured": captured,
+            "missing_frames": num_images - captured,
+        }
+
+        # Rate between the first frame and the last, once capture completed
+        first = timing.get("time_to_first_frame")
+        complete = timing.get("time_to_capture_complete")
+        if first is not None and complete is not None and captured > 1 and complete > first:
+            statistics["achieved_fps"] = (captured - 1) / (complete - first)
+
+        return statistics
 
     def disarm(self):
         if self.file_writing_enabled:
@@ -140,29 +300,27 @@ class EigerTestDetector:
     def clear_previous_acquisition_failures(self):
         self.disarm()
         if self.file_writing_enabled:
+            # Stopping capture may raise errors of its own, so clear errors afterwards
             self.put("OD:Capture", 0)
             self.clear_fp_errors()
 
+    def fp_params(self, param, value=None):
+        """Return {OD<n>:<param>: value} for each frame processor"""
+        return {f"OD{fp}:{param}": value for fp in range(1, self.fp_count + 1)}
+
     def clear_fp_errors(self):
-        for fp in range(1, self.fp_count + 1):
-            self.put(f"OD{fp}:FPClearErrors", 1)
+        self.put_many(self.fp_params("FPClearErrors", 1))
 
     def get_fp_errors(self):
         # Check for file writer errors
         fp_errors = [
-            "".join(
-                str(
-                    ctypes.string_at(self.get(f"OD{fp}:FPErrorMessage_RBV").ctypes.data)
-                )
-            )
-            for fp in range(1, self.fp_count + 1)
+            "".join(str(ctypes.string_at(message.ctypes.data)))
+            for message in self.get_many(self.fp_params("FPErrorMessage_RBV"))
         ]
         return fp_errors
 
     def get_num_fp_errors(self):
-        fp_states = [
-            self.get(f"OD{fp}:FPErrorState_RBV") for fp in range(1, self.fp_count + 1)
-        ]
+        fp_states = self.get_many(self.fp_params("FPErrorState_RBV"))
         return sum(fp_states)
 
     def prepare_and_run_acquisition(
@@ -170,6 +328,7 @@ class EigerTestDetector:
     ):
         now = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
         success = False
+        timing = {}
 
         logging.info(f"Attempting acq with ID {self.acquisition_id}")
         try:
@@ -177,17 +336,18 @@ class EigerTestDetector:
             self.put_eiger_params(acquire_period, num_images)
             if self.file_writing_enabled:
                 self.put_odin_params(filename, filepath)
-            self.acquire_manual_trigger(
-                WAIT_PV_TIMEOUT_SECONDS + acquire_period * num_images
+            timing = self.acquire_manual_trigger(
+                WAIT_PV_TIMEOUT_SECONDS + acquire_period * num_images,
+                ACQUISITION_SETTLE_SECONDS + acquire_period * num_images,
             )
             self.disarm()
             if self.file_writing_enabled:
+                timing.update(self.get_capture_statistics(num_images, timing))
                 if self.get_num_fp_errors():
                     # If we have fp errors, set success to False and raise an error
                     success = False
                     raise FPError("One or more FP in error state")
-            else:
-                success = True
+            success = True
         except TimeoutError:
             logging.error("Acquisition failed due to wait for PV timeout")
             raise
@@ -208,12 +368,132 @@ class EigerTestDetector:
                 "filepath": filepath,
                 "acquire_period": acquire_period,
                 "num_images": num_images,
+                "target_fps": 1 / acquire_period,
+                **timing,
             }
             self.acquisition_log.append(acquisition_parameters)
             self.acquisition_id += 1
             logging.info(f"Acq parameters: {acquisition_parameters}")
 
 
+def write_results(rows, path: Path, fields=RESULT_FIELDS):
+    """Write rows as a results table - JSON if path ends .json, else CSV of fields"""
+    if path.suffix == ".json":
+        with open(path, "w") as f:
+            json.dump(rows, f, indent=2, default=str)
+    else:
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def run_sweep_point(detector, filename, file_path, acquire_period, num_images, args):
+    """Run one point of a sweep until it succeeds args.runs times or fails too often
+
+    A point that fails is retried up to args.retries times, so a borderline point is
+    distinguished from one that is reliably unstable.
+
+    Returns:
+        (attempts, successes, status)
+
+    """
+    runs = max(args.runs, 1)
+    attempts = successes = 0
+    while successes < runs and attempts - successes <= args.retries:
+        try:
+            detector.prepare_and_run_acquisition(
+                f"{filename}_{attempts}", file_path, acquire_period, num_images
+            )
+            successes += 1
+        except Exception:
+            logging.exception(f"Sweep acquisition {filename}_{attempts} failed")
+        finally:
+            attempts += 1
+            if args.benchmark is not None:
+                write_results(detector.acquisition_log, args.benchmark)
+        if args.delay:
+            sleep(args.delay)
+
+    if successes < runs:
+        status = UNSTABLE
+    elif attempts > successes:
+        status = BORDERLINE
+    else:
+        status = STABLE
+    return attempts, successes, status
+
+
+def sweep(detector, args):
+    """Map the stability of the grid of acquire periods and image counts
+
+    Each image count is swept from the slowest frame rate up, stopping at the first
+    unstable point. Faster points are then skipped for larger image counts too, on the
+    basis that acquiring more images at a rate is no more reliable than fewer.
+
+    Returns:
+        A row per point of the grid, ordered by image count then frame rate
+
+    """
+    periods = sorted({period for period, _ in args.parameter_list}, reverse=True)
+    image_counts = sorted({num_images for _, num_images in args.parameter_list})
+
+    points = []
+    unstable_period = None  # Fastest rate that has been found unstable
+    for num_images in image_counts:
+        for period in periods:
+            point = {
+                "acquire_period": period,
+                "frame_rate": 1 / period,
+                "num_images": num_images,
+                "attempts": 0,
+                "successes": 0,
+                "status": SKIPPED,
+            }
+            if unstable_period is None or period > unstable_period:
+                logging.info(f"Sweep point {period} s x {num_images} images")
+                point["attempts"], point["successes"], point["status"] = run_sweep_point(
+                    detector,
+                    f"{args.filename}_sweep{len(points)}",
+                    args.filepath,
+                    period,
+                    num_images,
+                    args,
+                )
+                if point["status"] == UNSTABLE:
+                    unstable_period = period
+            points.append(point)
+            if args.stability_map is not None:
+                write_results(points, args.stability_map, STABILITY_FIELDS)
+
+    return points
+
+
+def format_stability_map(points):
+    """Return the points of a sweep as a table of image counts by frame rate"""
+    rates = sorted({point["frame_rate"] for point in points})
+    image_counts = sorted({point["num_images"] for point in points})
+    status = {(point["frame_rate"], point["num_images"]): point["status"] for point in points}
+
+    lines = ["images \\ fps " + "".join(f"{rate:>10g}" for rate in rates)]
+    for num_images in image_counts:
+        lines.append(
+            f"{num_images:>13} "
+            + "".join(f"{STATUS_SYMBOLS[status[rate, num_images]]:>10}" for rate in rates)
+        )
+
+    reliable = [point for point in points if point["status"] == STABLE]
+    if reliable:
+        best = max(reliable, key=lambda point: (point["num_images"], point["frame_rate"]))
+        lines.append(
+            f"Highest reliable rate at {best['num_images']} images: "
+            f"{best['frame_rate']:g} fps"
+        )
+    else:
+        lines.append("No stable points")
+    return "\n".join(lines)
+
+
 def parse_args():
     def parameter_pair(arg):
         test = arg.split(",")
@@ -286,6 +566,35 @@ def parse_args():
     parser.add_argument(
         "--fp-count", default=4, type=int, help="Number of frame processors"
     )
+    parser.add_argument(
+        "--benchmark",
+        default=None,
+        type=Path,
+        metavar="RESULTS",
+        help="Record arm time, time to first frame and to capture complete, achieved "
+        + "frame rate and missing frames of each acquisition in RESULTS (.csv or .json), "
+        + "continuing after failed acquisitions",
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        default=False,
+        help="Sweep every combination of the acquire periods and image counts in "
+        + "parameter_list, from the slowest frame rate up, and map where acquisitions "
+        + "are stable. Each point is run --runs times",
+    )
+    parser.add_argument(
+        "--retries",
+        default=1,
+        type=int,
+        help="Number of failures allowed at a sweep point before it is unstable",
+    )
+    parser.add_argument(
+        "--stability-map",
+        default=None,
+        type=Path,
+        help="File to write the sweep stability map to (.csv or .json)",
+    )
 
     args = parser.parse_args()
 
@@ -307,6 +616,12 @@ def main():
 
     detector = EigerTestDetector(args.pv_stem, not args.no_file_writing, args.fp_count)
 
+    if args.sweep:
+        stability_map = format_stability_map(sweep(detector, args))
+        logging.info(f"Stability map:\n{stability_map}")
+        print(stability_map)
+        return
+
     file_path = args.filepath
     run = 0
     while True:
@@ -319,9 +634,18 @@ def main():
         # Note odin requires different file names for sequential acquisitions
         for id, (acquire_period, num_images) in enumerate(args.parameter_list):
             filename = f"{args.filename}_{run}_{id}"
-            detector.prepare_and_run_acquisition(
-                filename, file_path, acquire_period, num_images
-            )
+            try:
+                detector.prepare_and_run_acquisition(
+                    filename, file_path, acquire_period, num_images
+                )
+            except Exception:
+                if args.benchmark is None:
+                    raise
+                # Failures are results - record them and move on to the next
+                logging.exception(f"Acquisition {filename} failed")
+            finally:
+                if args.benchmark is not None:
+                    write_results(detector.acquisition_log, args.benchmark)
             if args.delay:
                 logging.debug(f"Acquisition complete - Waiting {args.delay} seconds")
                 sleep(args.delay)
@@ -0,0 +1,366 @@
+import argparse
+import logging
+import threading
+from datetime import datetime
+from time import monotonic
+
+import cothread
+import numpy as np
+import zmq
+from softioc import builder, softioc
+
+from .eiger_simulator import EigerStreamSimulator, add_simulator_arguments
+
+# Interval between polls of the frames captured while capturing
+CAPTURE_UPDATE_SECONDS = 0.05
+STRING_LENGTH = 256
+STATUS_TIMEOUT_MS = 1000
+# FrameProcessor control ports allocated by the builder, one block of ports per process
+FP_BASE_CTRL_PORT = 10004
+FP_CTRL_PORT_STEP = 10
+# Parts of an image message in the Eiger stream
+IMAGE_PARTS = 4
+
+
+class FrameProcessorWriters:
+    """The HDF writers of the FrameProcessors, configured and polled as ADOdin does
+
+    The frames captured are the sum of the frames processed by each writer, as in
+    OD:NumCaptured_RBV of ADOdin. Methods are called from a single capture thread, as
+    the sockets are not thread safe.
+    """
+
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self.sockets = None
+        self.request_id = 0
+
+    def connect(self):
+        if self.sockets is None:
+            context = zmq.Context.instance()
+            self.sockets = []
+            for endpoint in self.endpoints:
+                socket = context.socket(zmq.DEALER)
+                socket.setsockopt(zmq.LINGER, 0)
+                socket.connect(f"tcp://{endpoint}")
+                self.sockets.append(socket)
+
+    def request(self, socket, msg_val, params):
+        """Send a command to a FrameProcessor and return the reply params, or None"""
+        self.request_id += 1
+        socket.send_json(
+            {
+                "msg_type": "cmd",
+                "id": self.request_id,
+                "msg_val": msg_val,
+                "params": params,
+                "timestamp": datetime.now().isoformat(),
+            }
+        )
+        # Discard late replies to earlier requests that timed out
+        while socket.poll(STATUS_TIMEOUT_MS):
+            reply = socket.recv_json()
+            if reply.get("id") == self.request_id:
+                return reply.get("params", {})
+        return None
+
+    def start(self, path, name, frames):
+        self.connect()
+        config = {
+            "hdf": {
+                "file": {"path": path, "name": name},
+                "frames": frames,
+                "acquisition_id": name,
+                "write": True,
+            }
+        }
+        for endpoint, socket in zip(self.endpoints, self.sockets):
+            if self.request(socket, "configure", config) is None:
+                logging.warning(f"No reply to configure from FrameProcessor {endpoint}")
+
+    def stop(self):
+        for socket in self.sockets:
+            self.request(socket, "configure", {"hdf": {"write": False}})
+
+    def status(self):
+        """Return the frames captured and whether any writer is still writing"""
+        captured, writing = 0, False
+        for endpoint, socket in zip(self.endpoints, self.sockets):
+            status = self.request(socket, "status", {})
+            if status is None:
+                logging.warning(f"No status from FrameProcessor {endpoint}")
+                # Assume it is still writing, so capture does not complete early
+                writing = True
+                continue
+            hdf = status.get("hdf", {})
+            captured += int(hdf.get("frames_processed", 0))
+            writing = writing or bool(hdf.get("writing", False))
+        return captured, writing
+
+
+class StreamSink:
+    """Consume and discard the stream, for running without EigerFan
+
+    The frames captured are the images the sink has received since capture started.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint.replace("*", "127.0.0.1")
+        self.received = 0
+        self.frames = 0
+        threading.Thread(target=self.drain, daemon=True).start()
+
+    def drain(self):
+        socket = zmq.Context.instance().socket(zmq.PULL)
+        socket.connect(self.endpoint)
+        while True:
+            if len(socket.recv_multipart(copy=False)) == IMAGE_PARTS:
+                self.received += 1
+
+    def start(self, path, name, frames):
+        self.received = 0
+        self.frames = frames
+
+    def stop(self):
+        pass
+
+    def status(self):
+        # As for the writers, 0 frames captures until stopped
+        return self.received, not self.frames or self.received < self.frames
+
+
+class EigerPVShim:
+    """Soft IOC serving the CAM: and OD: PVs the acquisition harness uses
+
+    Stands in for the Eiger and ADOdin IOCs: arming starts a series on an
+    EigerStreamSimulator and triggering streams NumImages frames at 1 / AcquirePeriod.
+    Capturing starts the writers, and OD:NumCaptured_RBV counts the frames they have
+    captured. Capture completes once the writers stop writing.
+    """
+
+    def __init__(self, simulator, writers, bit_depth, fp_count):
+        self.simulator = simulator
+        self.writers = writers
+        self.armed = False
+        # Whether the armed series has been triggered, so stream() ends it
+        self.triggered = False
+        self.streaming = None
+        self.capturing = None
+        self.stop_capture = threading.Event()
+        self.captured = 0
+
+        def out(record, name, *args, **kwargs):
+            return record(name, *args, always_update=True, **kwargs)
+
+        # Eiger
+        builder.stringIn("CAM:PortName_RBV", initial_value="EIG.CAM")
+        out(builder.mbbOut, "CAM:ManualTrigger", "No", "Yes")
+        out(builder.aOut, "CAM:AcquireTime", initial_value=0.1, PREC=7)
+        self.acquire_period = out(
+            builder.aOut, "CAM:AcquirePeriod", initial_value=0.1, PREC=7
+        )
+        out(builder.mbbOut, "CAM:ImageMode", "Single", "Multiple", "Continuous")
+        self.num_images = out(builder.longOut, "CAM:NumImages", initial_value=1)
+        out(
+            builder.mbbOut,
+            "CAM:TriggerMode",
+            "Internal Series",
+            "Internal Enable",
+            "External Series",
+            "External Enable",
+        )
+        out(builder.longOut, "CAM:NumTriggers", initial_value=1)
+        out(builder.mbbOut, "CAM:StreamEnable", "No", "Yes")
+        builder.longIn("CAM:StaleParameters_RBV", initial_value=0)
+        builder.longIn("CAM:BitDepthImage_RBV", initial_value=bit_depth)
+        out(builder.boolOut, "CAM:Acquire", "Done", "Acquire", on_update=self.on_acquire)
+        out(builder.boolOut, "CAM:Trigger", "Done", "Trigger", on_update=self.on_trigger)
+
+        # Odin
+        out(
+            builder.longStringOut,
+            "OD:FileName",
+            length=STRING_LENGTH,
+            on_update=self.on_file_name,
+        )
+        self.file_path = out(builder.longStringOut, "OD:FilePath", length=STRING_LENGTH)
+        self.meta_file_name = builder.longStringIn(
+            "OD:META:FileName_RBV", length=STRING_LENGTH
+        )
+        self.acquisition_id = builder.longStringIn(
+            "OD:AcquisitionID_RBV", length=STRING_LENGTH
+        )
+        self.num_capture = out(builder.longOut, "OD:NumCapture", initial_value=0)
+        out(builder.mbbOut, "OD:DataType", "UInt8", "UInt16", "UInt32")
+        out(builder.boolOut, "OD:Capture", "Done", "Capture", on_update=self.on_capture)
+        self.capture_rbv = builder.longIn("OD:Capture_RBV", initial_value=0)
+        self.meta_writing = builder.longIn("OD:META:Writing_RBV", initial_value=0)
+        self.fan_ready = builder.longIn("OD:FAN:StateReady_RBV", initial_value=0)
+        self.num_captured = builder.longIn("OD:NumCaptured_RBV", initial_value=0)
+        out(
+            builder.boolOut,
+            "OD:StartTimeout",
+            "Done",
+            "Timeout",
+            on_update=self.on_start_timeout,
+        )
+
+        # Frame processors never report errors
+        for fp in range(1, fp_count + 1):
+            out(builder.boolOut, f"OD{fp}:FPClearErrors", "Done", "Clear")
+            builder.longIn(f"OD{fp}:FPErrorState_RBV", initial_value=0)
+            builder.WaveformIn(
+                f"OD{fp}:FPErrorMessage_RBV", np.zeros(STRING_LENGTH, dtype=np.uint8)
+            )
+
+    def on_file_name(self, value):
+        self.meta_file_name.set(value)
+        self.acquisition_id.set(value)
+
+    def on_capture(self, value):
+        if value and self.capturing is None:
+            self.captured = 0
+            self.num_captured.set(0)
+            self.stop_capture.clear()
+            self.capturing = threading.Thread(
+                target=self.capture,
+                args=(
+                    self.file_path.get(),
+                    self.meta_file_name.get(),
+                    self.num_capture.get(),
+                ),
+                daemon=True,
+            )
+            self.capturing.start()
+        elif not value:
+            # The capture thread stops the writers and completes capture
+            self.stop_capture.set()
+
+    def on_start_timeout(self, value):
+        # Close the files of an acquisition that will not complete
+        if value:
+            self.on_capture(0)
+
+    def capture(self, path, name, frames):
+        """Start the writers and poll the frames captured until they stop writing"""
+        self.writers.start(path, name, frames)
+        cothread.Callback(self.start_capture)
+        while not self.stop_capture.wait(CAPTURE_UPDATE_SECONDS):
+            self.captured, writing = self.writers.status()
+            cothread.Callback(self.update_captured)
+            if not writing:
+                break
+        self.writers.stop()
+        self.captured, _ = self.writers.status()
+        logging.info(f"Captured {self.captured} / {frames} frames")
+        cothread.Callback(self.finish_capture)
+
+    def start_capture(self):
+        self.capture_rbv.set(1)
+        self.meta_writing.set(1)
+
+    def finish_capture(self):
+        self.capturing = None
+        self.num_captured.set(self.captured)
+        self.capture_rbv.set(0)
+        self.meta_writing.set(0)
+
+    def on_acquire(self, value):
+        if value and not self.armed:
+            self.armed = True
+            self.triggered = False
+            self.simulator.start_series(self.num_images.get(), self.acquire_period.get())
+            self.fan_ready.set(1)
+        elif not value and self.armed:
+            self.armed = False
+            if not self.triggered:
+                # Armed but never triggered
+                self.simulator.end_series()
+            self.fan_ready.set(0)
+
+    def on_trigger(self, value):
+        if not value or not self.armed or self.triggered:
+            return
+        self.triggered = True
+        self.streaming = threading.Thread(
+            target=self.stream,
+            args=(self.num_images.get(), 1 / self.acquire_period.get()),
+            daemon=True,
+        )
+        self.streaming.start()
+
+    def stream(self, frames, frame_rate):
+        """Send the frames of the series from a thread, as sends block on the consumer"""
+        start = monotonic()
+        sent = self.simulator.send_frames(frames, frame_rate, stopped=lambda: not self.armed)
+        self.simulator.end_series()
+        duration = monotonic() - start
+        logging.info(
+            f"Sent {sent} / {frames} frames at {sent / duration if duration else 0:.1f} Hz"
+        )
+        cothread.Callback(self.finish_stream)
+
+    def update_captured(self):
+        if self.capture_rbv.get():
+            self.num_captured.set(self.captured)
+
+    def finish_stream(self):
+        self.streaming = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the Eiger and odin PVs used by eiger_acquisition, streaming "
+        + "simulated images when triggered"
+    )
+    parser.add_argument(
+        "pv_stem", type=str, help="The Eiger PV stem to serve e.g. BL04I-EA-EIGER-01"
+    )
+    add_simulator_arguments(parser)
+    parser.add_argument(
+        "--fp-count", default=4, type=int, help="Number of frame processors"
+    )
+    parser.add_argument(
+        "--fp-endpoints",
+        default=None,
+        help="Comma separated <IP>:<Port> control endpoints of the frame processors to "
+        + "write and count captured frames with (default: the builder ports of --fp-count "
+        + "local processes)",
+    )
+    parser.add_argument(
+        "--sink",
+        action="store_true",
+        default=False,
+        help="Consume the stream internally instead of waiting for EigerFan to connect, "
+        + "counting the frames received as captured",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    simulator = EigerStreamSimulator(
+        args.endpoint, args.sensor, args.bit_depth, args.payload_size
+    )
+    if args.sink:
+        writers = StreamSink(args.endpoint)
+    elif args.fp_endpoints is not None:
+        writers = FrameProcessorWriters(args.fp_endpoints.split(","))
+    else:
+        writers = FrameProcessorWriters(
+            [
+                f"127.0.0.1:{FP_BASE_CTRL_PORT + FP_CTRL_PORT_STEP * fp}"
+                for fp in range(args.fp_count)
+            ]
+        )
+
+    builder.SetDeviceName(args.pv_stem)
+    EigerPVShim(simulator, writers, args.bit_depth, args.fp_count)
+    builder.LoadDatabase()
+    softioc.iocInit()
+
+    print(f"Serving {args.pv_stem} - streaming on {args.endpoint}")
+    cothread.WaitForQuit()
+
+
+if __name__ == "__main__":
+    main()
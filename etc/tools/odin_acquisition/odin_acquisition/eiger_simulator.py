@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+from time import monotonic, sleep, time_ns
+
+import zmq
+
+# Sensor shapes (x, y) by detector model
+EIGER_DIMENSIONS = {
+    "500K": (1028, 512),
+    "4M": (2068, 2162),
+    "9M": (3108, 3262),
+    "16M": (4148, 4362),
+}
+DATA_TYPES = {8: "uint8", 16: "uint16", 32: "uint32"}
+STREAM_ENDPOINT = "tcp://*:9999"
+
+# LZ4 requires the last 5 bytes of a block to be literals and the last match to start at
+# least 12 bytes before the end
+LZ4_LAST_LITERALS = 5
+LZ4_MIN_MATCH = 4
+LZ4_MATCH_START_MARGIN = 12
+
+
+def lz4_length_bytes(length):
+    """Return the extension bytes encoding length beyond a 4 bit token field"""
+    if length < 15:
+        return b""
+    return b"\xff" * ((length - 15) // 255) + bytes([(length - 15) % 255])
+
+
+def lz4_payload(size, payload_size):
+    """Return a valid LZ4 block of about payload_size bytes decompressing to size bytes
+
+    The block is random literals followed by a run of the last literal, so the compressed
+    size can be chosen independently of the frame size, down to about size / 255.
+    """
+    # The encoded lengths depend on the number of literals, so refine an estimate once
+    literals = payload_size
+    for _ in range(2):
+        match = size - literals - LZ4_LAST_LITERALS
+        overhead = (
+            len(lz4_length_bytes(literals))
+            + len(lz4_length_bytes(max(match - LZ4_MIN_MATCH, 0)))
+            + 1 + 2 + 1 + LZ4_LAST_LITERALS
+        )
+        literals = max(1, min(payload_size - overhead, size - LZ4_MATCH_START_MARGIN))
+    match = size - literals - LZ4_LAST_LITERALS
+
+    return b"".join(
+        [
+            # Literals, then a match at offset 1 repeating the last literal
+            bytes([min(literals, 15) << 4 | min(match - LZ4_MIN_MATCH, 15)]),
+            lz4_length_bytes(literals),
+            os.urandom(literals),
+            (1).to_bytes(2, "little"),
+            lz4_length_bytes(match - LZ4_MIN_MATCH),
+            # Final sequence of literals only
+            bytes([LZ4_LAST_LITERALS << 4]),
+            bytes(LZ4_LAST_LITERALS),
+        ]
+    )
+
+
+class EigerStreamSimulator:
+    """Stand-in for the stream interface of an Eiger detector
+
+    Sends series of global header, image and end messages on a ZMQ PUSH socket in the
+    format of the Eiger stream interface, for EigerFan to connect to in place of a
+    detector. As PUSH blocks when the consumer falls behind, the rate frames are sent
+    at is the rate the consumer can sustain, up to the frame rate requested.
+
+    Images are LZ4 compressed payloads of payload_size bytes, or uncompressed if
+    payload_size is 0. The content is random, so only the size is representative.
+    """
+
+    def __init__(
+        self, endpoint=STREAM_ENDPOINT, sensor="4M", bit_depth=16, payload_size=0
+    ):
+        self.width, self.height = EIGER_DIMENSIONS[sensor]
+        self.sensor = sensor
+        self.bit_depth = bit_depth
+        frame_bytes = self.width * self.height * bit_depth // 8
+        if payload_size:
+            self.payload = lz4_payload(frame_bytes, payload_size)
+            self.encoding = "lz4<"
+        else:
+            self.payload = bytes(frame_bytes)
+            self.encoding = "<"
+        self.payload_hash = hashlib.md5(self.payload).hexdigest()
+        self.series = 0
+
+        self.socket = zmq.Context.instance().socket(zmq.PUSH)
+        self.socket.bind(endpoint)
+
+    def detector_config(self, frames, frame_time):
+        return {
+            "description": f"Simulated Eiger {self.sensor}",
+            "detector_number": "SIMULATED",
+            "x_pixels_in_detector": self.width,
+            "y_pixels_in_detector": self.height,
+            "bit_depth_image": self.bit_depth,
+            "bit_depth_readout": self.bit_depth,
+            "count_time": frame_time,
+            "frame_time": frame_time,
+            "nimages": frames,
+            "ntrigger": 1,
+            "trigger_mode": "ints",
+            "compression": "lz4" if self.encoding != "<" else "none",
+        }
+
+    def start_series(self, frames, frame_time):
+        """Send the global header for a new series"""
+        self.series += 1
+        self.socket.send_multipart(
+            [
+                json.dumps(
+                    {"htype": "dheader-1.0", "series": self.series, "header_detail": "basic"}
+                ).encode(),
+                json.dumps(self.detector_config(frames, frame_time)).encode(),
+            ]
+        )
+        logging.debug(f"Started series {self.series}")
+
+    def send_frame(self, frame, start_time, frame_time_ns):
+        self.socket.send_multipart(
+            [
+                json.dumps(
+                    {
+                        "htype": "dimage-1.0",
+                        "series": self.series,
+                        "frame": frame,
+                        "hash": self.payload_hash,
+                    }
+                ).encode(),
+                json.dumps(
+                    {
+                        "htype": "dimage_d-1.0",
+                        "shape": [self.width, self.height],
+                        "type": DATA_TYPES[self.bit_depth],
+                        "encoding": self.encoding,
+                        "size": len(self.payload),
+                    }
+                ).encode(),
+                self.payload,
+                json.dumps(
+                    {
+                        "htype": "dconfig-1.0",
+                        "start_time": start_time,
+                        "stop_time": start_time + frame_time_ns,
+                        "real_time": frame_time_ns,
+                    }
+                ).encode(),
+            ],
+            copy=False,
+        )
+
+    def end_series(self):
+        self.socket.send_json({"htype": "dseries_end-1.0", "series": self.series})
+        logging.debug(f"Ended series {self.series}")
+
+    def send_frames(self, frames, frame_rate, stopped=None, on_frame=None):
+        """Send frames at up to frame_rate, for a series already started
+
+        Args:
+            frames: Number of frames to send
+            frame_rate: Maximum rate to send at (Hz)
+            stopped: Callable returning True if the series should stop early
+            on_frame: Callable taking the number of frames sent so far
+
+        Returns:
+            The number of frames sent
+
+        """
+        frame_time = 1 / frame_rate
+        frame_time_ns = int(frame_time * 1e9)
+        start = monotonic()
+        for frame in range(frames):
+            if stopped is not None and stopped():
+                return frame
+            # Pace against the start, so a consumer that catches up is not penalised
+            delay = start + frame * frame_time - monotonic()
+            if delay > 0:
+                sleep(delay)
+            self.send_frame(frame, time_ns(), frame_time_ns)
+            if on_frame is not None:
+                on_frame(frame + 1)
+        return frames
+
+    def run_series(self, frames, frame_rate):
+        """Send a complete series and return the achieved frame rate"""
+        self.start_series(frames, 1 / frame_rate)
+        start = monotonic()
+        self.send_frames(frames, frame_rate)
+        duration = monotonic() - start
+        self.end_series()
+        return frames / duration if duration else float("inf")
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+def add_simulator_arguments(parser):
+    parser.add_argument(
+        "--endpoint", default=STREAM_ENDPOINT, help="ZMQ endpoint to bind the stream to"
+    )
+    parser.add_argument(
+        "--sensor", default="4M", choices=list(EIGER_DIMENSIONS), help="Detector model"
+    )
+    parser.add_argument(
+        "--bit-depth", default=16, type=int, choices=list(DATA_TYPES), help="Bit depth"
+    )
+    parser.add_argument(
+        "--payload-size",
+        default=0,
+        type=int,
+        help="Size in bytes of each LZ4 compressed image (default: uncompressed)",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send series of simulated Eiger stream images, e.g. to EigerFan"
+    )
+    add_simulator_arguments(parser)
+    parser.add_argument("--frames", default=1000, type=int, help="Frames per series")
+    parser.add_argument("--frame-rate", default=100, type=float, help="Frame rate (Hz)")
+    parser.add_argument("--series", default=1, type=int, help="Number of series to send")
+    parser.add_argument(
+        "--delay", default=1, type=float, help="Delay (in seconds) between series"
+    )
+    args = parser.parse_args()
+
+    simulator = EigerStreamSimulator(
+        args.endpoint, args.sensor, args.bit_depth, args.payload_size
+    )
+    try:
+        for series in range(args.series):
+            if series:
+                sleep(args.delay)
+            rate = simulator.run_series(args.frames, args.frame_rate)
+            print(
+                f"Series {simulator.series}: {args.frames} frames at {rate:.1f} fps "
+                f"({rate * len(simulator.payload) / 1e6:.1f} MB/s)"
+            )
+    finally:
+        simulator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import json
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from typing import Dict, List
+
+import zmq
+
+# Microseconds a plugin took to process a frame, averaged by the plugin
+TIMING_PARAMETER = "mean_process"
+TIMEOUT_MS = 2000
+
+
+def request_status(context: zmq.Context, endpoint: str) -> dict:
+    """Request the status of a FrameProcessor from its control endpoint"""
+    socket = context.socket(zmq.DEALER)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(f"tcp://{endpoint}")
+    socket.send_json(
+        {
+            "msg_type": "cmd",
+            "id": 1,
+            "msg_val": "status",
+            "params": {},
+            "timestamp": datetime.now().isoformat(),
+        }
+    )
+    try:
+        if not socket.poll(TIMEOUT_MS):
+            raise TimeoutError(f"No status from FrameProcessor at {endpoint}")
+        return socket.recv_json()["params"]
+    finally:
+        socket.close()
+
+
+def plugin_times(status: dict) -> Dict[str, float]:
+    """Return {plugin: mean microseconds per frame} from a FrameProcessor status"""
+    times = {}
+    for name in status.get("plugins", {}).get("names", []):
+        timing = status.get(name, {}).get("timing", {})
+        if TIMING_PARAMETER in timing:
+            times[name] = float(timing[TIMING_PARAMETER])
+    return times
+
+
+def average(measurements: List[Dict[str, float]]) -> Dict[str, float]:
+    names = set(name for times in measurements for name in times)
+    return {
+        name: sum(times[name] for times in measurements if name in times)
+        / sum(1 for times in measurements if name in times)
+        for name in sorted(names)
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the time each FrameProcessor plugin takes per frame during an "
+        "acquisition, for the MEASURED file of an OdinPluginCosts builder entry"
+    )
+    parser.add_argument(
+        "endpoints", nargs="+", help="<IP>:<Port> of FrameProcessor control endpoints"
+    )
+    parser.add_argument(
+        "--frame-bytes",
+        required=True,
+        type=int,
+        help="Size of an uncompressed frame in the acquisition measured",
+    )
+    parser.add_argument("-o", "--output", default=None, help="File to write to")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    measurements = []
+    for endpoint in args.endpoints:
+        times = plugin_times(request_status(context, endpoint))
+        if not times:
+            print(f"No plugin timing from {endpoint}", file=sys.stderr)
+        measurements.append(times)
+    context.term()
+
+    measured = {"frame_bytes": args.frame_bytes, "plugins": average(measurements)}
+    for name, time in measured["plugins"].items():
+        print(f"{name}: {time:.1f} us/frame", file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(measured, f, indent=2)
+    else:
+        print(json.dumps(measured, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,3 +44,34 @@ else
   echo -e "\e[31m  Shared Memory: Shared memory usage percent not set\e[0m"
 fi
 
+
+# Check huge page configuration of shared memory - odin-data buffers are only backed by
+# huge pages if /dev/shm is mounted with huge=
+shm_huge="$(cat /proc/mounts | grep " /dev/shm " | grep -o 'huge=[a-z_]*' | cut -d= -f2)"
+if [[ -n "$shm_huge" && "$shm_huge" != "never" ]]; then
+  echo "  Huge Pages: /dev/shm mounted with huge="$shm_huge
+else
+  echo -e "\e[33m  Huge Pages: /dev/shm not mounted with huge pages (HUGE_PAGES buffers need huge=within_size)\e[0m"
+fi
+shmem_enabled="$(cat /sys/kernel/mm/transparent_hugepage/shmem_enabled 2>/dev/null)"
+echo "    Shared memory transparent huge pages:" $shmem_enabled
+if [[ "$shmem_enabled" == *"[deny]"* ]]; then
+  echo -e "\e[31m    Shared memory huge pages are denied\e[0m"
+fi
+
+# Memory and huge page reservations per NUMA node. Reserved hugetlbfs pages cannot hold
+# /dev/shm buffers, so they reduce the memory available to them
+for node_dir in /sys/devices/system/node/node[0-9]*; do
+  node="$(basename $node_dir)"
+  free_kb="$(grep MemFree $node_dir/meminfo | awk '{print $4}')"
+  shmem_huge_kb="$(grep ShmemHugePages $node_dir/meminfo | awk '{print $4}')"
+  echo "    $node: $((free_kb / 1024)) MB free, $((shmem_huge_kb / 1024)) MB of shared memory in huge pages"
+  for pool in $node_dir/hugepages/hugepages-*; do
+    size="$(basename $pool | cut -d- -f2)"
+    total="$(cat $pool/nr_hugepages)"
+    free="$(cat $pool/free_hugepages)"
+    if (( total > 0 )); then
+      echo -e "\e[33m      $size hugetlbfs pages reserved: $total ($free free) - unavailable to /dev/shm\e[0m"
+    fi
+  done
+done
@@ -0,0 +1,536 @@
+import json
+import os
+import random
+import re
+import selectors
+import socket
+import struct
+import sys
+import time
+from argparse import ArgumentParser
+from glob import glob
+from multiprocessing import Process, Queue
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_HOST = "127.0.0.1"
+PACKET_SIZE = 8000  # Bytes of data in a full packet
+# Frame (or subframe) counter, then packet number within the frame (or subframe) with
+# start / end of frame flags - the Excalibur packet trailer
+HEADER = struct.Struct("<QI")
+START_OF_FRAME = 1 << 31
+END_OF_FRAME = 1 << 30
+PACKET_NUMBER_MASK = 0x3FFFFFFF
+SEND_BUFFER_SIZE = 32 * 1024 * 1024
+PROC_SNMP = "/proc/net/snmp"
+
+# Bytes per pixel by counter bit depth, as the decoders unpack them
+BIT_DEPTH_BYTES = {"1-bit": 1 / 8, "6-bit": 1, "12-bit": 2, "24-bit": 4}
+EXCALIBUR_SUBFRAMES = {"1-bit": 2, "6-bit": 2, "12-bit": 2, "24-bit": 4}
+# Pixels read out by one FEM, from the builder dimensions
+FEM_PIXELS = {
+    "Excalibur": 2048 * 256,  # Half a 1M module
+    "Arc": 768 * 3072,  # ArcDimensions with six super modules
+}
+# Event mode detectors have no fixed frame size, so send blocks of full packets
+EVENT_PACKETS_PER_FRAME = {"LATRD": 16}
+# Decoders that append the header after the data of each packet
+TRAILER_DECODERS = ["Excalibur"]
+# Decoders whose packets the frameReceiver can decode - the others only the receive command
+FRAME_RECEIVER_DECODERS = ["Excalibur"]
+UDP_CONFIGS = ["udp_excalibur.json", "udp_tristan.json", "udp_arc.json"]
+
+
+class Receiver(NamedTuple):
+    """A frame receiver from its generated config"""
+
+    rank: int
+    ports: List[int]  # Indexed by FEM
+
+
+class PacketLayout(NamedTuple):
+    """The packets one FEM sends for each frame"""
+
+    sizes: List[int]  # Bytes of data in each packet
+    trailer: bool  # Header follows the data of each packet, rather than preceding it
+    subframe_packets: int
+
+    @property
+    def frame_bytes(self) -> int:
+        return sum(self.sizes)
+
+    @property
+    def subframes(self) -> int:
+        return len(self.sizes) // self.subframe_packets
+
+    def packet_count(self) -> int:
+        return len(self.sizes)
+
+
+def packet_layout(
+    decoder: str,
+    bit_depth: str,
+    packet_size: int = PACKET_SIZE,
+    packets_per_frame: Optional[int] = None,
+) -> PacketLayout:
+    """Return the layout of the packets for a frame from one FEM of a decoder
+
+    Image sizes are derived from the sensor geometry of each FEM and the bit depth. Packets
+    carry the counter and packet number of the Excalibur trailer, counting subframes and
+    numbering packets within each subframe as the frameReceiver decodes them. The LATRD and
+    Arc headers are not reproduced, so although their packet sizes, counts and rates match
+    the hardware, only the receive command counts their packets.
+    """
+    if packets_per_frame is not None:
+        sizes = [packet_size] * packets_per_frame
+        return PacketLayout(sizes, decoder in TRAILER_DECODERS, len(sizes))
+    if decoder in EVENT_PACKETS_PER_FRAME:
+        sizes = [packet_size] * EVENT_PACKETS_PER_FRAME[decoder]
+        return PacketLayout(sizes, False, len(sizes))
+    if decoder not in FEM_PIXELS:
+        raise ValueError(f"Decoder {decoder} does not receive UDP packets")
+
+    subframes = EXCALIBUR_SUBFRAMES[bit_depth] if decoder in TRAILER_DECODERS else 1
+    subframe_bytes = int(FEM_PIXELS[decoder] * BIT_DEPTH_BYTES[bit_depth]) // subframes
+    full, tail = divmod(subframe_bytes, packet_size)
+    subframe_sizes = [packet_size] * full + ([tail] if tail else [])
+    return PacketLayout(
+        subframe_sizes * subframes, decoder in TRAILER_DECODERS, len(subframe_sizes)
+    )
+
+
+def load_receivers(config_dir: str) -> Tuple[str, str, List[Receiver]]:
+    """Return the decoder, bit depth and receivers of the generated fr<rank>.json files"""
+    receivers = []
+    decoder = bit_depth = None
+    paths = glob(os.path.join(config_dir, "fr[0-9]*.json"))
+    for path in sorted(paths, key=lambda p: int(re.findall(r"\d+", os.path.basename(p))[0])):
+        with open(path) as f:
+            config = json.load(f)[0]
+        decoder = config["decoder_type"]
+        decoder_config = config.get("decoder_config", {})
+        bit_depth = decoder_config.get("bitdepth", "12-bit")
+
+        rx_ports = [int(port) for port in str(config["rx_ports"]).split(",")]
+        if "fem_port_map" in decoder_config:
+            fem_ports = {}
+            for mapping in decoder_config["fem_port_map"].split(","):
+                port, fem = mapping.split(":")
+                fem_ports[int(fem)] = int(port)
+            rx_ports = [fem_ports[fem] for fem in sorted(fem_ports)]
+
+        rank = int(re.findall(r"\d+", os.path.basename(path))[0]) - 1
+        receivers.append(Receiver(rank, rx_ports))
+
+    if not receivers:
+        raise ValueError(f"No frame receiver configs (fr<rank>.json) in {config_dir}")
+    return decoder, bit_depth, receivers
+
+
+def load_routes(config_dir: str, receivers: List[Receiver]) -> List[List[int]]:
+    """Return the destination ports of each FEM, which it sends frames to in turn
+
+    Routes come from the generated UDP config if there is one, or otherwise each FEM
+    sends to its port on every receiver in rank order.
+    """
+    udp_config = None
+    for name in UDP_CONFIGS:
+        path = os.path.join(config_dir, name)
+        if os.path.exists(path):
+            with open(path) as f:
+                udp_config = json.load(f)
+            break
+
+    if udp_config is None:
+        fems = max(len(receiver.ports) for receiver in receivers)
+        return [
+            [receiver.ports[fem] for receiver in receivers if fem < len(receiver.ports)]
+            for fem in range(fems)
+        ]
+
+    if "fems" in udp_config:
+        # Excalibur - FEMs share a list of nodes, or have one each, with a port offset
+        nodes = udp_config["nodes"]
+        return [
+            [
+                node["port"] + fem["dest_port_offset"]
+                for node in nodes.get(fem["name"], nodes.get("all_fems", []))
+            ]
+            for fem in udp_config["fems"]
+        ]
+
+    # Tristan and Arc - each module has its own round robin list of nodes
+    modules = udp_config.get("config", udp_config)
+    return [[node["port"] for node in modules[module]["nodes"]] for module in sorted(modules)]
+
+
+def check_routes(routes: List[List[int]], receivers: List[Receiver]):
+    rx_ports = {port for receiver in receivers for port in receiver.ports}
+    for fem, ports in enumerate(routes):
+        if not ports:
+            raise ValueError(f"FEM {fem} has no destinations")
+        unreceived = sorted(set(ports) - rx_ports)
+        if unreceived:
+            print(
+                f"WARNING: FEM {fem} sends to ports {unreceived} with no frame receiver",
+                file=sys.stderr,
+            )
+
+
+def udp_receive_errors() -> int:
+    """Return the datagrams dropped by this host as socket receive buffers were full"""
+    try:
+        with open(PROC_SNMP) as f:
+            lines = [line.split() for line in f if line.startswith("Udp:")]
+    except OSError:
+        return 0
+    fields = dict(zip(lines[0][1:], lines[1][1:]))
+    return int(fields.get("RcvbufErrors", 0))
+
+
+def process_cpu_ticks(name: str) -> Dict[int, int]:
+    """Return the user + system clock ticks of each running process called name"""
+    ticks = {}
+    for stat in glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat) as f:
+                content = f.read()
+        except OSError:
+            continue
+        comm = content[content.index("(") + 1:content.rindex(")")]
+        if comm == name[:15]:  # comm is truncated to 15 characters
+            fields = content[content.rindex(")") + 2:].split()
+            ticks[int(stat.split("/")[2])] = int(fields[11]) + int(fields[12])
+    return ticks
+
+
+def send_fem(
+    fem: int,
+    ports: List[int],
+    layout: PacketLayout,
+    args,
+    start: float,
+    results: Queue,
+):
+    """Send frames from one FEM, paced against a common start time"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+    rng = random.Random(args.seed + fem if args.seed is not None else None)
+    payload = os.urandom(max(layout.sizes))
+    # One reusable buffer per packet, so sending only updates the header
+    packets = []
+    for index, size in enumerate(layout.sizes):
+        # Packets are numbered, and frames start and end, within each subframe
+        subframe, number = divmod(index, layout.subframe_packets)
+        flags = (START_OF_FRAME if number == 0 else 0) | (
+            END_OF_FRAME if number == layout.subframe_packets - 1 else 0
+        )
+        if layout.trailer:
+            buffer, offset = bytearray(payload[:size]) + bytearray(HEADER.size), size
+        else:
+            buffer, offset = bytearray(HEADER.size) + payload[:size], 0
+        packets.append((buffer, offset, subframe, number | flags))
+
+    sent = dropped = reordered = late = 0
+    sent_bytes = 0
+    frame_time = 1 / args.frame_rate if args.frame_rate else 0
+    cpu = time.process_time()
+    for frame in range(args.frames):
+        delay = start + frame * frame_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif frame_time and delay < -frame_time:
+            late += 1
+
+        destination = (args.host, ports[frame % len(ports)])
+        order = list(range(len(packets)))
+        if args.reorder:
+            for index in range(len(order) - 1):
+                if rng.random() < args.reorder:
+                    order[index], order[index + 1] = order[index + 1], order[index]
+                    reordered += 1
+        for index in order:
+            if args.loss and rng.random() < args.loss:
+                dropped += 1
+                continue
+            buffer, offset, subframe, packet_number = packets[index]
+            counter = frame * layout.subframes + subframe
+            HEADER.pack_into(buffer, offset, counter, packet_number)
+            sock.sendto(buffer, destination)
+            sent += 1
+            sent_bytes += len(buffer)
+
+    results.put(
+        dict(
+            fem=fem,
+            packets=sent,
+            dropped=dropped,
+            reordered=reordered,
+            late_frames=late,
+            bytes=sent_bytes,
+            duration=time.monotonic() - start,
+            cpu=time.process_time() - cpu,
+        )
+    )
+
+
+def send(args) -> int:
+    decoder, bit_depth, receivers = load_receivers(args.config_dir)
+    layout = packet_layout(
+        decoder, args.bit_depth or bit_depth, args.packet_size, args.packets_per_frame
+    )
+    routes = load_routes(args.config_dir, receivers)
+    check_routes(routes, receivers)
+    if decoder not in FRAME_RECEIVER_DECODERS:
+        print(
+            f"WARNING: The frameReceiver cannot decode these {decoder} packets - receive "
+            "them with the receive command",
+            file=sys.stderr,
+        )
+
+    print(
+        f"{decoder} {args.bit_depth or bit_depth}: {len(routes)} FEMs -> "
+        f"{len(receivers)} receivers, {layout.packet_count()} packets "
+        f"({layout.frame_bytes / 1e6:.2f} MB) per FEM per frame"
+    )
+    for fem, ports in enumerate(routes):
+        print(f"  FEM {fem}: {args.host} ports {ports}")
+
+    receive_errors = udp_receive_errors()
+    cpu_ticks = process_cpu_ticks(args.watch) if args.watch else {}
+
+    results = Queue()
+    # Give every process time to start before the first frame is due
+    start = time.monotonic() + 0.5
+    senders = [
+        Process(target=send_fem, args=(fem, ports, layout, args, start, results))
+        for fem, ports in enumerate(routes)
+    ]
+    for sender in senders:
+        sender.start()
+    stats = sorted((results.get() for _ in senders), key=lambda s: s["fem"])
+    for sender in senders:
+        sender.join()
+    duration = max(s["duration"] for s in stats)
+
+    for s in stats:
+        print(
+            f"FEM {s['fem']}: sent {s['packets']} packets "
+            f"({s['bytes'] * 8 / s['duration'] / 1e9:.2f} Gb/s), dropped {s['dropped']}, "
+            f"reordered {s['reordered']}, {s['late_frames']} frames late, "
+            f"{s['cpu']:.2f}s CPU"
+        )
+    total_bytes = sum(s["bytes"] for s in stats)
+    print(
+        f"Sent {args.frames} frames in {duration:.2f}s ({args.frames / duration:.1f} fps, "
+        f"{total_bytes * 8 / duration / 1e9:.2f} Gb/s)"
+    )
+    print(f"UDP receive buffer errors: {udp_receive_errors() - receive_errors}")
+
+    if args.watch:
+        # Allow the receivers to finish with the last frames
+        time.sleep(1)
+        ticks_per_second = os.sysconf("SC_CLK_TCK")
+        after = process_cpu_ticks(args.watch)
+        for pid in sorted(after):
+            cpu = (after[pid] - cpu_ticks.get(pid, 0)) / ticks_per_second
+            print(f"{args.watch} {pid}: {cpu:.2f}s CPU ({cpu / duration:.0%} of a core)")
+        if not after:
+            print(f"WARNING: No {args.watch} processes running", file=sys.stderr)
+
+    return 0
+
+
+def expected_frames(port: int, routes: List[List[int]], last_frame: int) -> set:
+    """Return the frames up to last_frame that the routes send to port"""
+    frames = set()
+    for ports in routes:
+        for phase, destination in enumerate(ports):
+            if destination == port:
+                frames.update(range(phase, last_frame + 1, len(ports)))
+    return frames
+
+
+def receive_ports(
+    rank: int,
+    ports: List[int],
+    routes: List[List[int]],
+    layout: PacketLayout,
+    args,
+    results: Queue,
+):
+    """Count the packets of each frame arriving on the ports of one frame receiver
+
+    Frames are expected on each port as the routes send them, up to the last frame the
+    port received, so frames lost entirely are counted as well as incomplete frames.
+    """
+    selector = selectors.DefaultSelector()
+    for port in ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if args.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.rcvbuf)
+        sock.bind((args.host, port))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, port)
+
+    counts = {}  # (port, frame): packets
+    out_of_order = 0
+    last_packet = {}
+    buffer = bytearray(max(layout.sizes) + HEADER.size)
+    cpu = None
+    first = last = None
+    while True:
+        events = selector.select(args.idle if first is not None else None)
+        if not events:
+            break
+        if first is None:
+            first = time.monotonic()
+            cpu = time.process_time()
+        for key, _ in events:
+            while True:
+                try:
+                    size = key.fileobj.recv_into(buffer)
+                except BlockingIOError:
+                    break
+                offset = size - HEADER.size if layout.trailer else 0
+                counter, packet_number = HEADER.unpack_from(buffer, offset)
+                packet = (counter, packet_number & PACKET_NUMBER_MASK)
+                frame = counter // layout.subframes
+                if packet < last_packet.get(key.data, packet):
+                    out_of_order += 1
+                last_packet[key.data] = packet
+                counts[(key.data, frame)] = counts.get((key.data, frame), 0) + 1
+        last = time.monotonic()
+
+    missing = 0
+    for port in ports:
+        received = {frame for (frame_port, frame) in counts if frame_port == port}
+        if received:
+            missing += len(expected_frames(port, routes, max(received)) - received)
+
+    results.put(
+        dict(
+            rank=rank,
+            frames=len(counts),
+            missing=missing,
+            incomplete=sum(count != layout.packet_count() for count in counts.values()),
+            lost=(len(counts) + missing) * layout.packet_count() - sum(counts.values()),
+            out_of_order=out_of_order,
+            duration=(last - first) if first is not None else 0,
+            cpu=(time.process_time() - cpu) if cpu is not None else 0,
+        )
+    )
+
+
+def receive(args) -> int:
+    decoder, bit_depth, receivers = load_receivers(args.config_dir)
+    layout = packet_layout(
+        decoder, args.bit_depth or bit_depth, args.packet_size, args.packets_per_frame
+    )
+    routes = load_routes(args.config_dir, receivers)
+    print(
+        f"Receiving {decoder} on {len(receivers)} processes - "
+        f"stopping {args.idle}s after the last packet"
+    )
+
+    receive_errors = udp_receive_errors()
+    results = Queue()
+    processes = [
+        Process(
+            target=receive_ports,
+            args=(receiver.rank, receiver.ports, routes, layout, args, results),
+        )
+        for receiver in receivers
+    ]
+    for process in processes:
+        process.start()
+    stats = sorted((results.get() for _ in processes), key=lambda s: s["rank"])
+    for process in processes:
+        process.join()
+
+    for s in stats:
+        print(
+            f"Rank {s['rank']}: {s['frames']} FEM frames, {s['missing']} missing, "
+            f"{s['incomplete']} incomplete, "
+            f"{s['lost']} packets lost, {s['out_of_order']} out of order, "
+            f"{s['cpu']:.2f}s CPU in {s['duration']:.2f}s"
+        )
+    print(f"UDP receive buffer errors: {udp_receive_errors() - receive_errors}")
+
+    return 0
+
+
+def main():
+    parser = ArgumentParser(
+        description="Replay synthetic UDP frames to the frame receivers of a generated "
+        "Excalibur, Tristan or Arc config, to benchmark receive-side packet loss and CPU. "
+        "Packets carry the Excalibur packet numbering, so a frameReceiver can only decode "
+        "them for Excalibur - Tristan (LATRD) and Arc packets are only counted by the "
+        "receive command"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    send_parser = subparsers.add_parser(
+        "send", help="Send frames from each FEM to the receivers in the UDP config"
+    )
+    receive_parser = subparsers.add_parser(
+        "receive",
+        help="Stand in for the frame receivers, counting lost and out of order packets",
+    )
+    for subparser in [send_parser, receive_parser]:
+        subparser.add_argument(
+            "config_dir", help="Directory of the generated fr<rank>.json and udp_*.json"
+        )
+        subparser.add_argument(
+            "--host", default=DEFAULT_HOST, help="Address the receivers listen on"
+        )
+        subparser.add_argument(
+            "--bit-depth",
+            default=None,
+            choices=list(BIT_DEPTH_BYTES),
+            help="Counter bit depth (default: from the frame receiver config)",
+        )
+        subparser.add_argument(
+            "--packet-size", default=PACKET_SIZE, type=int, help="Bytes of data per packet"
+        )
+        subparser.add_argument(
+            "--packets-per-frame",
+            default=None,
+            type=int,
+            help="Packets per FEM per frame (default: from the sensor geometry)",
+        )
+
+    send_parser.add_argument("-n", "--frames", default=1000, type=int, help="Frames to send")
+    send_parser.add_argument(
+        "-r", "--frame-rate", default=100, type=float, help="Frame rate (Hz), 0 for unpaced"
+    )
+    send_parser.add_argument(
+        "--loss", default=0, type=float, help="Fraction of packets to deliberately drop"
+    )
+    send_parser.add_argument(
+        "--reorder",
+        default=0,
+        type=float,
+        help="Fraction of packets to swap with the next packet of the frame",
+    )
+    send_parser.add_argument("--seed", default=None, type=int, help="Random seed")
+    send_parser.add_argument(
+        "--watch",
+        default="frameReceiver",
+        help="Report the CPU used by processes of this name while sending ('' to disable)",
+    )
+    send_parser.set_defaults(function=send)
+
+    receive_parser.add_argument(
+        "--idle", default=2, type=float, help="Seconds without packets before stopping"
+    )
+    receive_parser.add_argument(
+        "--rcvbuf", default=0, type=int, help="Socket receive buffer size (bytes)"
+    )
+    receive_parser.set_defaults(function=receive)
+
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
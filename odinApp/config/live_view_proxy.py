@@ -0,0 +1,210 @@
+"""Merge the live view of every FrameProcessor into one endpoint
+
+Subscribes to the LiveViewPlugin socket of each process and keeps only the newest frame
+received from any of them, republishing it at no more than a capped rate. Receive queues
+are kept short, so frames are dropped by ZeroMQ rather than queued when the proxy falls
+behind. Statistics of each process are served as JSON to any request on a status socket.
+
+Each frame is forwarded unchanged, as the header and data parts the LiveViewPlugin sent.
+"""
+
+import json
+import logging
+import sys
+import time
+from argparse import ArgumentParser
+from typing import List, Optional
+
+import zmq
+
+# Messages a subscriber or the publisher will queue before dropping frames
+DEFAULT_HWM = 2
+
+
+class RankStatistics:
+    def __init__(self, rank: int, endpoint: str):
+        self.rank = rank
+        self.endpoint = endpoint
+        self.received = 0
+        self.published = 0
+        # Frames not sent because a client of the proxy was not keeping up
+        self.dropped = 0
+        # Frames replaced by a newer frame before they were published
+        self.conflated = 0
+        self.last_frame: Optional[int] = None
+        self.last_received: Optional[float] = None
+
+    def as_dict(self, now: float) -> dict:
+        return {
+            "rank": self.rank,
+            "endpoint": self.endpoint,
+            "received": self.received,
+            "published": self.published,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+            "last_frame": self.last_frame,
+            "seconds_since_frame": (
+                None if self.last_received is None else round(now - self.last_received, 3)
+            ),
+        }
+
+
+def frame_number(header) -> Optional[int]:
+    try:
+        return int(json.loads(header.bytes)["frame_num"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class LiveViewProxy:
+    def __init__(
+        self,
+        subscribe: List[str],
+        publish: str,
+        status: Optional[str],
+        rate: float,
+        hwm: int = DEFAULT_HWM,
+    ):
+        self.context = zmq.Context()
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.ranks = [RankStatistics(rank, endpoint) for rank, endpoint in enumerate(subscribe)]
+        self.poller = zmq.Poller()
+
+        self.subscribers = {}
+        for statistics in self.ranks:
+            socket = self.context.socket(zmq.SUB)
+            socket.setsockopt(zmq.RCVHWM, hwm)
+            socket.setsockopt(zmq.SUBSCRIBE, b"")
+            socket.connect(statistics.endpoint)
+            self.subscribers[socket] = statistics
+            self.poller.register(socket, zmq.POLLIN)
+
+        # XPUB rather than PUB, so sends fail rather than silently dropping frames when a
+        # client's queue is full, and the dropped frames can be counted
+        self.publisher = self.context.socket(zmq.XPUB)
+        self.publisher.setsockopt(zmq.SNDHWM, hwm)
+        self.publisher.setsockopt(zmq.XPUB_NODROP, 1)
+        self.publisher.bind(publish)
+        self.poller.register(self.publisher, zmq.POLLIN)
+
+        self.status = None
+        if status is not None:
+            self.status = self.context.socket(zmq.REP)
+            self.status.bind(status)
+            self.poller.register(self.status, zmq.POLLIN)
+
+        self.started = time.time()
+        self.published = 0
+        self.dropped = 0
+        self.pending = None
+        self.pending_rank: Optional[RankStatistics] = None
+        self.last_published = 0.0
+
+    def receive(self, socket):
+        """Take every frame queued on a subscriber, keeping the newest"""
+        statistics = self.subscribers[socket]
+        while True:
+            try:
+                parts = socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            statistics.received += 1
+            statistics.last_received = time.time()
+            statistics.last_frame = frame_number(parts[0])
+            if self.pending_rank is not None:
+                self.pending_rank.conflated += 1
+            self.pending = parts
+            self.pending_rank = statistics
+
+    def publish(self):
+        try:
+            self.publisher.send_multipart(self.pending, zmq.NOBLOCK, copy=False)
+        except zmq.Again:
+            # A client's queue is full
+            self.pending_rank.dropped += 1
+            self.dropped += 1
+        else:
+            self.pending_rank.published += 1
+            self.published += 1
+        self.pending = None
+        self.pending_rank = None
+        self.last_published = time.time()
+
+    def statistics(self) -> dict:
+        now = time.time()
+        return {
+            "uptime": round(now - self.started, 3),
+            "published": self.published,
+            "dropped": self.dropped,
+            "ranks": [statistics.as_dict(now) for statistics in self.ranks],
+        }
+
+    def run(self):
+        while True:
+            timeout = 1000
+            if self.pending is not None:
+                wait = self.last_published + self.interval - time.time()
+                timeout = max(0, int(wait * 1000))
+
+            for socket, _ in self.poller.poll(timeout):
+                if socket is self.status:
+                    self.status.recv()
+                    self.status.send_json(self.statistics())
+                elif socket is self.publisher:
+                    # Discard the subscription messages of clients
+                    self.publisher.recv()
+                else:
+                    self.receive(socket)
+
+            if (
+                self.pending is not None
+                and time.time() - self.last_published >= self.interval
+            ):
+                self.publish()
+
+
+def main():
+    parser = ArgumentParser(
+        description="Merge the live view of FrameProcessors, republishing the newest frame "
+        "at a capped rate"
+    )
+    parser.add_argument(
+        "--subscribe",
+        required=True,
+        help="Comma separated LiveViewPlugin endpoints, in rank order",
+    )
+    parser.add_argument("--publish", required=True, help="Endpoint to publish frames on")
+    parser.add_argument(
+        "--status", default=None, help="Endpoint to serve statistics on, as JSON"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=10, help="Maximum frames per second (0 -> no limit)"
+    )
+    parser.add_argument(
+        "--hwm",
+        type=int,
+        default=DEFAULT_HWM,
+        help="Frames queued for each subscription before dropping",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    subscribe = [endpoint for endpoint in args.subscribe.split(",") if endpoint]
+    proxy = LiveViewProxy(subscribe, args.publish, args.status, args.rate, args.hwm)
+    logging.info(
+        "Merging %d live views onto %s at up to %s Hz",
+        len(subscribe),
+        args.publish,
+        args.rate or "unlimited",
+    )
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        pass
+    logging.info("Stopped: %s", json.dumps(proxy.statistics()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/bin/bash
+# Check, or set up, huge pages for the odin-data shared memory buffers
+#
+# odin-data creates its buffers with shm_open, so they always live in the /dev/shm tmpfs
+# (hugetlbfs mounts cannot be used). They are backed by 2 MB transparent huge pages when
+# /dev/shm is mounted with huge= and shmem transparent huge pages are not denied.
+#
+# Installed as data without execute permission, so run with bash.
+#
+# Usage:
+#   bash shm_hugepages.sh check <buffer bytes> [numa node]
+#   bash shm_hugepages.sh setup    - as root, remount /dev/shm with huge=within_size
+
+SHMEM_ENABLED=/sys/kernel/mm/transparent_hugepage/shmem_enabled
+
+shm_huge_option() {
+  grep " /dev/shm " /proc/mounts | grep -o "huge=[a-z_]*" | cut -d= -f2
+}
+
+check() {
+  buffer_bytes=$1
+  node=$2
+
+  huge="$(shm_huge_option)"
+  if [[ -z "$huge" || "$huge" == "never" || "$huge" == "deny" ]]; then
+    echo "/dev/shm is not mounted with huge pages - run bash $0 setup as root" >&2
+    return 1
+  fi
+  if grep -q "\[deny\]" $SHMEM_ENABLED 2>/dev/null; then
+    echo "Shared memory huge pages are denied in $SHMEM_ENABLED" >&2
+    return 1
+  fi
+
+  if [[ -n "$node" ]]; then
+    meminfo=/sys/devices/system/node/node$node/meminfo
+    free_kb="$(grep MemFree $meminfo | awk '{print $4}')"
+    location="NUMA node $node"
+  else
+    free_kb="$(grep MemFree /proc/meminfo | awk '{print $2}')"
+    location="this host"
+  fi
+  # A buffer left by a previous run is reused, so this is only a warning
+  if (( free_kb * 1024 < buffer_bytes )); then
+    echo "WARNING: $buffer_bytes byte buffer may not fit in the $((free_kb * 1024)) bytes" \
+         "free on $location" >&2
+  fi
+  return 0
+}
+
+setup() {
+  mount -o remount,huge=within_size /dev/shm || return 1
+  if grep -q "\[deny\]" $SHMEM_ENABLED 2>/dev/null; then
+    echo within_size > $SHMEM_ENABLED || return 1
+  fi
+  echo "/dev/shm mounted with huge=$(shm_huge_option)"
+  echo "Add huge=within_size to the /dev/shm options in /etc/fstab to keep this on reboot"
+}
+
+case "$1" in
+  check)
+    check "$2" "$3"
+    ;;
+  setup)
+    setup
+    ;;
+  *)
+    echo "Usage: bash $0 check <buffer bytes> [numa node] | setup" >&2
+    exit 2
+    ;;
+esac